@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,10 +45,12 @@ INSTALLED_APPS = [
     'djoser',
     'rest_framework_simplejwt',
 
-    'atm.apps.atmdrfConfig'
+    'atmdrf.apps.AtmdrfConfig'
 ]
 
 MIDDLEWARE = [
+    'atmdrf.metrics.metrics_middleware',
+    'atmdrf.database.replica_reads_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,11 +84,62 @@ WSGI_APPLICATION = 'atm.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Профиль БД задается окружением: ATM_DB_ENGINE (sqlite3 или postgresql),
+# ATM_DB_NAME, ATM_DB_HOST, ATM_DB_PORT, ATM_DB_USER, ATM_DB_PASSWORD,
+# ATM_DB_CONN_MAX_AGE. Реплика для чтения - те же переменные с префиксом
+# ATM_DB_REPLICA_; без них все запросы идут в default.
+
+def env_database(prefix, default_name=None):
+    engine = os.environ.get(f'{prefix}_ENGINE', 'sqlite3')
+    name = os.environ.get(f'{prefix}_NAME', default_name)
+    if name is None:
+        return None
+    database = {
+        'ENGINE': f'django.db.backends.{engine}',
+        'NAME': name,
+        'CONN_MAX_AGE': int(os.environ.get(f'{prefix}_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
+    if engine == 'sqlite3':
+        database['OPTIONS'] = {'timeout': 20}
+    else:
+        database.update({
+            'HOST': os.environ.get(f'{prefix}_HOST', 'localhost'),
+            'PORT': os.environ.get(f'{prefix}_PORT', ''),
+            'USER': os.environ.get(f'{prefix}_USER', ''),
+            'PASSWORD': os.environ.get(f'{prefix}_PASSWORD', ''),
+        })
+    return database
+
+
+DATABASES = {
+    'default': env_database('ATM_DB', BASE_DIR / 'db.sqlite3'),
+}
+
+_replica = env_database('ATM_DB_REPLICA')
+if _replica is not None:
+    _replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES['replica'] = _replica
+
+DATABASE_ROUTERS = ['atmdrf.database.ReplicaRouter']
+
+DATABASE_ROUTING = {
+    'REPLICA_ALIAS': 'replica',
+    'REPLICA_PATHS': (
+        r'/log/$',
+        r'/log/statement/$',
+        r'/currency-rate/$',
+        r'/wallet/balance/$',
+    ),
+}
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
 }
 
 
@@ -108,6 +162,23 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+PASSWORD_HASHERS = [
+    'atmdrf.hashers.PinPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+PIN_AUTH = {
+    'HASHER_ITERATIONS': 100000,
+    'SESSION_TTL': 5 * 60,
+    'VERIFY_CACHE_TTL': 5 * 60,
+    'CACHE_ALIAS': 'default',
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
@@ -130,19 +201,94 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# production: без BrowsableAPIRenderer, только JSON.
+ATM_PROFILE = os.environ.get('ATM_PROFILE', 'development')
+
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'atmdrf.renderers.FastJSONRenderer',
+    ] + ([] if ATM_PROFILE == 'production' else [
         'rest_framework.renderers.BrowsableAPIRenderer',
-    ],
+    ]),
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'atmdrf.authentication.ClaimsJWTAuthentication',
+        'atmdrf.authentication.TerminalSessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'atmdrf.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+ATM_SHARDS = 8
+
+BALANCE_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 5 * 60,
+}
+
+BALANCE_SNAPSHOTS = {
+    'BATCH_SIZE': 5000,
+    'SETTLE_SECONDS': 60,
+}
+
+METRICS = {
+    'SLOW_REQUEST_SECONDS': 0.5,
+    'SLOW_SAMPLE_RATE': 0.1,
+    'ALLOWED_IPS': (),
+    'TOKEN': os.environ.get('ATM_METRICS_TOKEN'),
+}
+
+TRANSACTION_ARCHIVE = {
+    'ROOT': BASE_DIR / 'archive',
+    'HORIZON_DAYS': 365,
+}
+
+RECONCILIATION = {
+    'CHUNK_SIZE': 200000,
+    'MAX_REPORTED': 1000,
+}
+
+LEDGER_OUTBOX = {
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 0.5,
+    'GAP_TIMEOUT': 10,
+    'GAP_HORIZON': 60 * 60,
+}
+
+IDEMPOTENCY = {
+    'HEADER': 'Idempotency-Key',
+    'TTL': 24 * 60 * 60,
+}
+
+CURRENCY_RATES = {
+    'SOURCE': 'atmdrf.rates.PrivatBankRateSource',
+    'OPTIONS': {'timeout': 5},
+    'TTL': 60,
+    'STALE_TTL': 60 * 60,
+}
+
+NUMBER_ALLOCATOR = {
+    'BLOCK_SIZE': 1000,
+    'CARD_BIN': '4149',
+    'IBAN_COUNTRY': 'UA',
+    'IBAN_BANK_CODE': '300000',
+}
+
+TRANSACTION_JOURNAL = {
+    'ASYNC': False,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'WAL_PATH': BASE_DIR / 'journal.wal',
+    'SEGMENT_SIZE': 16 * 1024 * 1024,
+    'ROLLBACK_TIMEOUT': 600,
+}
+
 CORS_ALLOW_ALL_ORIGINS = False
 
 CORS_ALLOWED_ORIGINS = [
@@ -180,3 +326,9 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=5),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
+
+JWT_CLAIMS = {
+    'VERSION_CACHE_SIZE': 4096,
+    'VERSION_TTL': 30,
+    'CACHE_ALIAS': 'default',
+}
@@ -1,12 +1,14 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
+
+from atmdrf.views import ClaimsTokenObtainPairView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('rest_framework.urls')),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
-    path('api/v1/token/', TokenObtainPairView.as_view(),
+    path('api/v1/token/', ClaimsTokenObtainPairView.as_view(),
          name='token_obtain_pair'),
     path('api/v1/token/refresh/', TokenRefreshView.as_view(),
          name='token_refresh'),
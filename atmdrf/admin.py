@@ -3,5 +3,10 @@ from .models import *
 
 admin.site.register(User)
 admin.site.register(ATM)
+admin.site.register(ATMShard)
 admin.site.register(Transaction)
 admin.site.register(Card)
+admin.site.register(DailyBalanceSnapshot)
+admin.site.register(LedgerEvent)
+admin.site.register(ArchiveSegment)
+admin.site.register(RateSnapshot)
@@ -0,0 +1,163 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import NumberSequence
+
+DEFAULTS = {
+    'BLOCK_SIZE': 1000,
+    'CARD_BIN': '4149',
+    'IBAN_COUNTRY': 'UA',
+    'IBAN_BANK_CODE': '300000',
+}
+
+
+def allocator_settings():
+    return {**DEFAULTS, **getattr(settings, 'NUMBER_ALLOCATOR', {})}
+
+
+def luhn_check_digit(digits):
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        digit = int(digit)
+        if position % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return str((10 - total % 10) % 10)
+
+
+def is_valid_card_number(number):
+    return number.isdigit() and luhn_check_digit(number[:-1]) == number[-1]
+
+
+def _iban_number(text):
+    return int(''.join(str(int(char, 36)) for char in text))
+
+
+def iban_check_digits(country, bban):
+    return f'{98 - _iban_number(bban + country + "00") % 97:02d}'
+
+
+def is_valid_iban(iban):
+    return _iban_number(iban[4:] + iban[:4]) % 97 == 1
+
+
+class HiLoSequence:
+    """
+    Hi-lo последовательность: процесс резервирует в таблице
+    NumberSequence блок из block_size номеров одним UPDATE и дальше
+    раздает их из памяти, не обращаясь к БД.
+
+    Внутри внешней транзакции блок резервируется на отдельном
+    соединении в автокоммите: строка NumberSequence не остается
+    заблокированной до коммита внешней транзакции, а откат внешней
+    транзакции не возвращает счетчик, так что блок можно держать в
+    памяти (номера откаченных операций просто пропадают). В SQLite один
+    писатель, и внешняя транзакция уже держит блокировку всей БД, поэтому
+    там номера берутся из БД ровно в нужном количестве в той же
+    транзакции и откатываются вместе с ней.
+    """
+
+    def __init__(self, name, block_size=None):
+        self.name = name
+        self.block_size = block_size
+        self._next = 0
+        self._limit = 0
+        self._lock = threading.Lock()
+
+    def take(self, count=1):
+        numbers = []
+        with self._lock:
+            end = min(self._limit, self._next + count)
+            numbers.extend(range(self._next, end))
+            self._next = end
+            wanted = count - len(numbers)
+            if not wanted:
+                return numbers
+            reserve = self._reserve
+            current = transaction.get_connection()
+            if current.in_atomic_block:
+                if current.vendor == 'sqlite':
+                    start = self._advance(wanted)
+                    return numbers + list(range(start, start + wanted))
+                reserve = self._reserve_elsewhere
+            size = max(self.block_size or allocator_settings()['BLOCK_SIZE'],
+                       wanted)
+            start = reserve(size)
+            numbers.extend(range(start, start + wanted))
+            self._next, self._limit = start + wanted, start + size
+        return numbers
+
+    def _reserve(self, size):
+        with transaction.atomic():
+            return self._advance(size)
+
+    def _reserve_elsewhere(self, size):
+        # У другого потока свое соединение с БД, вне транзакции вызывающего.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(self._reserve_in_thread, size).result()
+
+    def _reserve_in_thread(self, size):
+        try:
+            return self._reserve(size)
+        finally:
+            connection.close()
+
+    def _advance(self, size):
+        """
+        Сдвигает счетчик на size и возвращает начало занятого диапазона.
+        """
+        sequences = NumberSequence.objects.filter(name=self.name)
+        if not sequences.update(next_value=F('next_value') + size):
+            NumberSequence.objects.get_or_create(name=self.name)
+            sequences.update(next_value=F('next_value') + size)
+        return sequences.values_list('next_value', flat=True).get() - size
+
+
+card_sequence = HiLoSequence('card_number')
+iban_sequence = HiLoSequence('iban')
+
+
+def _check_width(number, width, what):
+    if not 0 <= number < 10 ** width:
+        raise ValueError(f'{what}: номер {number} не вміщується в '
+                         f'{width} цифр')
+
+
+def format_card_number(number, bin_=None):
+    bin_ = bin_ or allocator_settings()['CARD_BIN']
+    width = 15 - len(bin_)
+    _check_width(number, width, 'Номер картки')
+    partial = f'{bin_}{number:0{width}d}'
+    return partial + luhn_check_digit(partial)
+
+
+def format_iban(number, country=None, bank_code=None):
+    config = allocator_settings()
+    country = country or config['IBAN_COUNTRY']
+    bank_code = bank_code or config['IBAN_BANK_CODE']
+    _check_width(number, 19, 'IBAN')
+    bban = f'{bank_code}{number:019d}'
+    return f'{country}{iban_check_digits(country, bban)}{bban}'
+
+
+def allocate_card_numbers(count):
+    return [format_card_number(number)
+            for number in card_sequence.take(count)]
+
+
+def allocate_ibans(count):
+    return [format_iban(number) for number in iban_sequence.take(count)]
+
+
+def allocate_card_number():
+    return allocate_card_numbers(1)[0]
+
+
+def allocate_iban():
+    return allocate_ibans(1)[0]
@@ -0,0 +1,321 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import groupby
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from .models import ArchiveIndex, ArchiveSegment, Card, Transaction
+from .snapshots import start_of_day, watermark
+
+DEFAULTS = {
+    'ROOT': 'archive',
+    'HORIZON_DAYS': 365,
+    'CHUNK_SIZE': 5000,
+    'COMPRESS_LEVEL': 6,
+    'BOUNDARY_TTL': 60,
+}
+
+# Порядок полей в строке сегмента.
+FIELDS = ('id', 'date', 'type_transaction', 'sender', 'receiver', 'value',
+          'card_id', 'rate_snapshot_id', 'user_id')
+
+_boundary = {'value': None, 'expires': 0.0}
+
+
+def archive_settings():
+    return {**DEFAULTS, **getattr(settings, 'TRANSACTION_ARCHIVE', {})}
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def horizon(horizon_days=None):
+    """
+    Начало месяца, до которого транзакции уходят в архив: архивируются
+    только целые месяцы старше HORIZON_DAYS.
+    """
+    horizon_days = archive_settings()['HORIZON_DAYS'] \
+        if horizon_days is None else horizon_days
+    day = timezone.localdate() - timedelta(days=horizon_days)
+    return start_of_day(day.replace(day=1))
+
+
+def pending_months(horizon_days=None):
+    limit = horizon(horizon_days)
+    oldest = Transaction.objects.filter(date__lt=limit).aggregate(
+        date=Min('date'))['date']
+    if oldest is None:
+        return []
+    months = []
+    month = timezone.localtime(oldest).date().replace(day=1)
+    while start_of_day(month) < limit:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def encode_row(row):
+    values = list(row)
+    values[1] = values[1].isoformat()
+    return json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+
+
+def archive_month(month, chunk_size=None):
+    """
+    Переносит транзакции месяца month в новый сегмент: файл из
+    gzip-member'ов по одному на пользователя (строки в порядке -date,
+    -id) и индекс (пользователь, смещение, длина). Берутся только записи,
+    уже свернутые в дневные снимки, чтобы balance_as_of не изменился.
+    Удаление из горячей таблицы идет в одной транзакции с индексом.
+    """
+    config = archive_settings()
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+    root = Path(config['ROOT'])
+    root.mkdir(parents=True, exist_ok=True)
+    queryset = Transaction.objects.filter(
+        date__gte=start_of_day(month),
+        date__lt=start_of_day(next_month(month)),
+        id__lte=watermark()
+    )
+    rows = queryset.order_by('user_id', '-date', '-id').values_list(*FIELDS)
+    fd, path = tempfile.mkstemp(dir=root, prefix=f'{month:%Y-%m}-',
+                                suffix='.gz')
+    entries, total = [], 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for user_id, group in groupby(
+                    rows.iterator(chunk_size=chunk_size),
+                    key=lambda row: row[-1]):
+                group = list(group)
+                data = ''.join(encode_row(row[:-1]) + '\n' for row in group)
+                member = gzip.compress(data.encode(),
+                                       config['COMPRESS_LEVEL'])
+                entries.append(ArchiveIndex(
+                    user_id=user_id, offset=out.tell(), length=len(member),
+                    rows=len(group), first_date=group[-1][1],
+                    last_date=group[0][1]))
+                out.write(member)
+                total += len(group)
+            out.flush()
+            os.fsync(out.fileno())
+        if not total:
+            os.unlink(path)
+            return 0
+        with transaction.atomic():
+            segment = ArchiveSegment.objects.create(
+                month=month, path=os.path.basename(path), rows=total)
+            for entry in entries:
+                entry.segment = segment
+            ArchiveIndex.objects.bulk_create(entries, batch_size=chunk_size)
+            deleted = queryset.delete()[0]
+            if deleted != total:
+                raise RuntimeError(
+                    f'Архів {month:%Y-%m}: записано {total}, '
+                    f'видалено {deleted}')
+    except BaseException:
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+    transaction.on_commit(lambda: archive_boundary(refresh=True))
+    return total
+
+
+def archive_boundary(refresh=False):
+    """
+    Конец последнего заархивированного месяца: транзакции новее него
+    лежат только в горячей таблице. Значение кешируется в процессе на
+    BOUNDARY_TTL секунд: пока кеш говорит, что архива нет, история не
+    обращается к архиву вовсе, так что записи, заархивированные другим
+    процессом, появляются в ней не позже чем через BOUNDARY_TTL.
+    """
+    if refresh or time.monotonic() >= _boundary['expires']:
+        month = ArchiveSegment.objects.aggregate(
+            month=Max('month'))['month']
+        _boundary['value'] = start_of_day(next_month(month)) \
+            if month else None
+        _boundary['expires'] = time.monotonic() + \
+            archive_settings()['BOUNDARY_TTL']
+    return _boundary['value']
+
+
+def archive_needed(rows, limit, boundary):
+    """
+    Архив нужен, только если он есть и страница горячей таблицы
+    неполная или заходит за границу архива (запись, добавленная задним
+    числом).
+    """
+    if not boundary:
+        return False
+    if len(rows) < limit:
+        return True
+    return rows[-1]['date'] < boundary
+
+
+def known_boundary():
+    """
+    Граница из кеша процесса без обращения к БД; None, если устарела.
+    """
+    if time.monotonic() >= _boundary['expires']:
+        return None
+    return _boundary['value'] or False
+
+
+@lru_cache(maxsize=256)
+def read_member(path, offset, length):
+    return decode_member(path, offset, length)
+
+
+def decode_member(path, offset, length):
+    with open(path, 'rb') as segment:
+        segment.seek(offset)
+        data = gzip.decompress(segment.read(length))
+    rows = []
+    for line in data.decode().splitlines():
+        values = json.loads(line)
+        values[1] = datetime.fromisoformat(values[1])
+        rows.append(tuple(values))
+    return tuple(rows)
+
+
+def index_entries(user_id, cursor=None, date_from=None, date_to=None):
+    """
+    Записи индекса (месяц, файл, смещение, длина) gzip-member'ов
+    пользователя, которые могут содержать строки из заданного периода.
+    """
+    entries = ArchiveIndex.objects.filter(user_id=user_id)
+    if cursor is not None:
+        entries = entries.filter(first_date__lte=cursor[0])
+    if date_from is not None:
+        entries = entries.filter(last_date__gte=date_from)
+    if date_to is not None:
+        entries = entries.filter(first_date__lte=date_to)
+    return entries.values_list('segment__month', 'segment__path', 'offset',
+                               'length')
+
+
+def row_matches(row, type_transaction=None, date_from=None, date_to=None):
+    if type_transaction and row[2] != type_transaction:
+        return False
+    if date_from is not None and row[1] < date_from:
+        return False
+    return date_to is None or row[1] <= date_to
+
+
+def archived_rows(user_id, limit, cursor=None, type_transaction=None,
+                  date_from=None, date_to=None):
+    """
+    Транзакции пользователя из архива (словари, как у .values()) в
+    порядке (-date, -id), строго после cursor (date, id). Сегменты
+    читаются от новых месяцев к старым, пока не набрано limit строк
+    (None - все).
+    """
+    root = Path(archive_settings()['ROOT'])
+    entries = index_entries(user_id, cursor, date_from, date_to) \
+        .order_by('-segment__month')
+    found = []
+    for month, members in groupby(entries.iterator(),
+                                  key=lambda entry: entry[0]):
+        if limit is not None and len(found) >= limit:
+            break
+        for _, name, offset, length in members:
+            for row in read_member(str(root / name), offset, length):
+                if cursor is not None and (row[1], row[0]) >= cursor:
+                    continue
+                if row_matches(row, type_transaction, date_from, date_to):
+                    found.append(row)
+    found.sort(key=lambda row: (row[1], row[0]), reverse=True)
+    # В сегментах до появления снимков курсов нет rate_snapshot_id.
+    return [{'rate_snapshot_id': None, **dict(zip(FIELDS, row)),
+             'user_id': user_id}
+            for row in found[:limit]]
+
+
+def card_rows(card_number, date_from, date_to):
+    """
+    Пары (тип, сумма) архивных записей карты за [date_from, date_to].
+    """
+    user_id = Card.objects.filter(pk=card_number).values_list(
+        'user_id', flat=True).first()
+    if user_id is None:
+        return []
+    return [(row['type_transaction'], row['value'])
+            for row in archived_rows(user_id, None, date_from=date_from,
+                                     date_to=date_to)
+            if row['card_id'] == card_number]
+
+
+class ArchivedHistory:
+    """
+    История пользователя для постраничного режима (?page=) вместе с
+    архивом, как последовательность для Paginator. Горячие записи новее
+    границы архива идут первыми и режутся OFFSET'ом; хвост (архив и
+    горячие записи старше границы) читается, только когда страница или
+    count до него доходят.
+    """
+
+    def __init__(self, queryset, boundary, user_id, **filters):
+        queryset = queryset.order_by('-date', '-id')
+        self.recent = queryset.filter(date__gte=boundary)
+        self.older = queryset.filter(date__lt=boundary)
+        self.user_id = user_id
+        self.filters = filters
+        self._recent_count = None
+        self._tail = None
+
+    def recent_count(self):
+        if self._recent_count is None:
+            self._recent_count = self.recent.count()
+        return self._recent_count
+
+    def tail(self):
+        if self._tail is None:
+            rows = list(self.older) + archived_rows(self.user_id, None,
+                                                    **self.filters)
+            rows.sort(key=lambda row: (row['date'], row['id']),
+                      reverse=True)
+            self._tail = rows
+        return self._tail
+
+    def count(self):
+        if self._tail is None and not any(self.filters.values()):
+            # Без фильтров число архивных строк есть в индексе.
+            archived = ArchiveIndex.objects.filter(
+                user_id=self.user_id).aggregate(rows=Sum('rows'))['rows']
+            return self.recent_count() + self.older.count() + \
+                (archived or 0)
+        return self.recent_count() + len(self.tail())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        start, stop = index.start or 0, index.stop
+        recent = self.recent_count()
+        rows = []
+        if start < recent:
+            rows = list(self.recent[start:min(stop, recent)])
+        if stop > recent:
+            rows += self.tail()[max(start - recent, 0):stop - recent]
+        return rows
+
+
+def merge_archived(rows, user_id, limit, cursor=None, **filters):
+    """
+    Страница истории из горячей таблицы, дополненная архивом, если
+    она заходит за границу архива.
+    """
+    if not archive_needed(rows, limit, archive_boundary()):
+        return rows
+    rows = rows + archived_rows(user_id, limit, cursor, **filters)
+    rows.sort(key=lambda row: (row['date'], row['id']), reverse=True)
+    return rows[:limit]
@@ -0,0 +1,102 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .balances import aget_card_balance
+from .models import Card, Transaction
+from .rates import aget_rate_quote
+from .renderers import FastJSONRenderer
+from .serializers import CardBalanceSerializer, \
+    TransactionListValuesSerializer
+from .utils import TransactionKeysetPagination, filter_transactions
+
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(FastJSONRenderer().render(data), status=status,
+                        headers=headers,
+                        content_type=FastJSONRenderer.media_type)
+
+
+def async_api_view(methods, authenticated=True):
+    """
+    Асинхронное представление для ASGI: аутентификация DRF (в потоке,
+    т.к. она может читать БД), права и ошибки DRF превращаются в JSON
+    так же, как у обычных APIView. Декораторы Django 4.1 (csrf_exempt,
+    require_http_methods) не умеют оборачивать корутины, поэтому их
+    работа сделана здесь.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            authenticators = [authenticator() for authenticator in
+                              api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+            request = Request(
+                request,
+                parsers=[parser() for parser in
+                         api_settings.DEFAULT_PARSER_CLASSES],
+                authenticators=authenticators
+            )
+            try:
+                if authenticated:
+                    user = await sync_to_async(lambda: request.user)()
+                    if not user or not user.is_authenticated:
+                        raise exceptions.NotAuthenticated()
+                return await view(request, *args, **kwargs)
+            except Http404:
+                return json_response({'detail': 'Не знайдено.'}, status=404)
+            except exceptions.APIException as exc:
+                headers = None
+                if isinstance(exc, (exceptions.NotAuthenticated,
+                                    exceptions.AuthenticationFailed)) \
+                        and authenticators:
+                    header = authenticators[0].authenticate_header(request)
+                    if header:
+                        headers = {'WWW-Authenticate': header}
+                    else:
+                        exc.status_code = 403
+                return json_response({'detail': exc.detail},
+                                     status=exc.status_code, headers=headers)
+        # CSRF проверяет SessionAuthentication, как у APIView.
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+@async_api_view(['GET'], authenticated=False)
+async def currency_rate(request):
+    quote = await aget_rate_quote()
+    return json_response(quote.as_dict(), headers={'Age': str(int(quote.age))})
+
+
+@async_api_view(['POST'])
+async def wallet_balance(request):
+    serializer = CardBalanceSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    entry = await aget_card_balance(serializer.validated_data['card'])
+    if entry is None or entry['user_id'] != request.user.pk:
+        raise Http404
+    instance = Card(card_number=entry['card_number'],
+                    balance=entry['balance'],
+                    currency=entry['currency'],
+                    user_id=entry['user_id'])
+    return json_response({'result': serializer.get_balance(instance)})
+
+
+@async_api_view(['GET'])
+async def transaction_log(request):
+    queryset = TransactionListValuesSerializer.values(filter_transactions(
+        Transaction.objects.filter(user_id=request.user.pk),
+        request.query_params
+    ))
+    paginator = TransactionKeysetPagination()
+    rows = await paginator.apaginate_queryset(queryset, request)
+    return json_response({
+        'next': paginator.get_next_link(),
+        'results': TransactionListValuesSerializer(rows, many=True).data,
+    })
@@ -0,0 +1,253 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, \
+    BasicAuthentication, get_authorization_header
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from .models import User
+
+DEFAULTS = {
+    'SESSION_TTL': 5 * 60,
+    'VERIFY_CACHE_TTL': 5 * 60,
+    'CACHE_ALIAS': 'default',
+}
+
+TERMINAL_SALT = 'atmdrf.terminal-session'
+
+JWT_CLAIMS_DEFAULTS = {
+    'VERSION_CACHE_SIZE': 4096,
+    'VERSION_TTL': 30,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def pin_auth_settings():
+    return {**DEFAULTS, **getattr(settings, 'PIN_AUTH', {})}
+
+
+def keyed_hash(*parts):
+    message = '\x00'.join(str(part) for part in parts).encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message,
+                    hashlib.sha256).hexdigest()
+
+
+def password_fingerprint(user):
+    """
+    Отпечаток текущего хеша PIN-кода: после смены PIN все выданные
+    терминальные сессии и закешированные проверки становятся невалидными.
+    """
+    return keyed_hash('password', user.password)[:16]
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic-аутентификация, которая запоминает успешные проверки PIN-кода
+    в кеше по ключу HMAC(SECRET_KEY, логин, PIN). Повторный запрос с теми
+    же данными проверяется без PBKDF2.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        config = pin_auth_settings()
+        cache = caches[config['CACHE_ALIAS']]
+        key = f'atmdrf:pin:{keyed_hash("pin", userid, password)}'
+        cached = cache.get(key)
+        if cached is not None:
+            user = User.objects.filter(pk=cached['pk']).first()
+            if user is not None and user.is_active and \
+                    password_fingerprint(user) == cached['fingerprint']:
+                return (user, None)
+            cache.delete(key)
+        user, auth = super().authenticate_credentials(userid, password,
+                                                      request)
+        cache.set(key, {'pk': user.pk,
+                        'fingerprint': password_fingerprint(user)},
+                  config['VERIFY_CACHE_TTL'])
+        return (user, auth)
+
+
+def issue_terminal_session(user):
+    token = signing.dumps(
+        {'pk': user.pk, 'fp': password_fingerprint(user)},
+        salt=TERMINAL_SALT, compress=True
+    )
+    return token, pin_auth_settings()['SESSION_TTL']
+
+
+class TerminalSessionAuthentication(BaseAuthentication):
+    """
+    Короткоживущая подписанная сессия терминала: заголовок
+    "Authorization: Terminal <token>". Проверка подписи - это один HMAC
+    вместо PBKDF2 на каждый запрос.
+    """
+    keyword = b'terminal'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword:
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid terminal session header.'))
+        try:
+            payload = signing.loads(
+                auth[1].decode(), salt=TERMINAL_SALT,
+                max_age=pin_auth_settings()['SESSION_TTL']
+            )
+        except (signing.BadSignature, UnicodeDecodeError):
+            raise exceptions.AuthenticationFailed(
+                _('Invalid or expired terminal session.'))
+        user = User.objects.filter(pk=payload['pk']).first()
+        if user is None or not user.is_active or \
+                password_fingerprint(user) != payload['fp']:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid or expired terminal session.'))
+        return (user, payload)
+
+    def authenticate_header(self, request):
+        return 'Terminal'
+
+
+def jwt_claims_settings():
+    return {**JWT_CLAIMS_DEFAULTS, **getattr(settings, 'JWT_CLAIMS', {})}
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Кладет в токен все, что нужно представлениям о пользователе, чтобы
+    не читать таблицу пользователей на каждом запросе.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        token['is_active'] = user.is_active
+        token['atm'] = user.atm_id
+        token['ver'] = user.token_version
+        return token
+
+
+class TokenClaimsUser(TokenUser):
+    @property
+    def iban(self):
+        return self.pk
+
+    @property
+    def is_active(self):
+        return self.token.get('is_active', True)
+
+    @property
+    def atm_id(self):
+        return self.token.get('atm')
+
+    def __eq__(self, other):
+        return self.pk == getattr(other, 'pk', None)
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def get_instance(self):
+        return User.objects.get(pk=self.pk)
+
+
+class TokenVersions:
+    """
+    Маленький LRU текущих версий токенов пользователей. Версия живет в
+    процессе ttl секунд, затем перечитывается из общего кеша или БД;
+    увеличение версии отзывает все ранее выданные токены.
+    """
+
+    def __init__(self, size=4096, ttl=30, cache_alias='default'):
+        self.size = size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(user_id):
+        return f'atmdrf:token-version:{user_id}'
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._versions.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._versions.move_to_end(user_id)
+                return entry[0]
+        cache = caches[self.cache_alias]
+        version = cache.get(self.cache_key(user_id))
+        if version is None:
+            version = User.objects.filter(pk=user_id).values_list(
+                'token_version', flat=True).first()
+            if version is None:
+                return None
+            cache.set(self.cache_key(user_id), version, None)
+        self._remember(user_id, version, now)
+        return version
+
+    def set(self, user_id, version):
+        caches[self.cache_alias].set(self.cache_key(user_id), version, None)
+        self._remember(user_id, version, time.monotonic())
+
+    def _remember(self, user_id, version, now):
+        with self._lock:
+            self._versions[user_id] = (version, now + self.ttl)
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.size:
+                self._versions.popitem(last=False)
+
+
+_token_versions = None
+
+
+def get_token_versions():
+    global _token_versions
+    if _token_versions is None:
+        config = jwt_claims_settings()
+        _token_versions = TokenVersions(
+            size=config['VERSION_CACHE_SIZE'],
+            ttl=config['VERSION_TTL'],
+            cache_alias=config['CACHE_ALIAS']
+        )
+    return _token_versions
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация без запроса к таблице пользователей: request.user
+    собирается из claims токена. Токены без версии (выданные до введения
+    claims) проверяются по БД, как раньше.
+    """
+
+    def get_user(self, validated_token):
+        if 'ver' not in validated_token:
+            return super().get_user(validated_token)
+        user = TokenClaimsUser(validated_token)
+        if validated_token['ver'] != get_token_versions().get(user.pk):
+            raise AuthenticationFailed(_('Token has been revoked'),
+                                       code='token_revoked')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'),
+                                       code='user_inactive')
+        return user
+
+
+def get_user_instance(user):
+    if isinstance(user, TokenClaimsUser):
+        return user.get_instance()
+    return user
@@ -0,0 +1,96 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .metrics import cache_event
+from .models import Card
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 5 * 60,
+}
+
+
+def balance_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'BALANCE_CACHE', {})}
+
+
+def entry_key(card_number):
+    return f'atmdrf:balance:{card_number}'
+
+
+def version_key(card_number):
+    return f'atmdrf:balance-version:{card_number}'
+
+
+def get_card_balance(card_number):
+    """
+    Баланс карты через кеш: при попадании - ни одного запроса к БД, при
+    промахе - один SELECT без загрузки владельца.
+
+    Запись хранит версию, прочитанную до SELECT; запись, пересекшаяся с
+    изменением баланса, получает устаревшую версию и не будет отдана.
+    """
+    config = balance_cache_settings()
+    cache = caches[config['CACHE_ALIAS']]
+    keys = entry_key(card_number), version_key(card_number)
+    entry, version = cached_entry(cache.get_many(keys), keys)
+    cache_event('balance', entry is not None)
+    if entry is not None:
+        return entry
+    entry = balance_queryset(card_number).first()
+    if entry is None:
+        return None
+    entry['version'] = version
+    cache.set(keys[0], entry, config['TTL'])
+    return entry
+
+
+async def aget_card_balance(card_number):
+    config = balance_cache_settings()
+    cache = caches[config['CACHE_ALIAS']]
+    keys = entry_key(card_number), version_key(card_number)
+    entry, version = cached_entry(await cache.aget_many(keys), keys)
+    cache_event('balance', entry is not None)
+    if entry is not None:
+        return entry
+    entry = await balance_queryset(card_number).afirst()
+    if entry is None:
+        return None
+    entry['version'] = version
+    await cache.aset(keys[0], entry, config['TTL'])
+    return entry
+
+
+def cached_entry(cached, keys):
+    version = cached.get(keys[1], 0)
+    entry = cached.get(keys[0])
+    if entry is not None and entry['version'] == version:
+        return entry, version
+    return None, version
+
+
+def balance_queryset(card_number):
+    # Промах кеша случается сразу после проводки (сброс версии), а
+    # отстающая реплика закешировала бы старый баланс под новой версией,
+    # поэтому заполнение кеша всегда читает основную БД.
+    return Card.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk=card_number).values('card_number', 'user_id', 'balance', 'currency')
+
+
+def bump_versions(card_numbers):
+    cache = caches[balance_cache_settings()['CACHE_ALIAS']]
+    for card_number in card_numbers:
+        key = version_key(card_number)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+    cache.delete_many([entry_key(card_number)
+                       for card_number in card_numbers])
+
+
+def invalidate_on_commit(*card_numbers):
+    transaction.on_commit(lambda: bump_versions(card_numbers))
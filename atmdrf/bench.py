@@ -0,0 +1,385 @@
+import json
+import platform
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .allocator import allocate_card_numbers
+from .authentication import ClaimsTokenObtainPairSerializer
+from .models import ATM, ATMShard, Card, Transaction, User
+from .onboarding import DEFAULT_PIN, bulk_register
+from .rates import FixtureRateSource, RateProvider, set_provider
+from .renderers import FastJSONRenderer
+from .serializers import TransactionListSerializer, \
+    TransactionListValuesSerializer, WalletSerializer, WalletValuesSerializer
+
+SCENARIOS = ('balance', 'mixed', 'transfers', 'paging')
+
+FIRST_NAMES = ('Олена', 'Андрій', 'Марія', 'Тарас', 'Ірина', 'Богдан')
+LAST_NAMES = ('Коваленко', 'Шевченко', 'Бойко', 'Мельник', 'Ткаченко')
+
+
+def use_stub_rates():
+    """
+    Курсы из фикстуры вместо PrivatBank: бенчмарк не ходит в сеть, а
+    результаты не зависят от времени суток.
+    """
+    set_provider(RateProvider(FixtureRateSource(), ttl=10 ** 9,
+                              stale_ttl=10 ** 9))
+
+
+def is_test_database(alias='default'):
+    """
+    Бенчмарк пишет в БД тысячи пользователей и транзакций, поэтому без
+    явного согласия он работает только с тестовой базой: в памяти или
+    с именем, начинающимся с test (так их называет тест-раннер Django).
+    """
+    database = connections[alias]
+    if database.vendor == 'sqlite' and database.is_in_memory_db():
+        return True
+    return Path(str(database.settings_dict['NAME'])).name.lower() \
+        .startswith('test')
+
+
+class SharedPinHasher:
+    """
+    Один хеш PIN-кода по умолчанию на всех сгенерированных пользователей:
+    сотни тысяч PBKDF2 сделали бы seed дольше самого бенчмарка. Только
+    для бенчмарка - seed работает лишь с тестовой БД.
+    """
+
+    def __init__(self, pin=DEFAULT_PIN):
+        self.password = make_password(pin)
+
+    def hashes(self, count):
+        return [self.password] * count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def database_name(alias='default'):
+    return str(connections[alias].settings_dict['NAME'])
+
+
+def seed(users=1000, transactions=100000, usd_share=0.1, days=365,
+         chunk_size=5000, random_seed=1, log=None):
+    """
+    Детерминированные тестовые данные: пользователи с картами (часть с
+    дополнительной USD-картой) и журнал пополнений/снятий, с которым
+    согласованы итоговые балансы карт и наличные банкомата, так что
+    reconcile после seed не находит расхождений.
+    """
+    rng = random.Random(random_seed)
+    log = log or (lambda message: None)
+    atm = ATM.objects.default()
+    rows = ({'first_name': rng.choice(FIRST_NAMES),
+             'last_name': rng.choice(LAST_NAMES),
+             'phone_number': f'+380{rng.randrange(10 ** 9):09d}'}
+            for _ in range(users))
+    created = [result for result in bulk_register(
+        rows, chunk_size=chunk_size, atm=atm, hasher=SharedPinHasher())
+        if result['status'] == 'created']
+    cards = [(result['login'], result['iban']) for result in created]
+    usd_owners = [iban for _, iban in cards if rng.random() < usd_share]
+    usd_cards = [Card(card_number=number, user_id=iban, currency='USD')
+                 for number, iban in zip(
+                     allocate_card_numbers(len(usd_owners)), usd_owners)]
+    Card.objects.bulk_create(usd_cards, batch_size=chunk_size)
+    cards.extend((card.card_number, card.user_id) for card in usd_cards)
+    log(f'{len(created)} користувачів, {len(cards)} карт')
+
+    # Журнал пишется executemany мимо ORM: на миллионах строк сборка
+    # моделей и подготовка значений bulk_create в разы дороже вставки.
+    insert = insert_statement(Transaction, ('type_transaction', 'receiver',
+                                            'card', 'value', 'user', 'date'))
+    adapt_date = connection.ops.adapt_datetimefield_value
+    balances = dict.fromkeys((number for number, _ in cards), 0)
+    cash = 0
+    started = timezone.now() - timedelta(days=days)
+    step = timedelta(days=days) / max(transactions, 1)
+    written = 0
+    while written < transactions:
+        batch = []
+        for index in range(written, min(written + chunk_size,
+                                        transactions)):
+            number, iban = cards[rng.randrange(len(cards))]
+            value = rng.randrange(100, 100000)
+            if balances[number] >= value and rng.random() < 0.4:
+                type_transaction = 'Зняття готівки'
+                balances[number] -= value
+                cash -= value
+            else:
+                type_transaction = 'Поповнення'
+                balances[number] += value
+                cash += value
+            batch.append((type_transaction, number, number, value, iban,
+                          adapt_date(started + step * index)))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(insert, batch)
+        written += len(batch)
+        log(f'{written} транзакцій')
+    Card.objects.bulk_update(
+        [Card(card_number=number, balance=balance)
+         for number, balance in balances.items()],
+        ['balance'], batch_size=chunk_size)
+    # Поповнення и зняття проходят через банкомат: его наличные должны
+    # сойтись с opening_balance + поповнення - зняття.
+    shards = list(ATMShard.objects.filter(atm=atm).order_by('index')
+                  .values_list('pk', flat=True))
+    share, rest = divmod(cash, len(shards))
+    with transaction.atomic():
+        for position, pk in enumerate(shards):
+            ATMShard.objects.filter(pk=pk).update(
+                balance=F('balance') + share + (1 if position < rest else 0))
+    return {'users': len(created), 'cards': len(cards),
+            'transactions': written}
+
+
+def insert_statement(model, fields):
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in fields]
+    return f'INSERT INTO {quote(model._meta.db_table)} ' \
+           f'({", ".join(quote(column) for column in columns)}) ' \
+           f'VALUES ({", ".join(["%s"] * len(columns))})'
+
+
+class Actor:
+    """
+    Клиент-терминал одного пользователя: JWT выдается без проверки
+    PIN, чтобы в замер не попадал PBKDF2.
+    """
+
+    def __init__(self, user, cards):
+        token = ClaimsTokenObtainPairSerializer.get_token(user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token.access_token}'}
+        self.cards = cards
+        self.next_page = None
+        self.depth = 0
+
+
+def load_actors(count, rng):
+    ibans = list(User.objects.filter(wallet__currency='UAH').order_by(
+        'iban').values_list('iban', flat=True).distinct()[:count * 10])
+    ibans = rng.sample(ibans, min(count, len(ibans)))
+    users = User.objects.in_bulk(ibans)
+    cards = {}
+    for number, iban, currency in Card.objects.filter(
+            user_id__in=ibans).values_list('card_number', 'user_id',
+                                           'currency'):
+        cards.setdefault(iban, []).append((number, currency))
+    return [Actor(users[iban], cards[iban]) for iban in ibans]
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(share * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class Runner:
+    def __init__(self, scenario, concurrency=8, requests=2000,
+                 duration=None, page_depth=50, random_seed=1,
+                 receivers=None):
+        if scenario not in SCENARIOS:
+            raise ValueError(f'Невідомий сценарій {scenario}')
+        self.scenario = scenario
+        self.concurrency = concurrency
+        self.requests = requests
+        self.duration = duration
+        self.page_depth = page_depth
+        self.random_seed = random_seed
+        self.receivers = receivers or []
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def take(self, deadline):
+        with self._lock:
+            if self.duration is None and self._issued >= self.requests:
+                return False
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+            self._issued += 1
+            return True
+
+    def request(self, client, actor, rng):
+        card, currency = rng.choice(actor.cards)
+        if self.scenario == 'balance':
+            return client.post('/api/v1/wallet/balance/', {'card': card},
+                               format='json', **actor.headers)
+        if self.scenario == 'mixed':
+            action = rng.choice(('deposit', 'withdraw'))
+            return client.put(
+                f'/api/v1/wallet/{action}/',
+                {'card': card, action: f'{rng.randrange(1, 500)}.00'},
+                format='json', **actor.headers)
+        if self.scenario == 'transfers':
+            receiver = rng.choice(self.receivers)
+            return client.put(
+                '/api/v1/wallet/send-money/',
+                {'card_sender': card, 'card_receiver': receiver,
+                 'send_money': f'{rng.randrange(1, 100)}.00'},
+                format='json', **actor.headers)
+        url = actor.next_page or '/api/v1/log/'
+        response = client.get(url, **actor.headers)
+        actor.depth += 1
+        next_page = response.data.get('next') \
+            if response.status_code == 200 else None
+        actor.next_page = next_page if next_page and \
+            actor.depth < self.page_depth else None
+        if actor.next_page is None:
+            actor.depth = 0
+        return response
+
+    def worker(self, number, actors, deadline, samples):
+        rng = random.Random(self.random_seed * 1000 + number)
+        client = APIClient()
+        try:
+            while self.take(deadline):
+                actor = rng.choice(actors)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    try:
+                        status = self.request(client, actor,
+                                              rng).status_code
+                    except Exception:
+                        status = 0
+                    elapsed = time.perf_counter() - started
+                samples.append((elapsed, status, len(queries)))
+        finally:
+            connection.close()
+
+    def run(self, actors):
+        samples = []
+        deadline = time.perf_counter() + self.duration \
+            if self.duration else None
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for future in [pool.submit(self.worker, number, actors, deadline,
+                                       samples)
+                           for number in range(self.concurrency)]:
+                future.result()
+        wall = time.perf_counter() - started
+        return self.report(samples, wall)
+
+    def report(self, samples, wall):
+        latencies = [elapsed * 1000 for elapsed, _, _ in samples]
+        queries = [count for _, _, count in samples]
+        errors = sum(1 for _, status, _ in samples
+                     if not 200 <= status < 300)
+        return {
+            'scenario': self.scenario,
+            'concurrency': self.concurrency,
+            'seed': self.random_seed,
+            'requests': len(samples),
+            'errors': errors,
+            'wall_seconds': round(wall, 3),
+            'rps': round(len(samples) / wall, 1) if wall else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.5) or 0, 3),
+                'p90': round(percentile(latencies, 0.9) or 0, 3),
+                'p99': round(percentile(latencies, 0.99) or 0, 3),
+                'max': round(max(latencies, default=0), 3),
+            },
+            'queries_per_request': round(statistics.fmean(queries), 2)
+            if queries else None,
+        }
+
+
+def serialization_throughput(rows=5000, repeat=5):
+    """
+    Строк в секунду для ответов /log/ и /wallet/: выборка, сериализация
+    и рендер JSON. 'model' - ModelSerializer и JSONRenderer, 'values' -
+    values() с планом сериализации и FastJSONRenderer. Лучший из repeat
+    прогонов.
+    """
+    cases = (
+        ('log', Transaction.objects.order_by('-id'),
+         TransactionListSerializer, TransactionListValuesSerializer),
+        ('wallet', Card.objects.order_by('card_number'),
+         WalletSerializer, WalletValuesSerializer),
+    )
+    results = []
+    for endpoint, queryset, model_serializer, values_serializer in cases:
+        paths = (
+            ('model', lambda: queryset[:rows], model_serializer,
+             JSONRenderer()),
+            ('values', lambda: values_serializer.values(queryset)[:rows],
+             values_serializer, FastJSONRenderer()),
+        )
+        for path, fetch, serializer, renderer in paths:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                data = list(fetch())
+                renderer.render(serializer(data, many=True).data)
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            results.append({
+                'endpoint': endpoint,
+                'path': path,
+                'rows': len(data),
+                'rows_per_second': round(len(data) / best) if best else None,
+            })
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connections['default'].vendor,
+        'machine': platform.machine(),
+        'cards': Card.objects.count(),
+        'transactions': Transaction.objects.count(),
+    }
+
+
+def compare(current, baseline):
+    """
+    Разница с прошлым прогоном по тем же сценариям: отношение
+    текущего значения к базовому для RPS, p50/p99 и SQL на запрос.
+    """
+    previous = {result['scenario']: result
+                for result in baseline.get('results', [])}
+    rows = []
+    for result in current['results']:
+        base = previous.get(result['scenario'])
+        if base is None:
+            continue
+        pairs = (('rps', result['rps'], base['rps']),
+                 ('p50', result['latency_ms']['p50'],
+                  base['latency_ms']['p50']),
+                 ('p99', result['latency_ms']['p99'],
+                  base['latency_ms']['p99']),
+                 ('queries', result['queries_per_request'],
+                  base['queries_per_request']))
+        rows.append({
+            'scenario': result['scenario'],
+            **{name: round(value / old, 3) if old else None
+               for name, value, old in pairs},
+        })
+    return rows
+
+
+def dump(data, path):
+    with open(path, 'w', encoding='utf-8') as out:
+        json.dump(data, out, ensure_ascii=False, indent=2)
@@ -0,0 +1,85 @@
+import asyncio
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+
+DEFAULTS = {
+    'REPLICA_ALIAS': 'replica',
+    'REPLICA_PATHS': (),
+}
+
+_use_replica = ContextVar('atmdrf_use_replica', default=False)
+
+
+def routing_settings():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_ROUTING', {})}
+
+
+def replica_alias():
+    alias = routing_settings()['REPLICA_ALIAS']
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def use_replica(enabled=True):
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтения в пределах use_replica() (маршруты из REPLICA_PATHS) идут на
+    реплику, все записи и остальные чтения - на основную БД. Без
+    настроенной реплики роутер ничего не меняет.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get():
+            return replica_alias() or DEFAULT_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+@sync_and_async_middleware
+def replica_reads_middleware(get_response):
+    patterns = [re.compile(pattern)
+                for pattern in routing_settings()['REPLICA_PATHS']]
+
+    def replica_allowed(request):
+        return any(pattern.search(request.path) for pattern in patterns)
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with use_replica(replica_allowed(request)):
+                return await get_response(request)
+    else:
+        def middleware(request):
+            with use_replica(replica_allowed(request)):
+                return get_response(request)
+    return middleware
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Прагмы SQLite для каждого нового соединения: WAL позволяет читать
+    во время записи, synchronous=NORMAL в WAL-режиме не теряет
+    согласованность при сбое процесса.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,54 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def encode_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_lines(rows, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(
+            '' if value is None else encode_value(value) for value in row)
+
+
+def ndjson_lines(rows, fields):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), ensure_ascii=False,
+                         default=encode_value) + '\n'
+
+
+def export_lines(rows, fields, fmt):
+    if fmt == 'csv':
+        return csv_lines(rows, fields)
+    return ndjson_lines(rows, fields)
+
+
+def streaming_export(rows, fields, fmt='ndjson', filename=None):
+    """
+    Потоковая выгрузка кортежей rows (обычно values_list().iterator())
+    в CSV или NDJSON: память не зависит от числа строк.
+    """
+    fmt = fmt if fmt in CONTENT_TYPES else 'ndjson'
+    response = StreamingHttpResponse(export_lines(rows, fields, fmt),
+                                     content_type=CONTENT_TYPES[fmt])
+    if filename:
+        response['Content-Disposition'] = \
+            f'attachment; filename="{filename}.{fmt}"'
+    return response
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class PinPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 для 4-значных PIN-кодов с числом итераций из профиля
+    PIN_AUTH['HASHER_ITERATIONS']. Хеши с другим числом итераций
+    пересчитываются при следующей успешной проверке.
+    """
+    algorithm = 'pin_pbkdf2_sha256'
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PIN_AUTH', {}).get(
+            'HASHER_ITERATIONS', PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,123 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .authentication import keyed_hash
+from .metrics import cache_event
+from .models import IdempotencyKey
+
+DEFAULTS = {
+    'HEADER': 'Idempotency-Key',
+    'TTL': 24 * 60 * 60,
+    'CACHE_ALIAS': 'default',
+    'MAX_KEY_LENGTH': 255,
+}
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def idempotency_settings():
+    return {**DEFAULTS, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+def cache_key(digest):
+    return f'atmdrf:idempotency:{digest}'
+
+
+def request_fingerprint(data):
+    return keyed_hash('idempotency-request',
+                      json.dumps(data, sort_keys=True, default=str))
+
+
+def lookup(digest, config):
+    """
+    Сохраненный ответ: сначала из кеша (без запросов к БД), затем одна
+    выборка по первичному ключу. Просроченная запись удаляется.
+    """
+    cache = caches[config['CACHE_ALIAS']]
+    stored = cache.get(cache_key(digest))
+    cache_event('idempotency', stored is not None)
+    if stored is not None:
+        return stored
+    record = IdempotencyKey.objects.filter(pk=digest).first()
+    if record is None:
+        return None
+    if record.expires_at <= timezone.now():
+        record.delete()
+        return None
+    stored = {'fingerprint': record.fingerprint,
+              'status': record.status_code,
+              'response': record.response}
+    cache.set(cache_key(digest), stored,
+              (record.expires_at - timezone.now()).total_seconds())
+    return stored
+
+
+def replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'detail': 'Idempotency-Key вже використано з іншим запитом'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(stored['response'], status=stored['status'],
+                    headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent(request, data, handler, prepare=None):
+    """
+    Выполняет handler() не более одного раза для пары (пользователь,
+    Idempotency-Key). Запись ключа вставляется в той же транзакции БД,
+    что и проводка: конкурентный дубль ждет на уникальном ключе, пока
+    первый запрос не завершится, и получает его ответ. Запросы без
+    заголовка выполняются как раньше.
+
+    prepare() вызывается до открытия транзакции: медленные внешние
+    вызовы (курс валют по HTTP) не должны держать блокировку записи.
+    """
+    config = idempotency_settings()
+    key = request.headers.get(config['HEADER'])
+    if not key:
+        return handler()
+    if len(key) > config['MAX_KEY_LENGTH']:
+        return Response(
+            {'detail': f'{config["HEADER"]} задовгий'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    digest = keyed_hash('idempotency', request.user.pk, request.path, key)
+    fingerprint = request_fingerprint(data)
+    stored = lookup(digest, config)
+    if stored is not None:
+        return replay(stored, fingerprint)
+    if prepare is not None:
+        prepare()
+    expires_at = timezone.now() + timedelta(seconds=config['TTL'])
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                key=digest, fingerprint=fingerprint, expires_at=expires_at)
+            response = handler()
+            record.status_code = response.status_code
+            record.response = response.data
+            record.save(update_fields=['status_code', 'response'])
+    except IntegrityError:
+        stored = lookup(digest, config)
+        if stored is None:
+            raise
+        return replay(stored, fingerprint)
+    stored = {'fingerprint': fingerprint,
+              'status': record.status_code,
+              'response': record.response}
+    caches[config['CACHE_ALIAS']].set(cache_key(digest), stored,
+                                      config['TTL'])
+    return response
+
+
+def purge_expired():
+    return IdempotencyKey.objects.filter(
+        expires_at__lte=timezone.now()).delete()[0]
@@ -0,0 +1,353 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, \
+    transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import JournalBatch, Transaction
+
+DEFAULTS = {
+    'ASYNC': False,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'WAL_PATH': None,
+    'SEGMENT_SIZE': 16 * 1024 * 1024,
+    'ROLLBACK_TIMEOUT': 600,
+}
+
+ENTRY_FIELDS = ('type_transaction', 'sender', 'receiver', 'value', 'user_id',
+                'card_id', 'rate_snapshot_id')
+
+
+def journal_settings():
+    return {**DEFAULTS, **getattr(settings, 'TRANSACTION_JOURNAL', {})}
+
+
+class Journal:
+    """
+    Собирает записи журнала одной бизнес-операции и пишет их одним
+    bulk_create в текущей транзакции БД (или, в асинхронном режиме, в
+    write-ahead файл до коммита).
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.entries = []
+
+    def record(self, type_transaction, sender, receiver, value, user_id,
+               rate_snapshot_id=None):
+        entry = Transaction(
+            type_transaction=type_transaction,
+            sender=sender,
+            receiver=receiver,
+            value=value,
+            user_id=user_id,
+            card_id=Transaction.card_for(type_transaction, sender, receiver),
+            rate_snapshot_id=rate_snapshot_id,
+            date=timezone.now()
+        )
+        self.entries.append(entry)
+        return entry
+
+    def commit(self):
+        entries, self.entries = self.entries, []
+        if not entries:
+            return entries
+        if journal_settings()['ASYNC']:
+            get_queue().append(entries, self.using)
+            return entries
+        return Transaction.objects.using(self.using).bulk_create(entries)
+
+
+class JournalQueue:
+    """
+    Асинхронный режим журнала. Пачка записей операции дописывается в
+    write-ahead сегмент до коммита, а в той же транзакции БД вставляется
+    ее отметка JournalBatch. После коммита пачка сбрасывается в БД вместе
+    с удалением отметки, пачками по размеру или по времени.
+
+    При старте переигрываются пачки, чьи отметки есть в БД: пачки
+    откаченных транзакций отметок не имеют. Сегмент удаляется целиком,
+    когда все его пачки сброшены или откачены, файл не переписывается.
+
+    Цена режима: в транзакции операции остаются вставка отметки и fsync
+    (общий для одновременных операций), экономятся только вставки строк
+    журнала. До сброса (до FLUSH_INTERVAL) записей нет в Transaction: их
+    не видят история, выписки, снимки и сверка; reconcile и rollup
+    сбрасывают очередь своего процесса, но не чужих. Режим выключен по
+    умолчанию и нужен, только если узкое место - вставки в журнал.
+    """
+
+    def __init__(self, wal_path, batch_size=500, flush_interval=1.0,
+                 segment_size=DEFAULTS['SEGMENT_SIZE'],
+                 rollback_timeout=DEFAULTS['ROLLBACK_TIMEOUT']):
+        self.wal_path = Path(wal_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_size = segment_size
+        self.rollback_timeout = rollback_timeout
+        self._pending = []
+        # Несброшенные пачки по сегментам; пачки в полете - с базой и
+        # временем записи, коммит отмечает функция on_commit.
+        self._segments = {}
+        self._segment_of = {}
+        self._in_flight = {}
+        # Номер последней записанной и последней сброшенной fsync строки.
+        self._written = self._synced = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._replay()
+        self._wal = None
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, entries, using=None):
+        """
+        Пишет пачку в сегмент и отметку в текущую транзакцию; в очередь
+        сброса пачка попадает после коммита.
+        """
+        using = using or DEFAULT_DB_ALIAS
+        batch_id = uuid.uuid4().hex
+        line = json.dumps({'batch': batch_id, 'using': using,
+                           'entries': [self._dump(entry)
+                                       for entry in entries]}) + '\n'
+        with self._lock:
+            self._wal.write(line)
+            self._written += 1
+            number = self._written
+            segment = self._wal_segment
+            self._segments[segment].add(batch_id)
+            self._segment_of[batch_id] = segment
+            self._in_flight[batch_id] = (using, time.monotonic())
+            if self._wal.tell() >= self.segment_size:
+                self._open_segment()
+        self._sync(number)
+        JournalBatch.objects.using(using).create(id=batch_id)
+        transaction.on_commit(
+            lambda: self._committed(batch_id, using, entries), using=using)
+        return batch_id
+
+    def flush(self):
+        """
+        Сбрасывает закоммиченные пачки в порядке коммита; пачки разных
+        баз идут разными транзакциями.
+        """
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batches = self._take_batch()
+                if not batches:
+                    break
+                using = batches[0][1]
+                with transaction.atomic(using=using):
+                    Transaction.objects.using(using).bulk_create(
+                        [entry for _, _, entries in batches
+                         for entry in entries])
+                    JournalBatch.objects.using(using).filter(
+                        id__in=[batch_id for batch_id, _, _ in batches]
+                    ).delete()
+                with self._lock:
+                    del self._pending[:len(batches)]
+                    for batch_id, _, _ in batches:
+                        self._resolve(batch_id)
+            self._collect()
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self._wal.close()
+
+    def __len__(self):
+        return sum(len(entries) for _, _, entries in self._pending)
+
+    def _committed(self, batch_id, using, entries):
+        with self._lock:
+            self._in_flight.pop(batch_id, None)
+            self._pending.append((batch_id, using, entries))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _sync(self, number):
+        """
+        Групповой fsync: поток, дождавшийся _sync_lock, сбрасывает на
+        диск все уже записанные строки, и ждавшие вместе с ним операции
+        выходят без своего fsync.
+        """
+        with self._sync_lock:
+            with self._lock:
+                if self._synced >= number:
+                    return
+                self._wal.flush()
+                target = self._written
+                # Копия дескриптора переживет смену сегмента во время
+                # fsync; смена сама сбрасывает старый сегмент.
+                fd = os.dup(self._wal.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self._lock:
+                self._synced = max(self._synced, target)
+
+    def _take_batch(self):
+        batches, size = [], 0
+        for batch_id, using, entries in self._pending:
+            if batches and (size + len(entries) > self.batch_size
+                            or using != batches[0][1]):
+                break
+            batches.append((batch_id, using, entries))
+            size += len(entries)
+        return batches
+
+    def _resolve(self, batch_id):
+        segment = self._segment_of.pop(batch_id, None)
+        if segment is not None:
+            self._segments[segment].discard(batch_id)
+
+    def _collect(self):
+        """
+        Удаляет закрытые сегменты без несброшенных пачек. Пачка в
+        полете дольше rollback_timeout без отметки в БД считается
+        откаченной: транзакция дольше таймаута все равно сбросит свою
+        пачку после коммита, но уже без защиты от сбоя процесса.
+        """
+        deadline = time.monotonic() - self.rollback_timeout
+        with self._lock:
+            expired = [(batch_id, using) for batch_id, (using, written)
+                       in self._in_flight.items() if written < deadline
+                       and self._segment_of.get(batch_id) !=
+                       self._wal_segment]
+        for batch_id, using in expired:
+            if JournalBatch.objects.using(using).filter(
+                    id=batch_id).exists():
+                continue
+            with self._lock:
+                if self._in_flight.pop(batch_id, None) is not None:
+                    self._resolve(batch_id)
+        with self._lock:
+            for segment, batch_ids in list(self._segments.items()):
+                if segment != self._wal_segment and not batch_ids:
+                    del self._segments[segment]
+                    segment.unlink(missing_ok=True)
+
+    def _open_segment(self):
+        if self._wal is not None:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._synced = self._written
+            self._wal.close()
+        numbers = [int(path.suffix[1:]) for path in self._segment_paths()]
+        self._wal_segment = self.wal_path.with_name(
+            f'{self.wal_path.name}.{max(numbers, default=0) + 1:08d}')
+        self._segments[self._wal_segment] = set()
+        self._wal = open(self._wal_segment, 'a', encoding='utf-8')
+
+    def _segment_paths(self):
+        return sorted(
+            path for path in self.wal_path.parent.glob(
+                f'{self.wal_path.name}.*')
+            if path.suffix[1:].isdigit())
+
+    def _replay(self):
+        batches = {}
+        for segment in self._segment_paths():
+            self._segments[segment] = set()
+            with open(segment, encoding='utf-8') as wal:
+                for line in wal:
+                    if not line.strip():
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        # Недописанная строка: сбой до коммита.
+                        continue
+                    batches[data['batch']] = (
+                        segment, data.get('using', DEFAULT_DB_ALIAS),
+                        data['entries'])
+        committed = set()
+        by_alias = defaultdict(list)
+        for batch_id, (_, using, _) in batches.items():
+            by_alias[using].append(batch_id)
+        for using, batch_ids in by_alias.items():
+            for start in range(0, len(batch_ids), 500):
+                committed.update(JournalBatch.objects.using(using).filter(
+                    id__in=batch_ids[start:start + 500]
+                ).values_list('id', flat=True))
+        for batch_id, (segment, using, entries) in batches.items():
+            if batch_id in committed:
+                self._segments[segment].add(batch_id)
+                self._segment_of[batch_id] = segment
+                self._pending.append(
+                    (batch_id, using,
+                     [self._load(entry) for entry in entries]))
+        for segment, batch_ids in list(self._segments.items()):
+            if not batch_ids:
+                del self._segments[segment]
+                segment.unlink()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.flush_interval)
+            finally:
+                close_old_connections()
+
+    @staticmethod
+    def _dump(entry):
+        data = {field: getattr(entry, field) for field in ENTRY_FIELDS}
+        data['date'] = entry.date.isoformat()
+        return data
+
+    @staticmethod
+    def _load(data):
+        return Transaction(date=parse_datetime(data.pop('date')), **data)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                config = journal_settings()
+                wal_path = config['WAL_PATH'] or \
+                    Path(settings.BASE_DIR) / 'journal.wal'
+                _queue = JournalQueue(
+                    wal_path,
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    segment_size=config['SEGMENT_SIZE'],
+                    rollback_timeout=config['ROLLBACK_TIMEOUT']
+                )
+    return _queue
+
+
+def flush_local():
+    """
+    Сбрасывает очередь журнала этого процесса перед чтением журнала
+    целиком (сверка, свертывание снимков).
+    """
+    if _queue is not None:
+        _queue.flush()
@@ -0,0 +1,194 @@
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .balances import invalidate_on_commit
+from .journal import Journal
+from .models import ATM, ATMShard, Card
+from .outbox import Outbox
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class ATMOutOfCash(LedgerError):
+    pass
+
+
+def _credit(queryset, value):
+    return queryset.update(balance=F('balance') + value)
+
+
+def _debit(queryset, value):
+    """
+    Условное списание: UPDATE ... SET balance = balance - value
+    WHERE balance >= value. Успех определяется числом измененных строк.
+    """
+    return queryset.filter(balance__gte=value).update(
+        balance=F('balance') - value)
+
+
+def shard_index(card):
+    """
+    Карты закреплены за своим шардом банкомата, поэтому операции по разным
+    картам обновляют разные строки.
+    """
+    shards = getattr(settings, 'ATM_SHARDS', 8)
+    return zlib.crc32(card.card_number.encode()) % shards
+
+
+def _put_cash(atm_id, value, index):
+    shards = ATMShard.objects.filter(atm_id=atm_id)
+    if _credit(shards.filter(index=index), value):
+        return
+    shard = shards.order_by('index').first()
+    if shard is None or not _credit(shards.filter(pk=shard.pk), value):
+        raise ATM.DoesNotExist
+
+
+def _take_cash(atm_id, value, index):
+    shards = ATMShard.objects.filter(atm_id=atm_id)
+    if _debit(shards.filter(index=index), value):
+        return
+    available = list(
+        shards.filter(balance__gt=0).order_by('-balance')
+        .values_list('pk', 'balance')
+    )
+    remaining = value
+    for pk, balance in available:
+        take = min(balance, remaining)
+        if _debit(shards.filter(pk=pk), take):
+            remaining -= take
+        if not remaining:
+            return
+    raise ATMOutOfCash
+
+
+def deposit(card, value, atm_id):
+    journal, outbox = Journal(), Outbox()
+    with transaction.atomic():
+        _put_cash(atm_id, value, shard_index(card))
+        if not _credit(Card.objects.filter(pk=card.pk), value):
+            raise Card.DoesNotExist
+        journal.record('Поповнення', None, card.card_number, value,
+                       card.user_id)
+        outbox.add('deposit', card.card_number, value)
+        journal.commit()
+        outbox.commit()
+        invalidate_on_commit(card.card_number)
+    card.balance += value
+
+
+def withdraw(card, value, atm_id):
+    journal, outbox = Journal(), Outbox()
+    with transaction.atomic():
+        if not _debit(Card.objects.filter(pk=card.pk), value):
+            raise InsufficientFunds
+        _take_cash(atm_id, value, shard_index(card))
+        journal.record('Зняття готівки', None, card.card_number, value,
+                       card.user_id)
+        outbox.add('withdraw', card.card_number, value)
+        journal.commit()
+        outbox.commit()
+        invalidate_on_commit(card.card_number)
+    card.balance -= value
+
+
+def send_money(sender, receiver, value, received_value,
+               rate_snapshot_id=None):
+    """
+    Списывает value с карты отправителя и зачисляет received_value
+    (уже сконвертированную сумму) на карту получателя одной транзакцией.
+    rate_snapshot_id - снимок курсов, по которому считалась конвертация.
+    """
+    journal, outbox = Journal(), Outbox()
+    with transaction.atomic():
+        if not _debit(Card.objects.filter(pk=sender.pk), value):
+            raise InsufficientFunds
+        if not _credit(Card.objects.filter(pk=receiver.pk), received_value):
+            raise Card.DoesNotExist
+        journal.record('Переказ', sender.card_number, receiver.card_number,
+                       value, sender.user_id, rate_snapshot_id)
+        journal.record('Отримання', sender.card_number,
+                       receiver.card_number, received_value, receiver.user_id,
+                       rate_snapshot_id)
+        outbox.add('transfer', sender.card_number, value,
+                   receiver.card_number, received_value)
+        journal.commit()
+        outbox.commit()
+        invalidate_on_commit(sender.card_number, receiver.card_number)
+    sender.balance -= value
+    receiver.balance += received_value
+
+
+def send_batch(sender, items, get_quote, batch_size=1000):
+    """
+    Выплаты с одной карты многим получателям одной транзакцией: строка
+    отправителя блокируется и списывается один раз, получатели читаются
+    одним in_bulk и зачисляются пачкой UPDATE, журнал пишется одним
+    bulk_create. items - пары (номер карты получателя, сумма в копейках
+    валюты отправителя); позиции обрабатываются по порядку, пока хватает
+    средств. Котировка берется вызовом get_quote() только при первой
+    межвалютной позиции и одна на все позиции, ее снимок записывается в
+    журнал межвалютных переказов. Возвращает по словарю на позицию.
+    """
+    journal, outbox = Journal(), Outbox()
+    with transaction.atomic():
+        available = Card.objects.select_for_update().filter(
+            pk=sender.pk).values_list('balance', flat=True).get()
+        receivers = Card.objects.only(
+            'card_number', 'currency', 'user_id', 'balance'
+        ).in_bulk({card_number for card_number, value in items})
+        results, credits, total = [], {}, 0
+        quote = snapshot_id = None
+        for card_number, value in items:
+            receiver = receivers.get(card_number)
+            result = {'card_receiver': card_number, 'value': value}
+            results.append(result)
+            if receiver is None or card_number == sender.card_number:
+                result['error'] = 'not_found'
+                continue
+            if total + value > available:
+                result['error'] = 'insufficient_funds'
+                continue
+            received, rate_snapshot_id = value, None
+            if receiver.currency != sender.currency:
+                if quote is None:
+                    quote = get_quote()
+                    snapshot_id = quote.snapshot_id
+                received = quote.convert(value, sender.currency,
+                                         receiver.currency)
+                rate_snapshot_id = snapshot_id
+            total += value
+            credits[card_number] = credits.get(card_number, 0) + received
+            result['received'] = received
+            result['currency'] = receiver.currency
+            journal.record('Переказ', sender.card_number, card_number,
+                           value, sender.user_id, rate_snapshot_id)
+            journal.record('Отримання', sender.card_number, card_number,
+                           received, receiver.user_id, rate_snapshot_id)
+            outbox.add('transfer', sender.card_number, value, card_number,
+                       received)
+        if not credits:
+            return results
+        if not _debit(Card.objects.filter(pk=sender.pk), total):
+            raise InsufficientFunds
+        credited = []
+        for card_number, received in credits.items():
+            receiver = receivers[card_number]
+            receiver.balance = F('balance') + received
+            credited.append(receiver)
+        Card.objects.bulk_update(credited, ['balance'],
+                                 batch_size=batch_size)
+        journal.commit()
+        outbox.commit()
+        invalidate_on_commit(sender.card_number, *credits)
+    sender.balance = available - total
+    return results
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from atmdrf.archive import archive_month, pending_months
+
+
+class Command(BaseCommand):
+    help = 'Переносить транзакції, старші за горизонт, у стиснений архів ' \
+           'по місяцях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon-days', type=int)
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = 0
+        for month in pending_months(options['horizon_days']):
+            count = archive_month(month, options['chunk_size'])
+            total += count
+            if count:
+                self.stderr.write(f'{month:%Y-%m}: {count} транзакцій')
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            f'Заархівовано {total} транзакцій за {elapsed:.1f} с'
+        )
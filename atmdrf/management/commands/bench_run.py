@@ -0,0 +1,87 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+from atmdrf.bench import SCENARIOS, Runner, compare, database_name, dump, \
+    environment, is_test_database, load_actors, serialization_throughput, \
+    use_stub_rates
+from atmdrf.models import Card
+
+
+class Command(BaseCommand):
+    help = 'Навантажувальні сценарії гаманця: p50/p99, RPS, SQL на запит'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append',
+                            choices=SCENARIOS,
+                            help='Можна вказати кілька разів; за '
+                                 'замовчуванням усі')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--duration', type=float,
+                            help='Секунд на сценарій замість --requests')
+        parser.add_argument('--actors', type=int, default=200)
+        parser.add_argument('--page-depth', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Файл JSON з результатами')
+        parser.add_argument('--compare', help='JSON попереднього прогону')
+        parser.add_argument('--serialization', type=int, metavar='ROWS',
+                            help='Також виміряти швидкість серіалізації '
+                                 '/log/ і /wallet/ на ROWS рядках')
+        parser.add_argument('--i-know-this-is-not-prod', action='store_true',
+                            help='Дозволити запуск не на тестовій БД')
+
+    def handle(self, *args, **options):
+        if not options['i_know_this_is_not_prod'] and \
+                not is_test_database():
+            raise CommandError(
+                f'БД {database_name()} не схожа на тестову (потрібна БД у '
+                'пам\'яті або з назвою test...); якщо це не продакшн, '
+                'додайте --i-know-this-is-not-prod')
+        # Запросы идут через тестовый клиент DRF в этом же процессе, без
+        # сети: ему нужен 'testserver' в ALLOWED_HOSTS.
+        setup_test_environment()
+        use_stub_rates()
+        rng = random.Random(options['seed'])
+        actors = load_actors(options['actors'], rng)
+        if not actors:
+            raise CommandError('Немає даних: спочатку запустіть bench_seed')
+        receivers = list(Card.objects.filter(currency='UAH').order_by(
+            'card_number').values_list('card_number', flat=True)[:10000])
+        results = []
+        for scenario in options['scenario'] or SCENARIOS:
+            runner = Runner(
+                scenario,
+                concurrency=options['concurrency'],
+                requests=options['requests'],
+                duration=options['duration'],
+                page_depth=options['page_depth'],
+                random_seed=options['seed'],
+                receivers=receivers,
+            )
+            result = runner.run(actors)
+            results.append(result)
+            self.stderr.write(
+                f'{scenario}: {result["rps"]} зап/с, '
+                f'p50 {result["latency_ms"]["p50"]} мс, '
+                f'p99 {result["latency_ms"]["p99"]} мс, '
+                f'SQL {result["queries_per_request"]}, '
+                f'помилок {result["errors"]}'
+            )
+        report = {'environment': environment(), 'results': results}
+        if options['serialization']:
+            report['serialization'] = serialization_throughput(
+                options['serialization'])
+            for result in report['serialization']:
+                self.stderr.write(
+                    f'{result["endpoint"]} ({result["path"]}): '
+                    f'{result["rows_per_second"]} рядків/с'
+                )
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline:
+                report['compare'] = compare(report, json.load(baseline))
+        if options['output']:
+            dump(report, options['output'])
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
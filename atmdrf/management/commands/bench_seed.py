@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from atmdrf.bench import database_name, is_test_database, seed
+
+
+class Command(BaseCommand):
+    help = 'Генерує відтворювані дані для бенчмарку (лише для тестової БД)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--transactions', type=int, default=100000)
+        parser.add_argument('--usd-share', type=float, default=0.1)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--i-know-this-is-not-prod', action='store_true',
+                            help='Дозволити запуск не на тестовій БД')
+
+    def handle(self, *args, **options):
+        if not options['i_know_this_is_not_prod'] and \
+                not is_test_database():
+            raise CommandError(
+                f'БД {database_name()} не схожа на тестову (потрібна БД у '
+                'пам\'яті або з назвою test...); якщо це не продакшн, '
+                'додайте --i-know-this-is-not-prod')
+        started = time.perf_counter()
+        result = seed(
+            users=options['users'],
+            transactions=options['transactions'],
+            usd_share=options['usd_share'],
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            random_seed=options['seed'],
+            log=self.stderr.write,
+        )
+        self.stderr.write(
+            f'Згенеровано {result} за {time.perf_counter() - started:.1f} с')
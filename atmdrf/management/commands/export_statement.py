@@ -0,0 +1,57 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from atmdrf.export import export_lines
+from atmdrf.statements import STATEMENT_FIELDS, statement_archive, \
+    statement_queryset, statement_rows
+
+
+class Command(BaseCommand):
+    help = 'Потокова виписка транзакцій користувача або карти'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='IBAN користувача')
+        parser.add_argument('--card', help='Номер карти')
+        parser.add_argument('--from', dest='date_from')
+        parser.add_argument('--to', dest='date_to')
+        parser.add_argument('--type', dest='type')
+        parser.add_argument('--output', choices=('csv', 'ndjson'),
+                            default='csv')
+        parser.add_argument('--out', help='Файл виписки (за замовчуванням '
+                                          'stdout)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not options['user'] and not options['card']:
+            raise CommandError('Вкажіть --user або --card')
+        params = {key: options[key] for key in ('date_from', 'date_to', 'type')
+                  if options[key]}
+        queryset = statement_queryset(options['user'], options['card'],
+                                      params)
+        archived = statement_archive(options['user'], options['card'],
+                                     params)
+        out = open(options['out'], 'w', encoding='utf-8', newline='') \
+            if options['out'] else sys.stdout
+        started = time.perf_counter()
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for count, row in enumerate(rows, 1):
+                yield row
+
+        try:
+            out.writelines(export_lines(
+                counted(statement_rows(queryset, options['chunk_size'],
+                                       archived)),
+                STATEMENT_FIELDS, options['output']))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            f'Вивантажено {count} рядків за {elapsed:.1f} с '
+            f'({count / elapsed if elapsed else 0:.0f} рядків/с)'
+        )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from atmdrf.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Видаляє прострочені ключі ідемпотентності'
+
+    def handle(self, *args, **options):
+        self.stderr.write(f'Видалено {purge_expired()} ключів')
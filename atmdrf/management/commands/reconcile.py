@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from atmdrf.reconcile import np, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Звіряє баланси карт з журналом транзакцій і готівку ' \
+           'банкоматів з рухом готівки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--max-reported', type=int,
+                            help='Скільки розбіжностей включити у звіт')
+        parser.add_argument('--output', help='Файл JSON зі звітом')
+        parser.add_argument('--fail-on-discrepancy', action='store_true',
+                            help='Код виходу 1, якщо є розбіжності')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('Для звірки потрібен numpy')
+        report = reconcile(options['chunk_size'], options['max_reported'],
+                           log=self.stderr.write)
+        self.stderr.write(
+            f'Перевірено {report["cards"]} карт, {report["rows"]} '
+            f'транзакцій за {report["seconds"]} с '
+            f'({report["rows_per_second"]} рядків/с); розбіжностей: '
+            f'{report["discrepancy_count"]}, готівка: '
+            f'{report["cash"]["status"]}'
+        )
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as out:
+                out.write(data)
+        else:
+            self.stdout.write(data)
+        failed = report['discrepancy_count'] or \
+            report['cash']['status'] == 'mismatch'
+        if options['fail_on_discrepancy'] and failed:
+            raise CommandError('Знайдено розбіжності')
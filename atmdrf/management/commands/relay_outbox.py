@@ -0,0 +1,50 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from atmdrf.outbox import FileSink, Relay, UnixSocketSink
+
+SINKS = {
+    'file': FileSink,
+    'unix': UnixSocketSink,
+}
+
+
+class Command(BaseCommand):
+    help = 'Публікує події руху коштів з outbox у файл або Unix-сокет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', action='append', required=True,
+                            help='file:ШЛЯХ або unix:ШЛЯХ, можна кілька')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--interval', type=float)
+        parser.add_argument('--once', action='store_true',
+                            help='Опублікувати лише одну порцію')
+        parser.add_argument('--purge', action='store_true',
+                            help='Видалити опубліковані старі події')
+
+    def handle(self, *args, **options):
+        sinks = []
+        for spec in options['sink']:
+            kind, _, path = spec.partition(':')
+            if kind not in SINKS or not path:
+                raise CommandError(f'Невідомий приймач {spec}')
+            sinks.append(SINKS[kind](path))
+        relay = Relay(sinks, batch_size=options['batch_size'])
+        try:
+            if options['once']:
+                count = relay.run_once()
+                self.stderr.write(f'Опубліковано {count} подій')
+            else:
+                stop = threading.Event()
+                signal.signal(signal.SIGTERM, lambda *args: stop.set())
+                try:
+                    relay.run(options['interval'], stop)
+                except KeyboardInterrupt:
+                    pass
+            if options['purge']:
+                self.stderr.write(f'Видалено {relay.purge()} подій')
+        finally:
+            for sink in sinks:
+                sink.close()
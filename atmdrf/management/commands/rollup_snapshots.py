@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from atmdrf.snapshots import rollup
+
+
+class Command(BaseCommand):
+    help = 'Інкрементально згортає журнал транзакцій у денні знімки балансів'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--once', action='store_true',
+                            help='Обробити лише одну порцію')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = 0
+        while True:
+            count = rollup(options['batch_size'])
+            total += count
+            if not count or options['once']:
+                break
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            f'Згорнуто {total} записів за {elapsed:.1f} с'
+        )
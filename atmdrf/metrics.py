@@ -0,0 +1,300 @@
+import asyncio
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.utils.decorators import sync_and_async_middleware
+
+DEFAULTS = {
+    'ENABLED': True,
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                        2.5, 5.0, 10.0),
+    'QUERY_BUCKETS': (0, 1, 2, 3, 5, 10, 20, 50, 100),
+    'SLOW_REQUEST_SECONDS': 0.5,
+    'SLOW_SAMPLE_RATE': 0.1,
+    'MAX_CAPTURED_QUERIES': 50,
+    'ALLOWED_IPS': (),
+    'TOKEN': None,
+    'TOKEN_HEADER': 'X-Metrics-Token',
+}
+
+slow_logger = logging.getLogger('atmdrf.metrics.slow')
+
+
+def metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"'
+                          for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = \
+                    [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), count, total)
+                      for labels, (counts, count, total)
+                      in self._values.items()}
+        names = self.labels + ('le',)
+        for labels, (counts, count, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                yield f'{self.name}_bucket' \
+                      f'{format_labels(names, labels + (bound,))} {cumulative}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} ' \
+                  f'{count}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} ' \
+                  f'{total}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+_config = metrics_settings()
+ROUTE_LABELS = ('route', 'view', 'method')
+
+request_latency = registry.register(Histogram(
+    'atm_http_request_duration_seconds', 'Request latency',
+    ROUTE_LABELS + ('status',), _config['LATENCY_BUCKETS']))
+request_queries = registry.register(Histogram(
+    'atm_db_queries_per_request', 'SQL queries per request',
+    ROUTE_LABELS, _config['QUERY_BUCKETS']))
+request_db_time = registry.register(Histogram(
+    'atm_db_time_per_request_seconds', 'SQL time per request',
+    ROUTE_LABELS, _config['LATENCY_BUCKETS']))
+request_http_time = registry.register(Histogram(
+    'atm_outbound_http_time_per_request_seconds',
+    'Outbound HTTP time per request', ROUTE_LABELS,
+    _config['LATENCY_BUCKETS']))
+outbound_http = registry.register(Histogram(
+    'atm_outbound_http_duration_seconds', 'Outbound HTTP call latency',
+    ('target', 'outcome'), _config['LATENCY_BUCKETS']))
+cache_requests = registry.register(Counter(
+    'atm_cache_requests_total', 'Application cache lookups',
+    ('cache', 'result')))
+slow_requests = registry.register(Counter(
+    'atm_slow_requests_total', 'Requests slower than the threshold',
+    ROUTE_LABELS))
+background_failures = registry.register(Counter(
+    'atm_background_task_failures_total', 'Failed background tasks',
+    ('task',)))
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_count', 'db_time', 'http_time',
+                 'max_queries')
+
+    def __init__(self, max_queries):
+        self.queries = []
+        self.query_count = 0
+        self.db_time = 0.0
+        self.http_time = 0.0
+        self.max_queries = max_queries
+
+
+_current = ContextVar('atmdrf_request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.query_count += 1
+        stats.db_time += elapsed
+        if len(stats.queries) < stats.max_queries:
+            stats.queries.append((sql, round(elapsed * 1000, 3)))
+
+
+def install_query_wrappers():
+    for connection in connections.all():
+        if record_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def track_http(target):
+    """
+    Время исходящего HTTP-запроса: в общую гистограмму и в статистику
+    текущего запроса, если он есть.
+    """
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - started
+        outbound_http.observe(elapsed, target, outcome)
+        stats = _current.get()
+        if stats is not None:
+            stats.http_time += elapsed
+
+
+def cache_event(cache, hit):
+    cache_requests.inc(cache, 'hit' if hit else 'miss')
+
+
+def background_failed(task):
+    background_failures.inc(task)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', 'unresolved'
+    func = match.func
+    view_class = getattr(func, 'cls', None) or \
+        getattr(func, 'view_class', None)
+    name = view_class.__name__ if view_class else \
+        match.view_name or func.__name__
+    actions = getattr(func, 'actions', None)
+    if actions:
+        action = actions.get(request.method.lower())
+        if action:
+            name = f'{name}.{action}'
+    route = (match.route or match.view_name).lstrip('^').rstrip('$')
+    return route, name
+
+
+def start_request(config):
+    install_query_wrappers()
+    stats = RequestStats(config['MAX_CAPTURED_QUERIES'])
+    return _current.set(stats), stats, time.perf_counter()
+
+
+def finish_request(config, request, response, stats, started):
+    elapsed = time.perf_counter() - started
+    route, view = view_label(request)
+    labels = (route, view, request.method)
+    request_latency.observe(elapsed, *labels,
+                            f'{response.status_code // 100}xx')
+    request_queries.observe(stats.query_count, *labels)
+    request_db_time.observe(stats.db_time, *labels)
+    request_http_time.observe(stats.http_time, *labels)
+    if elapsed < config['SLOW_REQUEST_SECONDS']:
+        return
+    slow_requests.inc(*labels)
+    if random.random() < config['SLOW_SAMPLE_RATE']:
+        slow_logger.warning(json.dumps({
+            'route': route,
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+            'queries': stats.query_count,
+            'db_time_ms': round(stats.db_time * 1000, 3),
+            'http_time_ms': round(stats.http_time * 1000, 3),
+            'sql': stats.queries,
+        }, ensure_ascii=False))
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Латентность, число и время SQL, время исходящих HTTP-вызовов по
+    маршруту и действию представления. Медленные запросы с частотой
+    SLOW_SAMPLE_RATE пишутся в лог 'atmdrf.metrics.slow' вместе с SQL.
+    Для потоковых ответов учитывается время до первого байта.
+    """
+    config = metrics_settings()
+    if not config['ENABLED']:
+        return get_response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            token, stats, started = start_request(config)
+            try:
+                response = await get_response(request)
+                finish_request(config, request, response, stats, started)
+            finally:
+                _current.reset(token)
+            return response
+    else:
+        def middleware(request):
+            token, stats, started = start_request(config)
+            try:
+                response = get_response(request)
+                finish_request(config, request, response, stats, started)
+            finally:
+                _current.reset(token)
+            return response
+    return middleware
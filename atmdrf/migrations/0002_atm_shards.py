@@ -0,0 +1,67 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def seed_shards(apps, schema_editor):
+    """
+    Раскладывает наличные каждого банкомата по шардам так же, как
+    ATM.objects.create, до удаления ATM.balance.
+    """
+    db = schema_editor.connection.alias
+    ATM = apps.get_model('atmdrf', 'ATM')
+    ATMShard = apps.get_model('atmdrf', 'ATMShard')
+    shards = getattr(settings, 'ATM_SHARDS', 8)
+    rows = []
+    for atm_id, balance in ATM.objects.using(db).values_list('pk',
+                                                             'balance'):
+        share, rest = divmod(balance, shards)
+        rows.extend(ATMShard(atm_id=atm_id, index=index,
+                             balance=share + (1 if index < rest else 0))
+                    for index in range(shards))
+    ATMShard.objects.using(db).bulk_create(rows, batch_size=1000)
+
+
+def merge_shards(apps, schema_editor):
+    db = schema_editor.connection.alias
+    ATM = apps.get_model('atmdrf', 'ATM')
+    totals = ATM.objects.using(db).annotate(total=Sum('shards__balance'))
+    for atm in totals:
+        ATM.objects.using(db).filter(pk=atm.pk).update(
+            balance=atm.total or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='atm',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=128, verbose_name='Адреса банкомату'),
+        ),
+        migrations.CreateModel(
+            name='ATMShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField(verbose_name='Номер шарда')),
+                ('balance', models.PositiveIntegerField(default=0, verbose_name='Баланс доступної готівки в шарді')),
+                ('atm', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='atmdrf.atm')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='atmshard',
+            constraint=models.UniqueConstraint(fields=('atm', 'index'), name='unique_atm_shard_index'),
+        ),
+        migrations.RunPython(seed_shards, merge_shards),
+        migrations.RemoveField(
+            model_name='atm',
+            name='balance',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0002_atm_shards'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Дата'),
+        ),
+    ]
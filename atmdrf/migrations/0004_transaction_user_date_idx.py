@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0003_transaction_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-date', '-id'], name='transaction_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:08
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+
+def to_minor_units(apps, schema_editor):
+    db = schema_editor.connection.alias
+    apps.get_model('atmdrf', 'ATMShard').objects.using(db).update(
+        balance=F('balance') * 100)
+    apps.get_model('atmdrf', 'Card').objects.using(db).update(
+        balance=Round(F('balance') * 100))
+    apps.get_model('atmdrf', 'Transaction').objects.using(db).update(
+        value=Round(F('value') * 100))
+
+
+def to_major_units(apps, schema_editor):
+    db = schema_editor.connection.alias
+    apps.get_model('atmdrf', 'ATMShard').objects.using(db).update(
+        balance=F('balance') / 100)
+    apps.get_model('atmdrf', 'Card').objects.using(db).update(
+        balance=F('balance') / 100.0)
+    apps.get_model('atmdrf', 'Transaction').objects.using(db).update(
+        value=F('value') / 100.0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0004_transaction_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='atmshard',
+            name='balance',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Баланс доступної готівки в шарді (в копійках)'),
+        ),
+        migrations.RunPython(to_minor_units, to_major_units),
+        migrations.AlterField(
+            model_name='card',
+            name='balance',
+            field=models.BigIntegerField(default=0, verbose_name='Баланс карти (в копійках)'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='value',
+            field=models.BigIntegerField(verbose_name='Сума (в копійках)'),
+        ),
+    ]
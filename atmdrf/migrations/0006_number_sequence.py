@@ -0,0 +1,68 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:09
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+from django.db.models.functions import Length, Substr
+
+
+def highest(queryset, field, length, start, size, **filters):
+    """
+    Наибольший номер счета в поле field длины length: номер занимает
+    size цифр с позиции start, цифры одной длины сравниваются как
+    строки, поэтому хватает одного MAX.
+    """
+    value = queryset.annotate(
+        size=Length(field), number=Substr(field, start + 1, size)
+    ).filter(size=length, **filters).aggregate(
+        value=Max('number'))['value']
+    return int(value) if value else None
+
+
+def seed_sequences(apps, schema_editor):
+    """
+    Ставит счетчики за уже выданными номерами: карты и IBAN раньше
+    генерировались случайно, и аллокатор не должен на них наткнуться.
+    """
+    db = schema_editor.connection.alias
+    config = getattr(settings, 'NUMBER_ALLOCATOR', {})
+    card_bin = config.get('CARD_BIN', '4149')
+    country = config.get('IBAN_COUNTRY', 'UA')
+    bank_code = config.get('IBAN_BANK_CODE', '300000')
+    Card = apps.get_model('atmdrf', 'Card').objects.using(db)
+    User = apps.get_model('atmdrf', 'User').objects.using(db)
+    NumberSequence = apps.get_model('atmdrf', 'NumberSequence')
+    # Карта: BIN, номер счета и контрольная цифра Луна, всего 16 цифр.
+    size = 15 - len(card_bin)
+    cards = [highest(Card, 'card_number', 16, len(card_bin), size,
+                     card_number__startswith=card_bin),
+             highest(User, 'username', 16, len(card_bin), size,
+                     username__startswith=card_bin)]
+    # IBAN: страна, 2 контрольные цифры, код банка и 19 цифр счета.
+    ibans = [highest(User.filter(iban__startswith=country).annotate(
+        bank=Substr('iban', 5, len(bank_code))).filter(bank=bank_code),
+        'iban', 23 + len(bank_code), 4 + len(bank_code), 19)]
+    NumberSequence.objects.using(db).bulk_create([
+        NumberSequence(name=name, next_value=max(
+            [number + 1 for number in numbers if number is not None],
+            default=0))
+        for name, numbers in (('card_number', cards), ('iban', ibans))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0005_minor_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='Послідовність')),
+                ('next_value', models.BigIntegerField(default=0, verbose_name='Наступне вільне значення')),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0006_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='password',
+            field=models.CharField(default='0000', max_length=128, verbose_name='PIN-код'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0007_pin_hash_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версія токенів доступу'),
+        ),
+    ]
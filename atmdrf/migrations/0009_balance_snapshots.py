@@ -0,0 +1,65 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:16
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+import django.db.models.deletion
+
+
+def backfill_cards(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Card = apps.get_model('atmdrf', 'Card')
+    Transaction = apps.get_model('atmdrf', 'Transaction').objects.using(db)
+    for field, types in (('sender', ['Переказ']),
+                         ('receiver', ['Поповнення', 'Зняття готівки',
+                                       'Отримання'])):
+        Transaction.filter(type_transaction__in=types).filter(
+            Exists(Card.objects.filter(card_number=OuterRef(field)))
+        ).update(card_id=models.F(field))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0008_token_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Checkpoint',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='Назва')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Позиція')),
+                ('time_update', models.DateTimeField(auto_now=True, verbose_name='Дата оновлення')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='card',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='journal', to='atmdrf.card', verbose_name='Карта'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['card', 'date'], name='transaction_card_date_idx'),
+        ),
+        migrations.RunPython(backfill_cards, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='DailyBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('closing_balance', models.BigIntegerField(default=0, verbose_name='Баланс на кінець дня (в копійках)')),
+                ('deposits', models.BigIntegerField(default=0, verbose_name='Поповнення')),
+                ('withdrawals', models.BigIntegerField(default=0, verbose_name='Зняття готівки')),
+                ('sent', models.BigIntegerField(default=0, verbose_name='Перекази')),
+                ('received', models.BigIntegerField(default=0, verbose_name='Отримання')),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='atmdrf.card')),
+            ],
+            options={
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailybalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('card', 'day'), name='unique_card_snapshot_day'),
+        ),
+    ]
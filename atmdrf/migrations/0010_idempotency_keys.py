@@ -0,0 +1,23 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0009_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Відбиток запиту')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код відповіді')),
+                ('response', models.JSONField(blank=True, null=True, verbose_name='Відповідь')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Діє до')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0010_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16, verbose_name='Подія')),
+                ('card', models.CharField(max_length=16, verbose_name='Карта')),
+                ('counterparty', models.CharField(blank=True, max_length=16, null=True, verbose_name='Контрагент')),
+                ('value', models.BigIntegerField(verbose_name='Сума (в копійках)')),
+                ('received', models.BigIntegerField(blank=True, null=True, verbose_name='Зараховано (в копійках)')),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата')),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0011_ledger_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, verbose_name='Місяць')),
+                ('path', models.CharField(max_length=255, unique=True, verbose_name='Файл сегмента')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Кількість транзакцій')),
+                ('time_create', models.DateTimeField(auto_now_add=True, verbose_name='Дата архівації')),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchiveIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('rows', models.PositiveIntegerField()),
+                ('first_date', models.DateTimeField()),
+                ('last_date', models.DateTimeField()),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='atmdrf.archivesegment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archiveindex',
+            index=models.Index(fields=['user', '-last_date'], name='archive_user_date_idx'),
+        ),
+    ]
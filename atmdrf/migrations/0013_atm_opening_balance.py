@@ -0,0 +1,47 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:42
+
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def backfill_opening_balance(apps, schema_editor):
+    """
+    Начальная наличность = наличные в шардах - (поповнення - зняття).
+    Журнал не хранит банкомат операции, поэтому вся разница относится
+    на первый банкомат (ATM.objects.default()), остальные получают свои
+    шарды: сверка наличных все равно общая. Если часть журнала уже в
+    архиве, значение не угадывается и остается пустым.
+    """
+    db = schema_editor.connection.alias
+    ATM = apps.get_model('atmdrf', 'ATM')
+    ArchiveSegment = apps.get_model('atmdrf', 'ArchiveSegment')
+    Transaction = apps.get_model('atmdrf', 'Transaction')
+    if ArchiveSegment.objects.using(db).exists():
+        return
+    totals = Transaction.objects.using(db).aggregate(
+        deposits=Sum('value', filter=Q(type_transaction='Поповнення')),
+        withdrawals=Sum('value', filter=Q(type_transaction='Зняття готівки')),
+    )
+    net = (totals['deposits'] or 0) - (totals['withdrawals'] or 0)
+    atms = ATM.objects.using(db).filter(opening_balance__isnull=True) \
+        .annotate(cash=Sum('shards__balance')).order_by('pk')
+    for position, atm in enumerate(atms):
+        ATM.objects.using(db).filter(pk=atm.pk).update(
+            opening_balance=(atm.cash or 0) - (net if position == 0 else 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0012_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='atm',
+            name='opening_balance',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Початкова готівка (в копійках)'),
+        ),
+        migrations.RunPython(backfill_opening_balance,
+                             migrations.RunPython.noop),
+    ]
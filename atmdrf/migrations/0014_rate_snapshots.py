@@ -0,0 +1,31 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0013_atm_opening_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='Відбиток курсів')),
+                ('rates', models.JSONField(verbose_name='Курси')),
+                ('currencies', models.JSONField(verbose_name='Валюти матриці')),
+                ('matrix', models.JSONField(verbose_name='Матриця конвертації')),
+                ('fetched_at', models.DateTimeField(verbose_name='Дата отримання курсів')),
+                ('time_create', models.DateTimeField(auto_now_add=True, verbose_name='Дата створення')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='rate_snapshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='atmdrf.ratesnapshot', verbose_name='Курси переказу'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.1 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0014_rate_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalBatch',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='Пачка журналу')),
+                ('time_create', models.DateTimeField(auto_now_add=True, verbose_name='Дата створення')),
+            ],
+        ),
+    ]
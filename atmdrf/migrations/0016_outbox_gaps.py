@@ -0,0 +1,28 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atmdrf', '0015_journal_batches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxGap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkpoint', models.CharField(max_length=64, verbose_name='Контрольна точка')),
+                ('first', models.BigIntegerField(verbose_name='Перший id')),
+                ('last', models.BigIntegerField(verbose_name='Останній id')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxgap',
+            index=models.Index(fields=['checkpoint', 'first'], name='outbox_gap_checkpoint_idx'),
+        ),
+    ]
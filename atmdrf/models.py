@@ -1,10 +1,17 @@
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.db import models
+from django.db import models, transaction
 
-from random import randint
+from .money import CURRENCIES, Money, div_round, to_minor
+from .rates import get_rate_quote
 
 
 class UserManager(BaseUserManager):
@@ -18,11 +25,8 @@ class UserManager(BaseUserManager):
         user = self.model(**extra_fields)
         user.create_iban()
         user.create_username()
-        try:
-            user.atm = ATM.objects.get(pk=1)
-        except models.ObjectDoesNotExist:
-            ATM.objects.create(balance=10000)
-            user.atm = ATM.objects.get(pk=1)
+        if user.atm_id is None:
+            user.atm = ATM.objects.default()
         user.set_password('0000')
         user.save(using=self._db)
         self._create_card(user)
@@ -56,18 +60,159 @@ class CardManager(models.Manager):
         return card
 
 
+class ATMManager(models.Manager):
+    def create(self, balance=0, shards=None, **kwargs):
+        """
+        Создает банкомат и раскладывает наличные по N строкам-шардам,
+        чтобы операции по разным картам не блокировали одну строку.
+        """
+        shards = shards or getattr(settings, 'ATM_SHARDS', 8)
+        with transaction.atomic(using=self.db):
+            atm = super().create(opening_balance=to_minor(balance),
+                                 **kwargs)
+            share, rest = divmod(to_minor(balance), shards)
+            ATMShard.objects.bulk_create([
+                ATMShard(atm=atm, index=index,
+                         balance=share + (1 if index < rest else 0))
+                for index in range(shards)
+            ])
+        return atm
+
+    def default(self):
+        atm = self.order_by('pk').first()
+        if atm is None:
+            atm = self.create(balance=10000)
+        return atm
+
+
+class RateSnapshotManager(models.Manager):
+    def for_quote(self, quote):
+        """
+        Снимок курсов RateQuote: матрица уже посчитана котировкой,
+        повторные курсы находятся по digest без вставки.
+        """
+        rates = {key: str(value) for key, value in quote.rates.items()}
+        digest = hashlib.sha256(json.dumps(
+            [CURRENCIES, rates], sort_keys=True).encode()).hexdigest()
+        snapshot, _ = self.get_or_create(digest=digest, defaults={
+            'rates': rates,
+            'currencies': list(CURRENCIES),
+            'matrix': [[list(factors) if factors else None
+                        for factors in row] for row in quote.matrix],
+            'fetched_at': datetime.fromtimestamp(quote.fetched_at,
+                                                 dt_timezone.utc),
+        })
+        return snapshot
+
+
 class ATM(models.Model):
+    objects = ATMManager()
+    name = models.CharField(
+        max_length=128,
+        blank=True,
+        default='',
+        verbose_name='Адреса банкомату'
+    )
+    opening_balance = models.BigIntegerField(
+        null=True, blank=True,
+        verbose_name='Початкова готівка (в копійках)'
+    )
+
+    def __str__(self):
+        return self.name or f'ATM {self.pk}'
+
+    @property
+    def balance(self):
+        return self.get_balance()
+
+    def get_balance(self):
+        total = self.shards.aggregate(total=models.Sum('balance'))['total']
+        return total or 0
+
+
+class ATMShard(models.Model):
+    objects = models.Manager()
+    atm = models.ForeignKey(
+        ATM, on_delete=models.CASCADE,
+        related_name='shards'
+    )
+    index = models.PositiveSmallIntegerField(
+        verbose_name='Номер шарда'
+    )
+    balance = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Баланс доступної готівки в шарді (в копійках)'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['atm', 'index'],
+                                    name='unique_atm_shard_index'),
+        ]
+
+    def __str__(self):
+        return f'{self.atm_id}:{self.index} {self.balance}'
+
+
+class NumberSequence(models.Model):
     objects = models.Manager()
-    balance = models.PositiveIntegerField(
+    name = models.CharField(
+        max_length=32,
+        primary_key=True,
+        verbose_name='Послідовність'
+    )
+    next_value = models.BigIntegerField(
         default=0,
-        verbose_name='Баланс доступної готівки в банкоматі'
+        verbose_name='Наступне вільне значення'
+    )
+
+    def __str__(self):
+        return f'{self.name} {self.next_value}'
+
+
+class RateSnapshot(models.Model):
+    """
+    Курсы одного обновления и матрица конвертации N x N: ячейка
+    [source][target] - пара (numerator, denominator) для копеек/центов,
+    в порядке currencies.
+    """
+    objects = RateSnapshotManager()
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='Відбиток курсів'
+    )
+    rates = models.JSONField(
+        verbose_name='Курси'
+    )
+    currencies = models.JSONField(
+        verbose_name='Валюти матриці'
+    )
+    matrix = models.JSONField(
+        verbose_name='Матриця конвертації'
+    )
+    fetched_at = models.DateTimeField(
+        verbose_name='Дата отримання курсів'
+    )
+    time_create = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата створення'
     )
 
     def __str__(self):
-        return str(self.balance)
+        return f'{self.pk} {self.fetched_at}'
 
-    def get_balance(self):
-        return self.balance
+    def convert(self, amount, source, target):
+        """
+        Пересчет суммы по курсам снимка, например для аудита переказу.
+        """
+        if source == target:
+            return amount
+        factors = self.matrix[self.currencies.index(source)][
+            self.currencies.index(target)]
+        if factors is None:
+            raise KeyError((source, target))
+        return div_round(amount * factors[0], factors[1])
 
 
 class Transaction(models.Model):
@@ -80,7 +225,8 @@ class Transaction(models.Model):
     ]
     objects = models.Manager()
     date = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
+        editable=False,
         verbose_name='Дата'
     )
     type_transaction = models.CharField(
@@ -100,20 +246,288 @@ class Transaction(models.Model):
         null=True,
         verbose_name='Отримувач'
     )
-    value = models.FloatField(
-        verbose_name='Сума'
+    value = models.BigIntegerField(
+        verbose_name='Сума (в копійках)'
     )
     user = models.ForeignKey(
         'User', on_delete=models.CASCADE,
         related_name='transaction'
     )
+    card = models.ForeignKey(
+        'Card', on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='journal',
+        verbose_name='Карта'
+    )
+    rate_snapshot = models.ForeignKey(
+        RateSnapshot, on_delete=models.PROTECT,
+        null=True, blank=True,
+        related_name='transactions',
+        verbose_name='Курси переказу'
+    )
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['user', '-date', '-id'],
+                         name='transaction_user_date_idx'),
+            models.Index(fields=['card', 'date'],
+                         name='transaction_card_date_idx'),
+        ]
+
+    @staticmethod
+    def card_for(type_transaction, sender, receiver):
+        """
+        Карта, баланс которой изменила запись: для переказу это
+        отправитель, для всех остальных типов - получатель.
+        """
+        return sender if type_transaction == 'Переказ' else receiver
 
     def __str__(self):
         return f'{self.date} {self.type_transaction} {self.sender} ' \
-               f'{self.receiver} {self.value}'
+               f'{self.receiver} {Money(self.value).to_decimal()}'
+
+
+class JournalBatch(models.Model):
+    """
+    Отметка пачки асинхронного журнала, вставленная в транзакции
+    операции: пачка из write-ahead файла попадает в БД, только если ее
+    отметка закоммичена; сброс пачки удаляет отметку.
+    """
+    objects = models.Manager()
+    id = models.CharField(
+        max_length=32,
+        primary_key=True,
+        verbose_name='Пачка журналу'
+    )
+    time_create = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата створення'
+    )
+
+    def __str__(self):
+        return self.id
+
+
+class Checkpoint(models.Model):
+    objects = models.Manager()
+    name = models.CharField(
+        max_length=64,
+        primary_key=True,
+        verbose_name='Назва'
+    )
+    position = models.BigIntegerField(
+        default=0,
+        verbose_name='Позиція'
+    )
+    time_update = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата оновлення'
+    )
+
+    def __str__(self):
+        return f'{self.name} {self.position}'
+
+
+class LedgerEvent(models.Model):
+    objects = models.Manager()
+    kind = models.CharField(
+        max_length=16,
+        verbose_name='Подія'
+    )
+    card = models.CharField(
+        max_length=16,
+        verbose_name='Карта'
+    )
+    counterparty = models.CharField(
+        max_length=16,
+        null=True, blank=True,
+        verbose_name='Контрагент'
+    )
+    value = models.BigIntegerField(
+        verbose_name='Сума (в копійках)'
+    )
+    received = models.BigIntegerField(
+        null=True, blank=True,
+        verbose_name='Зараховано (в копійках)'
+    )
+    created = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name='Дата'
+    )
+
+    def as_dict(self):
+        return {
+            'offset': self.pk,
+            'kind': self.kind,
+            'card': self.card,
+            'counterparty': self.counterparty,
+            'value': self.value,
+            'received': self.received,
+            'created': self.created.isoformat(),
+        }
+
+    def __str__(self):
+        return f'{self.pk} {self.kind} {self.card} {self.value}'
+
+
+class OutboxGap(models.Model):
+    """
+    Диапазон id событий, через который релей перешагнул по GAP_TIMEOUT.
+    Релей перечитывает его, пока диапазон не старше GAP_HORIZON, и
+    публикует события, закоммиченные с опозданием.
+    """
+    objects = models.Manager()
+    checkpoint = models.CharField(
+        max_length=64,
+        verbose_name='Контрольна точка'
+    )
+    first = models.BigIntegerField(
+        verbose_name='Перший id'
+    )
+    last = models.BigIntegerField(
+        verbose_name='Останній id'
+    )
+    created = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Дата'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['checkpoint', 'first'],
+                         name='outbox_gap_checkpoint_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.checkpoint} {self.first}-{self.last}'
+
+
+class DailyBalanceSnapshot(models.Model):
+    objects = models.Manager()
+    card = models.ForeignKey(
+        'Card', on_delete=models.CASCADE,
+        related_name='snapshots'
+    )
+    day = models.DateField(
+        verbose_name='День'
+    )
+    closing_balance = models.BigIntegerField(
+        default=0,
+        verbose_name='Баланс на кінець дня (в копійках)'
+    )
+    deposits = models.BigIntegerField(
+        default=0,
+        verbose_name='Поповнення'
+    )
+    withdrawals = models.BigIntegerField(
+        default=0,
+        verbose_name='Зняття готівки'
+    )
+    sent = models.BigIntegerField(
+        default=0,
+        verbose_name='Перекази'
+    )
+    received = models.BigIntegerField(
+        default=0,
+        verbose_name='Отримання'
+    )
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['card', 'day'],
+                                    name='unique_card_snapshot_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.card_id} {self.day} {self.closing_balance}'
+
+
+class ArchiveSegment(models.Model):
+    objects = models.Manager()
+    month = models.DateField(
+        db_index=True,
+        verbose_name='Місяць'
+    )
+    path = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Файл сегмента'
+    )
+    rows = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Кількість транзакцій'
+    )
+    time_create = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата архівації'
+    )
+
+    class Meta:
+        ordering = ['-month']
+
+    def __str__(self):
+        return f'{self.month:%Y-%m} {self.path}'
+
+
+class ArchiveIndex(models.Model):
+    """
+    Положение транзакций одного пользователя в сегменте архива:
+    отдельный gzip-member длиной length байт со смещения offset.
+    """
+    objects = models.Manager()
+    segment = models.ForeignKey(
+        ArchiveSegment, on_delete=models.CASCADE,
+        related_name='entries'
+    )
+    user = models.ForeignKey(
+        'User', on_delete=models.CASCADE,
+        related_name='archive'
+    )
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    rows = models.PositiveIntegerField()
+    first_date = models.DateTimeField()
+    last_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-last_date'],
+                         name='archive_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.segment_id} {self.rows}'
+
+
+class IdempotencyKey(models.Model):
+    objects = models.Manager()
+    key = models.CharField(
+        max_length=64,
+        primary_key=True,
+        verbose_name='Ключ'
+    )
+    fingerprint = models.CharField(
+        max_length=64,
+        verbose_name='Відбиток запиту'
+    )
+    status_code = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        verbose_name='Код відповіді'
+    )
+    response = models.JSONField(
+        null=True, blank=True,
+        verbose_name='Відповідь'
+    )
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name='Діє до'
+    )
+
+    def __str__(self):
+        return f'{self.key} {self.status_code}'
 
 
 class Card(models.Model):
@@ -134,9 +548,9 @@ class Card(models.Model):
         default='UAH',
         verbose_name='Валюта карти'
     )
-    balance = models.FloatField(
+    balance = models.BigIntegerField(
         default=0,
-        verbose_name='Баланс карти'
+        verbose_name='Баланс карти (в копійках)'
     )
     user = models.ForeignKey('User', on_delete=models.CASCADE,
                              related_name='wallet')
@@ -145,87 +559,99 @@ class Card(models.Model):
         return f'{self.currency} {self.card_number}'
 
     def create_card(self):
-        random_card = [str(randint(0, 9)) for _ in range(12)]
-        new_card = '4149' + ''.join(random_card)
-        self.card_number = new_card
+        from .allocator import allocate_card_number
+        self.card_number = allocate_card_number()
         return self.card_number
 
+    def get_atm_id(self):
+        return self.user.atm_id or ATM.objects.default().pk
+
+    def get_money(self):
+        return Money(self.balance, self.currency)
+
     def get_balance(self):
-        return f'Баланс карти: {self.balance} {self.currency}'
-
-    def deposit(self, value):
-        atm = ATM.objects.get(pk=1)
-        atm.balance += value
-        self.balance += value
-        self.log_recording('Поповнення', None, self.card_number, value,
-                           self.user)
-        atm.save(), self.save()
-        return f'Баланс рахунку {self} поповнено на {value} {self.currency}'
-
-    def withdraw(self, value):
-        atm = ATM.objects.get(pk=1)
-        if value <= atm.get_balance() and value <= self.balance:
-            self.balance -= value
-            atm.balance -= value
-            self.log_recording('Зняття готівки', None, self.card_number, value,
-                               self.user)
-            atm.save(), self.save()
-            return f'Знято {value} {self.currency}'
-        return f'На вашому рахунку недостатньо коштів для зняття {value} ' \
-               f'{self.currency}' if value > self.balance else \
-            'В банкоматі недостатньо готівки'
+        return f'Баланс карти: {self.get_money()}'
 
-    def send_money(self, value, receiver_card):
-        if value <= self.balance:
-            self.balance -= value
-            if self.currency != receiver_card.currency:
-                value = self.exchange(value, self, receiver_card)
-            receiver_card.balance += value
-            self.log_recording(
-                'Переказ', self.card_number, receiver_card.card_number,
-                value, self.user)
-            self.log_recording(
-                'Отримання', self.card_number, receiver_card.card_number, value,
-                receiver_card.user)
-            self.save(), receiver_card.save()
-            return f'Успішний переказ на {receiver_card} {value} ' \
-                   f'{receiver_card.currency}'
-        return f'На вашому рахунку недостатньо коштів для переказу {value}' \
-               f'{self.currency}'
+    def deposit(self, value, atm_id=None):
+        from .ledger import deposit
+        amount = Money.from_major(value, self.currency)
+        deposit(self, amount.amount, atm_id or self.get_atm_id())
+        return f'Баланс рахунку {self} поповнено на {amount}'
 
-    @staticmethod
-    def log_recording(type_transaction, sender, receiver, value, user):
-        transaction = Transaction.objects.create(
-            type_transaction=type_transaction,
-            sender=sender,
-            receiver=receiver,
-            value=value,
-            user=user
-        )
-        return transaction
+    def withdraw(self, value, atm_id=None):
+        from .ledger import withdraw, InsufficientFunds, ATMOutOfCash
+        amount = Money.from_major(value, self.currency)
+        try:
+            withdraw(self, amount.amount, atm_id or self.get_atm_id())
+        except InsufficientFunds:
+            return f'На вашому рахунку недостатньо коштів для зняття ' \
+                   f'{amount}'
+        except ATMOutOfCash:
+            return 'В банкоматі недостатньо готівки'
+        return f'Знято {amount}'
+
+    def send_money(self, value, receiver_card):
+        from .ledger import send_money, InsufficientFunds
+        amount = Money.from_major(value, self.currency)
+        received = Money(amount.amount, receiver_card.currency)
+        rate_snapshot_id = None
+        if self.currency != receiver_card.currency:
+            received = Money(self.exchange(amount.amount, self,
+                                           receiver_card),
+                             receiver_card.currency)
+            rate_snapshot_id = receiver_card.rate_snapshot_id
+        try:
+            send_money(self, receiver_card, amount.amount, received.amount,
+                       rate_snapshot_id)
+        except InsufficientFunds:
+            return f'На вашому рахунку недостатньо коштів для переказу ' \
+                   f'{amount}'
+        if self.currency != receiver_card.currency:
+            return f'Успішний переказ на {receiver_card} {received} ' \
+                   f'(курс оновлено {int(receiver_card.rate_age)} с тому)'
+        return f'Успішний переказ на {receiver_card} {received}'
+
+    def send_batch(self, items):
+        """
+        Пакетный переказ: items - пары (номер карты получателя, сумма в
+        валюте отправителя). Межвалютные позиции считаются по одному
+        курсу; если их нет, курс не запрашивается.
+        """
+        from .ledger import send_batch
+        amounts = [(card_number, Money.from_major(value, self.currency))
+                   for card_number, value in items]
+        results = send_batch(self, [(card_number, amount.amount)
+                                    for card_number, amount in amounts],
+                             get_rate_quote)
+        for result, (card_number, amount) in zip(results, amounts):
+            error = result.pop('error', None)
+            result['value'] = str(amount)
+            if error == 'not_found':
+                result['result'] = 'Карту отримувача не знайдено'
+            elif error == 'insufficient_funds':
+                result['result'] = f'На вашому рахунку недостатньо коштів ' \
+                                   f'для переказу {amount}'
+            else:
+                received = Money(result.pop('received'),
+                                 result.pop('currency'))
+                result['result'] = f'Успішний переказ на {card_number} ' \
+                                   f'{received}'
+            result['ok'] = error is None
+        return results
 
     @staticmethod
     def exchange(value, sender_card, receiver_card):
-        from atm.utils import get_currency_rate
-        currency_rate = get_currency_rate()
-        exchanger = {
-            'UAH': {
-                'USD': lambda: value / float(currency_rate['usd_sale']),
-                'EUR': lambda: value / float(currency_rate['eur_sale'])
-            },
-            'USD': {
-                'EUR': lambda: ((currency_rate['usd_sale'] * value) /
-                                currency_rate['eur_buy']),
-                'UAH': lambda: value * float(currency_rate['usd_buy'])
-            },
-            'EUR': {
-                'USD': lambda: ((currency_rate['eur_buy'] * value) /
-                                currency_rate['usd_sale']),
-                'UAH': lambda: value * float(currency_rate['eur_buy'])
-            }
-        }
-        result = exchanger[sender_card.currency][receiver_card.currency]()
-        return round(result, 2)
+        """
+        Конвертирует value (в копейках/центах валюты отправителя) в
+        копейки/центы валюты получателя по матрице текущей котировки и
+        запоминает на картах ее возраст и снимок курсов.
+        """
+        quote = get_rate_quote()
+        sender_card.rate_age = receiver_card.rate_age = quote.age
+        sender_card.rate_snapshot_id = receiver_card.rate_snapshot_id = \
+            quote.snapshot_id
+        return quote.convert(value, sender_card.currency,
+                             receiver_card.currency)
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -244,7 +670,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     )
     password = models.CharField(
         _("PIN-код"),
-        max_length=4, default='0000'
+        max_length=128, default='0000'
     )
     last_name = models.CharField(
         max_length=30,
@@ -281,11 +707,20 @@ class User(AbstractBaseUser, PermissionsMixin):
         on_delete=models.SET_NULL,
         null=True, blank=True
     )
+    token_version = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Версія токенів доступу'
+    )
 
     USERNAME_FIELD = 'username'
 
     REQUIRED_FIELDS = ['first_name', 'last_name', 'phone_number']
 
+    # Поля, попадающие в claims JWT или в проверку PIN-кода: их смена
+    # отзывает выданные токены.
+    TOKEN_FIELDS = ('password', 'is_active', 'is_staff', 'is_superuser',
+                    'atm_id')
+
     class Meta:
         verbose_name = _('user')
         verbose_name_plural = _('users')
@@ -293,23 +728,63 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.iban
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._token_state = instance.token_state()
+        return instance
+
+    def token_state(self):
+        # Отложенные (defer/only) поля не загружены и не сравниваются.
+        return {field: self.__dict__[field] for field in self.TOKEN_FIELDS
+                if field in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_token_state', {})
+        super().save(*args, **kwargs)
+        state = self.token_state()
+        if getattr(self, '_rehashing', False):
+            # Пересчет хеша того же PIN-кода при входе - не смена PIN.
+            previous = {**previous, 'password': state.get('password')}
+        if any(field in state and state[field] != value
+               for field, value in previous.items()):
+            self.revoke_tokens()
+        self._token_state = state
+
+    def check_password(self, raw_password):
+        self._rehashing = True
+        try:
+            return super().check_password(raw_password)
+        finally:
+            self._rehashing = False
+
     def create_username(self):
-        random_card = [str(randint(0, 9)) for _ in range(12)]
-        new_card = '4149' + ''.join(random_card)
-        self.username = new_card
+        from .allocator import allocate_card_number
+        self.username = allocate_card_number()
         return self.username
 
     def create_iban(self):
-        country = 'UA'
-        code = '0000'
-        random_iban = [str(randint(0, 9)) for _ in range(12)]
-        new_iban = country + code + ''.join(random_iban)
-        return self.set_iban(new_iban)
+        from .allocator import allocate_iban
+        return self.set_iban(allocate_iban())
 
     def set_iban(self, iban):
         self.iban = iban
         return self.iban
 
+    def revoke_tokens(self):
+        """
+        Отзывает все выданные JWT пользователя увеличением версии токенов.
+        """
+        from .authentication import get_token_versions
+        users = User.objects.filter(pk=self.pk)
+        users.update(token_version=models.F('token_version') + 1)
+        self.token_version = users.values_list('token_version',
+                                               flat=True).get()
+        version = self.token_version
+        transaction.on_commit(
+            lambda: get_token_versions().set(self.pk, version))
+        return version
+
     def change_pin(self, current_pin, pin1, pin2):
         if not self.check_password(current_pin):
             return f'Поточний PIN-код неправильний'
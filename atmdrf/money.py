@@ -0,0 +1,190 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+MINOR_UNITS = {
+    'UAH': 2,
+    'USD': 2,
+    'EUR': 2,
+}
+
+# Валюты матрицы курсов, в порядке строк и столбцов.
+CURRENCIES = tuple(MINOR_UNITS)
+
+RATE_SCALE = 10 ** 6
+
+# Конвертация src -> dst: amount * numerator / denominator, где ключи
+# ссылаются на курсы PrivatBank, а None означает единицу.
+EXCHANGE_TABLE = {
+    ('UAH', 'USD'): (None, 'usd_sale'),
+    ('UAH', 'EUR'): (None, 'eur_sale'),
+    ('USD', 'EUR'): ('usd_sale', 'eur_buy'),
+    ('USD', 'UAH'): ('usd_buy', None),
+    ('EUR', 'USD'): ('eur_buy', 'usd_sale'),
+    ('EUR', 'UAH'): ('eur_buy', None),
+}
+
+
+def minor_exponent(currency):
+    return MINOR_UNITS.get(currency, 2)
+
+
+def to_minor(value, currency='UAH'):
+    """
+    Переводит сумму в основных единицах (int, str, Decimal) в целое
+    число копеек/центов.
+    """
+    exponent = minor_exponent(currency)
+    minor = (Decimal(str(value)) * 10 ** exponent).quantize(
+        Decimal(1), rounding=ROUND_HALF_UP)
+    return int(minor)
+
+
+def to_major(minor, currency='UAH'):
+    return Decimal(minor).scaleb(-minor_exponent(currency))
+
+
+def format_minor(minor, currency='UAH'):
+    """
+    Быстрое форматирование суммы в копейках без Decimal, для выгрузок.
+    """
+    exponent = minor_exponent(currency)
+    sign = '-' if minor < 0 else ''
+    major, rest = divmod(abs(minor), 10 ** exponent)
+    if not exponent:
+        return f'{sign}{major}'
+    return f'{sign}{major}.{rest:0{exponent}d}'
+
+
+def scale_rate(rate):
+    return int((Decimal(str(rate)) * RATE_SCALE).quantize(
+        Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def scale_rates(rates):
+    return {key: scale_rate(rate) for key, rate in rates.items()}
+
+
+def div_round(numerator, denominator):
+    """
+    Целочисленное деление с округлением половины вверх. Работает и для
+    int, и для целочисленных массивов NumPy.
+    """
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def exchange_factors(source, target, scaled_rates):
+    numerator_key, denominator_key = EXCHANGE_TABLE[(source, target)]
+    numerator = scaled_rates[numerator_key] if numerator_key else RATE_SCALE
+    denominator = scaled_rates[denominator_key] if denominator_key \
+        else RATE_SCALE
+    shift = minor_exponent(target) - minor_exponent(source)
+    if shift > 0:
+        numerator *= 10 ** shift
+    elif shift < 0:
+        denominator *= 10 ** -shift
+    return numerator, denominator
+
+
+def exchange_matrix(currencies, scaled_rates):
+    """
+    Матрица N x N множителей (numerator, denominator) для всех пар
+    currencies. Пары без прямой строки в EXCHANGE_TABLE считаются
+    кросс-курсом через гривню с одним округлением; None - пару
+    сконвертировать нельзя.
+    """
+    def factors(source, target):
+        if source == target:
+            return 1, 1
+        if (source, target) in EXCHANGE_TABLE:
+            return exchange_factors(source, target, scaled_rates)
+        if ('UAH', target) not in EXCHANGE_TABLE or \
+                (source, 'UAH') not in EXCHANGE_TABLE:
+            return None
+        to_base = exchange_factors(source, 'UAH', scaled_rates)
+        from_base = exchange_factors('UAH', target, scaled_rates)
+        return to_base[0] * from_base[0], to_base[1] * from_base[1]
+
+    return tuple(tuple(factors(source, target) for target in currencies)
+                 for source in currencies)
+
+
+def exchange_minor(amount, source, target, scaled_rates):
+    if source == target:
+        return amount
+    numerator, denominator = exchange_factors(source, target, scaled_rates)
+    return div_round(amount * numerator, denominator)
+
+
+class Money:
+    """
+    Неизменяемая сумма в копейках/центах: годится ключом словаря.
+    """
+    __slots__ = ('amount', 'currency')
+
+    def __init__(self, amount, currency='UAH'):
+        object.__setattr__(self, 'amount', int(amount))
+        object.__setattr__(self, 'currency', currency)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Money is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Money is immutable')
+
+    @classmethod
+    def from_major(cls, value, currency='UAH'):
+        return cls(to_minor(value, currency), currency)
+
+    def to_decimal(self):
+        return to_major(self.amount, self.currency)
+
+    def _check(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        if other.currency != self.currency:
+            raise ValueError(
+                f'Різні валюти: {self.currency} і {other.currency}')
+        return other.amount
+
+    def __add__(self, other):
+        amount = self._check(other)
+        if amount is NotImplemented:
+            return amount
+        return Money(self.amount + amount, self.currency)
+
+    def __sub__(self, other):
+        amount = self._check(other)
+        if amount is NotImplemented:
+            return amount
+        return Money(self.amount - amount, self.currency)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return (self.amount, self.currency) == (other.amount, other.currency)
+
+    def __lt__(self, other):
+        amount = self._check(other)
+        if amount is NotImplemented:
+            return amount
+        return self.amount < amount
+
+    def __le__(self, other):
+        amount = self._check(other)
+        if amount is NotImplemented:
+            return amount
+        return self.amount <= amount
+
+    def __hash__(self):
+        return hash((self.amount, self.currency))
+
+    def __repr__(self):
+        return f'Money({self.amount}, {self.currency!r})'
+
+    def __str__(self):
+        return f'{self.to_decimal()} {self.currency}'
+
+    def exchange(self, target, scaled_rates):
+        return Money(
+            exchange_minor(self.amount, self.currency, target, scaled_rates),
+            target
+        )
@@ -0,0 +1,172 @@
+import csv
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .allocator import allocate_card_numbers, allocate_ibans
+from .models import ATM, Card, User
+
+DEFAULT_PIN = '0000'
+REGISTER_FIELDS = ('first_name', 'last_name', 'phone_number')
+
+
+def read_rows(stream, fmt='csv'):
+    """
+    Построчно читает анкеты клиентов из текстового потока CSV (с
+    заголовком) или JSONL.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def text_lines(binary, encoding='utf-8'):
+    """
+    Строки бинарного потока (загруженного файла или тела запроса) по
+    одной, без чтения потока целиком. В UTF-8 байт перевода строки не
+    встречается внутри символа, поэтому строку можно декодировать
+    отдельно.
+    """
+    for line in binary:
+        yield line.decode(encoding)
+
+
+def normalize_row(row):
+    return {name: str(row.get(name) or '').strip()
+            for name in REGISTER_FIELDS}
+
+
+def validate_row(row):
+    errors = {}
+    for name, value in row.items():
+        max_length = User._meta.get_field(name).max_length
+        if not value:
+            errors[name] = 'Обов\'язкове поле'
+        elif len(value) > max_length:
+            errors[name] = f'Не більше {max_length} символів'
+    return errors
+
+
+def _setup_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _hash_pin(pin):
+    return make_password(pin)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(processes):
+    """
+    Пул процессов для хеширования, общий для всех импортов процесса:
+    запуск воркеров с django.setup() стоит дороже самого импорта.
+    """
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None:
+            pool = _pools[processes] = ProcessPoolExecutor(
+                max_workers=processes, initializer=_setup_worker)
+        return pool
+
+
+class PinHasher:
+    """
+    Заранее хеширует PIN-коды по умолчанию в пуле процессов, у каждого
+    пользователя своя соль.
+    """
+
+    def __init__(self, processes=None, pin=DEFAULT_PIN):
+        self.pin = pin
+        self.processes = processes or os.cpu_count() or 1
+        self._pool = get_pool(self.processes)
+
+    def hashes(self, count):
+        chunksize = max(count // (self.processes * 4), 1)
+        return list(self._pool.map(_hash_pin, [self.pin] * count,
+                                   chunksize=chunksize))
+
+    def close(self):
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_register(rows, chunk_size=1000, processes=None, atm=None,
+                  hasher=None):
+    """
+    Массовая регистрация: пользователи и их карты создаются bulk_create
+    пачками по chunk_size, каждая пачка в своей транзакции. Генератор
+    отдает результат по каждой строке входа. hasher - источник хешей
+    PIN-кодов с методом hashes(count), по умолчанию PinHasher.
+    """
+    atm = atm or ATM.objects.default()
+    with hasher or PinHasher(processes) as hasher:
+        number = 0
+        for chunk in _chunks(rows, chunk_size):
+            valid = []
+            results = []
+            for row in chunk:
+                number += 1
+                row = normalize_row(row)
+                errors = validate_row(row)
+                if errors:
+                    results.append({'row': number, 'status': 'error',
+                                    'errors': errors})
+                else:
+                    valid.append((number, row))
+            if valid:
+                results.extend(_create_chunk(valid, hasher, atm))
+            yield from sorted(results, key=lambda result: result['row'])
+
+
+def _create_chunk(valid, hasher, atm):
+    ibans = allocate_ibans(len(valid))
+    card_numbers = allocate_card_numbers(len(valid))
+    passwords = hasher.hashes(len(valid))
+    users = [
+        User(
+            iban=iban,
+            username=card_number,
+            password=password,
+            atm=atm,
+            **row
+        )
+        for (_, row), iban, card_number, password
+        in zip(valid, ibans, card_numbers, passwords)
+    ]
+    cards = [Card(card_number=user.username, user=user) for user in users]
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        Card.objects.bulk_create(cards)
+    return [
+        {'row': number, 'status': 'created', 'login': user.username,
+         'iban': user.iban, 'pin': DEFAULT_PIN}
+        for (number, _), user in zip(valid, users)
+    ]
@@ -0,0 +1,376 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Checkpoint, LedgerEvent, OutboxGap
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 0.5,
+    'GAP_TIMEOUT': 10,
+    'GAP_HORIZON': 60 * 60,
+    'RETENTION': 7 * 24 * 60 * 60,
+    'CHECKPOINT': 'outbox-relay',
+}
+
+logger = logging.getLogger('atmdrf.outbox')
+
+
+def outbox_settings():
+    return {**DEFAULTS, **getattr(settings, 'LEDGER_OUTBOX', {})}
+
+
+class Outbox:
+    """
+    События движения денег одной операции; commit() вставляет их одним
+    bulk_create в текущую транзакцию БД, рядом с проводками.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.events = []
+
+    def add(self, kind, card, value, counterparty=None, received=None):
+        self.events.append(LedgerEvent(kind=kind, card=card, value=value,
+                                       counterparty=counterparty,
+                                       received=received))
+
+    def commit(self):
+        events, self.events = self.events, []
+        if events:
+            LedgerEvent.objects.using(self.using).bulk_create(events)
+        return events
+
+
+def events_after(offset, limit=500, until=None):
+    """
+    Чтение потока с позиции offset (не включая ее): только по
+    первичному ключу таблицы событий, без горячих таблиц журнала.
+    """
+    queryset = LedgerEvent.objects.filter(id__gt=offset)
+    if until is not None:
+        queryset = queryset.filter(id__lte=until)
+    return [event.as_dict() for event in queryset.order_by('id')[:limit]]
+
+
+def encode(events):
+    return ''.join(json.dumps(event, ensure_ascii=False) + '\n'
+                   for event in events).encode()
+
+
+class FileSink:
+    """
+    NDJSON-файл событий: потребитель читает его как tail -f и помнит
+    offset последней обработанной строки.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, 'ab')
+
+    def publish(self, events):
+        self._file.write(encode(events))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class UnixSocketSink:
+    """
+    Поток событий через Unix-сокет. Клиент после подключения
+    отправляет строку с последним полученным offset (пустая строка -
+    только новые события), получает недостающие события из таблицы, а
+    затем все новые. Медленный клиент отключается по таймауту записи.
+    """
+
+    def __init__(self, path, send_timeout=5.0, backlog=16):
+        self.path = path
+        self.send_timeout = send_timeout
+        self.position = 0
+        self._clients = []
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(backlog)
+        self._closed = False
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def seek(self, position):
+        self.position = position
+
+    def publish(self, events):
+        data = encode(events)
+        with self._lock:
+            # Опоздавшие события из дыр идут с offset меньше position.
+            self.position = max(self.position, events[-1]['offset'])
+            for client in list(self._clients):
+                try:
+                    client.sendall(data)
+                except OSError:
+                    self._drop(client)
+
+    def close(self):
+        self._closed = True
+        self._server.close()
+        with self._lock:
+            for client in list(self._clients):
+                self._drop(client)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _drop(self, client):
+        self._clients.remove(client)
+        client.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handshake, args=(client,),
+                             daemon=True).start()
+
+    def _handshake(self, client):
+        """
+        Недостающие события отправляются без блокировки публикации:
+        медленный клиент не задерживает остальных. Клиент добавляется в
+        рассылку под блокировкой, только когда догнал position.
+        """
+        try:
+            client.settimeout(self.send_timeout)
+            line = client.makefile('rb').readline().strip()
+            offset = int(line) if line else None
+            while True:
+                if offset is not None:
+                    position = self.position
+                    while offset < position:
+                        events = events_after(offset, until=position)
+                        if not events:
+                            offset = position
+                            break
+                        client.sendall(encode(events))
+                        offset = events[-1]['offset']
+                with self._lock:
+                    if offset is None or offset >= self.position:
+                        self._clients.append(client)
+                        return
+        except (OSError, ValueError):
+            client.close()
+        finally:
+            close_old_connections()
+
+
+class LocalSink:
+    """
+    Подписчики внутри процесса: callback(events) вызывается для каждой
+    опубликованной пачки. Ошибка подписчика не останавливает поток.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(events)
+            except Exception:
+                logger.exception('Outbox subscriber failed')
+
+
+local_stream = LocalSink()
+
+
+def subscribe(callback):
+    return local_stream.subscribe(callback)
+
+
+def checkpoint_name(consumer=None):
+    """
+    Контрольные точки потребителей outbox: CHECKPOINT или
+    CHECKPOINT:<consumer>. По ним purge находит самую отстающую.
+    """
+    prefix = outbox_settings()['CHECKPOINT']
+    return f'{prefix}:{consumer}' if consumer else prefix
+
+
+class Relay:
+    """
+    Публикует события из outbox по возрастанию id пачками и сдвигает
+    контрольную точку после успешной публикации (доставка "хотя бы
+    один раз", потребители отбрасывают повторы по offset).
+
+    Id, выданный еще не закоммиченной транзакции, выглядит как дыра в
+    последовательности: релей ждет ее до GAP_TIMEOUT секунд, прежде чем
+    перешагнуть (дыры от откатов в PostgreSQL не заполняются никогда).
+    Перешагнутые диапазоны записываются в OutboxGap и перечитываются
+    до GAP_HORIZON: опоздавшее событие публикуется с offset меньше
+    уже опубликованных.
+    """
+
+    def __init__(self, sinks, batch_size=None, gap_timeout=None,
+                 gap_horizon=None, consumer=None):
+        config = outbox_settings()
+        self.sinks = list(sinks)
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.gap_timeout = config['GAP_TIMEOUT'] if gap_timeout is None \
+            else gap_timeout
+        self.gap_horizon = config['GAP_HORIZON'] if gap_horizon is None \
+            else gap_horizon
+        self.checkpoint = checkpoint_name(consumer)
+        self._gap = None
+        position = self.position()
+        for sink in self.sinks:
+            if hasattr(sink, 'seek'):
+                sink.seek(position)
+
+    def position(self):
+        return Checkpoint.objects.filter(pk=self.checkpoint).values_list(
+            'position', flat=True).first() or 0
+
+    def run_once(self):
+        with transaction.atomic():
+            checkpoint, _ = Checkpoint.objects.select_for_update() \
+                .get_or_create(pk=self.checkpoint)
+            late = self._late_events()
+            events = events_after(checkpoint.position, self.batch_size)
+            ready, gaps = self._contiguous(checkpoint.position, events)
+            if not late and not ready:
+                return 0
+            for sink in self.sinks:
+                sink.publish(late + ready)
+            if gaps:
+                OutboxGap.objects.bulk_create([
+                    OutboxGap(checkpoint=self.checkpoint, first=first,
+                              last=last) for first, last in gaps])
+            if ready:
+                checkpoint.position = ready[-1]['offset']
+                checkpoint.save(update_fields=['position', 'time_update'])
+        return len(late) + len(ready)
+
+    def _contiguous(self, position, events):
+        expected = position + 1
+        ready, gaps = [], []
+        for event in events:
+            if event['offset'] != expected:
+                if self._gap is None or self._gap[0] != expected:
+                    self._gap = (expected, time.monotonic())
+                if time.monotonic() - self._gap[1] < self.gap_timeout:
+                    break
+                gaps.append((expected, event['offset'] - 1))
+            ready.append(event)
+            expected = event['offset'] + 1
+        return ready, gaps
+
+    def _late_events(self):
+        """
+        События, закоммиченные внутри перешагнутых диапазонов. Диапазон
+        дробится вокруг найденных id, устаревшие удаляются.
+        """
+        gaps = OutboxGap.objects.filter(checkpoint=self.checkpoint)
+        gaps.filter(created__lt=timezone.now() -
+                    timedelta(seconds=self.gap_horizon)).delete()
+        gaps = list(gaps.order_by('first'))
+        if not gaps:
+            return []
+        condition = Q()
+        for gap in gaps:
+            condition |= Q(id__gte=gap.first, id__lte=gap.last)
+        events = [event.as_dict() for event in
+                  LedgerEvent.objects.filter(condition).order_by('id')]
+        if not events:
+            return []
+        found = [event['offset'] for event in events]
+        remaining = []
+        for gap in gaps:
+            first = gap.first
+            for offset in found:
+                if gap.first <= offset <= gap.last:
+                    if first < offset:
+                        remaining.append(OutboxGap(
+                            checkpoint=gap.checkpoint, first=first,
+                            last=offset - 1, created=gap.created))
+                    first = offset + 1
+            if first <= gap.last:
+                remaining.append(OutboxGap(
+                    checkpoint=gap.checkpoint, first=first, last=gap.last,
+                    created=gap.created))
+        OutboxGap.objects.filter(pk__in=[gap.pk for gap in gaps]).delete()
+        OutboxGap.objects.bulk_create(remaining)
+        return events
+
+    def run(self, interval=None, stop=None):
+        interval = outbox_settings()['POLL_INTERVAL'] \
+            if interval is None else interval
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                published = self.run_once()
+            except Exception:
+                logger.exception('Outbox relay failed')
+                published = 0
+            finally:
+                close_old_connections()
+            if not published:
+                stop.wait(interval)
+
+    def purge(self, retention=None):
+        """
+        Удаляет события старше retention секунд, опубликованные всеми
+        потребителями: граница - минимальная позиция среди контрольных
+        точек outbox. Контрольную точку выведенного из работы
+        потребителя нужно удалить, иначе она держит события.
+        """
+        retention = outbox_settings()['RETENTION'] \
+            if retention is None else retention
+        prefix = outbox_settings()['CHECKPOINT']
+        position = Checkpoint.objects.filter(
+            Q(pk=prefix) | Q(pk__startswith=f'{prefix}:')
+        ).aggregate(position=Min('position'))['position'] or 0
+        return LedgerEvent.objects.filter(
+            id__lte=position,
+            created__lt=timezone.now() - timedelta(seconds=retention)
+        ).delete()[0]
+
+
+def start_local_relay(interval=None, consumer='local'):
+    """
+    Релей в фоновом потоке текущего процесса, публикующий только
+    подписчикам subscribe(). Контрольная точка именованная и общая:
+    после перезапуска поток продолжается с места остановки, а процессы
+    с одним consumer делят события между собой. Возвращает Event для
+    остановки.
+    """
+    stop = threading.Event()
+    relay = Relay([local_stream], consumer=consumer)
+    threading.Thread(target=relay.run, args=(interval, stop),
+                     daemon=True).start()
+    return stop
@@ -1,3 +1,5 @@
+from hmac import compare_digest
+
 from rest_framework import permissions
 
 
@@ -14,3 +16,22 @@ class IsOwnerAccount(permissions.BasePermission):
 class IsAnonymous(permissions.BasePermission):
     def has_permission(self, request, view):
         return bool(not request.user.is_authenticated)
+
+
+class IsMetricsScraper(permissions.BasePermission):
+    """
+    Сборщик метрик: заголовок с токеном METRICS['TOKEN'] или адрес из
+    METRICS['ALLOWED_IPS'] (по умолчанию пусто: за обратным прокси все
+    запросы приходят с localhost). Иначе - только персонал.
+    """
+
+    def has_permission(self, request, view):
+        from .metrics import metrics_settings
+        config = metrics_settings()
+        token = request.headers.get(config['TOKEN_HEADER'])
+        if config['TOKEN'] and token and \
+                compare_digest(token.encode(), config['TOKEN'].encode()):
+            return True
+        if request.META.get('REMOTE_ADDR') in config['ALLOWED_IPS']:
+            return True
+        return bool(request.user and request.user.is_staff)
@@ -0,0 +1,368 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .metrics import background_failed, cache_event, track_http
+from .money import CURRENCIES, div_round, exchange_matrix, scale_rates
+
+PRIVATBANK_URL = \
+    'https://api.privatbank.ua/p24api/pubinfo?json&exchange&coursid=5'
+
+DEFAULTS = {
+    'SOURCE': 'atmdrf.rates.PrivatBankRateSource',
+    'OPTIONS': {},
+    'TTL': 60,
+    'STALE_TTL': 60 * 60,
+    'CACHE_ALIAS': 'default',
+    'CACHE_KEY': 'atmdrf:currency-rate',
+    'LOCK_TIMEOUT': 30,
+}
+
+logger = logging.getLogger('atmdrf.rates')
+
+
+def rates_settings():
+    return {**DEFAULTS, **getattr(settings, 'CURRENCY_RATES', {})}
+
+
+def parse_privatbank(payload):
+    """
+    Приводит ответ PrivatBank (или фикстуру в том же формате) к словарю
+    курсов, который отдает API.
+    """
+    if isinstance(payload, dict):
+        return {key: payload[key] for key in
+                ('usd_buy', 'usd_sale', 'eur_buy', 'eur_sale')}
+    by_currency = {row['ccy']: row for row in payload}
+    return {
+        'usd_buy': by_currency['USD']['buy'],
+        'usd_sale': by_currency['USD']['sale'],
+        'eur_buy': by_currency['EUR']['buy'],
+        'eur_sale': by_currency['EUR']['sale'],
+    }
+
+
+class PrivatBankRateSource:
+    def __init__(self, url=PRIVATBANK_URL, timeout=5, pool_maxsize=10):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                              max_retries=1)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool_maxsize = pool_maxsize
+        self._async_client = None
+
+    def fetch(self):
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_privatbank(response.json())
+
+    async def afetch(self):
+        """
+        Неблокирующий запрос курса через httpx; без httpx - синхронный
+        fetch в отдельном потоке.
+        """
+        if httpx is None:
+            return await sync_to_async(self.fetch, thread_sensitive=False)()
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_maxsize),
+                transport=httpx.AsyncHTTPTransport(retries=1)
+            )
+        response = await self._async_client.get(self.url)
+        response.raise_for_status()
+        return parse_privatbank(response.json())
+
+
+class FixtureRateSource:
+    """
+    Локальный источник курсов для тестов и офлайн-развертываний.
+    """
+    default_path = Path(__file__).resolve().parent / 'fixtures' / \
+        'currency_rate.json'
+
+    def __init__(self, path=None, rates=None):
+        self.path = Path(path) if path else self.default_path
+        self.rates = rates
+
+    def fetch(self):
+        if self.rates is not None:
+            return parse_privatbank(self.rates)
+        with open(self.path, encoding='utf-8') as fixture:
+            return parse_privatbank(json.load(fixture))
+
+
+CURRENCY_INDEX = {currency: index for index, currency in
+                  enumerate(CURRENCIES)}
+
+
+class RateQuote:
+    """
+    Курсы одного обновления: матрица конвертации строится один раз на
+    обновление, снимок в БД создается при первой конвертации.
+    """
+    __slots__ = ('rates', 'scaled_rates', 'fetched_at', 'matrix',
+                 '_snapshot_id')
+
+    def __init__(self, rates, fetched_at=None):
+        self.rates = rates
+        self.scaled_rates = scale_rates(rates)
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.matrix = exchange_matrix(CURRENCIES, self.scaled_rates)
+        self._snapshot_id = None
+
+    def factors(self, source, target):
+        factors = self.matrix[CURRENCY_INDEX[source]][CURRENCY_INDEX[target]]
+        if factors is None:
+            raise KeyError((source, target))
+        return factors
+
+    def convert(self, amount, source, target):
+        if source == target:
+            return amount
+        numerator, denominator = self.factors(source, target)
+        return div_round(amount * numerator, denominator)
+
+    @property
+    def snapshot_id(self):
+        """
+        Id RateSnapshot этих курсов: одинаковые курсы разных обновлений
+        и процессов дают один снимок (уникальный digest), так что запрос
+        к БД - один на обновление курса в процессе.
+        """
+        if self._snapshot_id is not None:
+            return self._snapshot_id
+        from .models import RateSnapshot
+        pk = RateSnapshot.objects.for_quote(self).pk
+        # Запоминается только закоммиченный снимок: при откате внешней
+        # транзакции следующий вызов создаст его заново.
+        transaction.on_commit(lambda: setattr(self, '_snapshot_id', pk))
+        return pk
+
+    @property
+    def age(self):
+        return max(time.time() - self.fetched_at, 0.0)
+
+    def as_dict(self):
+        return {**self.rates, 'age': round(self.age, 1)}
+
+
+class RateProvider:
+    """
+    Курсы валют с локальным TTL-кешем поверх общего кеш-бэкенда.
+
+    Свежий курс отдается сразу; устаревший (но моложе stale_ttl) тоже
+    отдается сразу, а обновление запускается в фоне. Источник опрашивает
+    только один поток процесса и только один процесс на общем кеше.
+    """
+
+    def __init__(self, source, ttl=60, stale_ttl=3600, cache_alias='default',
+                 cache_key='atmdrf:currency-rate', lock_timeout=30):
+        self.source = source
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.cache_alias = cache_alias
+        self.cache_key = cache_key
+        self.lock_key = f'{cache_key}:lock'
+        self.lock_timeout = lock_timeout
+        self._quote = None
+        self._lock = threading.Lock()
+        # Отдельный от _lock: его держит refresh() на время запроса к
+        # источнику, а фоновое обновление запускается без ожидания.
+        self._refreshing = threading.Lock()
+        self._async_refresh = None
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get(self):
+        quote = self._quote
+        if quote is None or quote.age >= self.ttl:
+            quote = self._newest(quote, self._from_shared())
+        if quote is not None and quote.age < self.ttl:
+            cache_event('currency-rate', True)
+            return quote
+        if quote is not None and quote.age < self.stale_ttl:
+            cache_event('currency-rate', True)
+            self.refresh_in_background()
+            return quote
+        cache_event('currency-rate', False)
+        return self.refresh()
+
+    def refresh(self):
+        with self._lock:
+            quote = self._newest(self._quote, self._from_shared())
+            if quote is not None and quote.age < self.ttl:
+                return quote
+            locked = self.cache.add(self.lock_key, 1, self.lock_timeout)
+            if not locked and quote is not None \
+                    and quote.age < self.stale_ttl:
+                return quote
+            try:
+                with track_http('currency-rate'):
+                    rates = self.source.fetch()
+                return self._store(RateQuote(rates))
+            finally:
+                if locked:
+                    self.cache.delete(self.lock_key)
+
+    async def aget(self):
+        """
+        То же, что get(), для асинхронных представлений: ожидание курса
+        не занимает поток, одновременные запросы ждут один и тот же
+        запрос к источнику.
+        """
+        quote = self._quote
+        if quote is None or quote.age >= self.ttl:
+            quote = self._newest(quote, await self._afrom_shared())
+        if quote is not None and quote.age < self.ttl:
+            cache_event('currency-rate', True)
+            return quote
+        if quote is not None and quote.age < self.stale_ttl:
+            cache_event('currency-rate', True)
+            self.refresh_in_background()
+            return quote
+        cache_event('currency-rate', False)
+        return await self.arefresh()
+
+    async def arefresh(self):
+        task = self._async_refresh
+        if task is None or task.done() or \
+                task.get_loop() is not asyncio.get_running_loop():
+            task = self._async_refresh = asyncio.ensure_future(
+                self._arefresh())
+        return await asyncio.shield(task)
+
+    async def _arefresh(self):
+        quote = self._newest(self._quote, await self._afrom_shared())
+        if quote is not None and quote.age < self.ttl:
+            return quote
+        locked = await self.cache.aadd(self.lock_key, 1, self.lock_timeout)
+        if not locked and quote is not None and quote.age < self.stale_ttl:
+            return quote
+        try:
+            fetch = getattr(self.source, 'afetch', None) or \
+                sync_to_async(self.source.fetch, thread_sensitive=False)
+            with track_http('currency-rate'):
+                rates = await fetch()
+            quote = RateQuote(rates)
+            await self.cache.aset(self.cache_key, self._dump(quote),
+                                  self.stale_ttl)
+            self._quote = quote
+            return quote
+        finally:
+            if locked:
+                await self.cache.adelete(self.lock_key)
+
+    def refresh_in_background(self):
+        """
+        Не блокирует: если обновление уже идет, просто возвращается, так
+        что устаревший курс отдается сразу, в том числе из event loop.
+        """
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            threading.Thread(target=self._background_refresh,
+                             daemon=True).start()
+        except BaseException:
+            self._refreshing.release()
+            raise
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            # Запрос продолжает получать устаревший курс, поэтому сбой
+            # источника виден только в логе и метриках.
+            logger.exception('Background currency rate refresh failed')
+            background_failed('currency-rate-refresh')
+        finally:
+            self._refreshing.release()
+
+    def _from_shared(self):
+        return self._load(self.cache.get(self.cache_key))
+
+    async def _afrom_shared(self):
+        return self._load(await self.cache.aget(self.cache_key))
+
+    @staticmethod
+    def _load(cached):
+        if cached is None:
+            return None
+        return RateQuote(cached['rates'], cached['fetched_at'])
+
+    @staticmethod
+    def _dump(quote):
+        return {'rates': quote.rates, 'fetched_at': quote.fetched_at}
+
+    def _store(self, quote):
+        self.cache.set(self.cache_key, self._dump(quote), self.stale_ttl)
+        self._quote = quote
+        return quote
+
+    def _newest(self, *quotes):
+        quotes = [quote for quote in quotes if quote is not None]
+        if not quotes:
+            return None
+        self._quote = max(quotes, key=lambda quote: quote.fetched_at)
+        return self._quote
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def build_provider(config=None):
+    config = config or rates_settings()
+    source_class = import_string(config['SOURCE'])
+    return RateProvider(
+        source_class(**config['OPTIONS']),
+        ttl=config['TTL'],
+        stale_ttl=config['STALE_TTL'],
+        cache_alias=config['CACHE_ALIAS'],
+        cache_key=config['CACHE_KEY'],
+        lock_timeout=config['LOCK_TIMEOUT'],
+    )
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = build_provider()
+    return _provider
+
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
+
+
+def get_rate_quote():
+    return get_provider().get()
+
+
+async def aget_rate_quote():
+    return await get_provider().aget()
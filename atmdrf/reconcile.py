@@ -0,0 +1,267 @@
+import gzip
+import json
+import time
+from itertools import groupby, islice, repeat
+from operator import itemgetter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, F, Q, Sum, Value, \
+    When
+
+from .archive import archive_settings
+from .journal import flush_local
+from .models import ATM, ATMShard, ArchiveIndex, Card, Transaction
+from .snapshots import TYPE_FIELDS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULTS = {
+    'CHUNK_SIZE': 200000,
+    'MAX_REPORTED': 1000,
+}
+
+CREDIT_TYPES = [name for name, (field, sign) in TYPE_FIELDS.items()
+                if sign > 0]
+DEBIT_TYPES = [name for name, (field, sign) in TYPE_FIELDS.items()
+               if sign < 0]
+
+# Сумма чанка через bincount (float64) точна, пока не превышает 2**53.
+EXACT_FLOAT = 2 ** 53
+
+
+def reconcile_settings():
+    return {**DEFAULTS, **getattr(settings, 'RECONCILIATION', {})}
+
+
+def signed_value():
+    return Case(
+        When(type_transaction__in=CREDIT_TYPES, then=F('value')),
+        When(type_transaction__in=DEBIT_TYPES, then=-F('value')),
+        default=Value(0),
+        output_field=BigIntegerField(),
+    )
+
+
+class CardIndex:
+    """
+    Факторизация номеров карт: номер из журнала переводится в позицию
+    массивов одним map(dict.get) на чанк, суммы по позициям считаются
+    bincount'ом.
+    """
+
+    def __init__(self, chunk_size):
+        self.numbers, balances = [], []
+        for number, balance in Card.objects.order_by(
+                'card_number').values_list('card_number', 'balance') \
+                .iterator(chunk_size=chunk_size):
+            self.numbers.append(number)
+            balances.append(balance)
+        self.positions = {number: position
+                          for position, number in enumerate(self.numbers)}
+        self.balances = np.array(balances, dtype=np.int64)
+        self.sums = np.zeros(len(self.numbers), dtype=np.int64)
+        self.rows = np.zeros(len(self.numbers), dtype=np.int64)
+        self.unattributed_rows = 0
+        self.unattributed_sum = 0
+
+    def add(self, rows):
+        """
+        Сложение чанка пар (номер карты или None, сумма со знаком).
+        """
+        values = np.fromiter(map(itemgetter(1), rows), dtype=np.int64,
+                             count=len(rows))
+        positions = np.fromiter(
+            map(self.positions.get, map(itemgetter(0), rows), repeat(-1)),
+            dtype=np.intp, count=len(rows))
+        found = positions >= 0
+        if not found.all():
+            self.unattributed_rows += int((~found).sum())
+            self.unattributed_sum += int(values[~found].sum())
+            positions, values = positions[found], values[found]
+        size = len(self.numbers)
+        self.rows += np.bincount(positions, minlength=size)
+        if len(values) and \
+                int(np.abs(values).max()) * len(values) < EXACT_FLOAT:
+            self.sums += np.bincount(positions, weights=values,
+                                     minlength=size).astype(np.int64)
+        else:
+            np.add.at(self.sums, positions, values)
+
+    def discrepancies(self):
+        return np.flatnonzero(self.sums != self.balances)
+
+
+def chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def scan_journal(index, chunk_size):
+    """
+    Горячий журнал одним проходом: знак суммы считает БД, в Python
+    приходят только пары (карта, сумма), которые сразу уходят в NumPy.
+    chunked_cursor на PostgreSQL - серверный курсор, память ограничена
+    чанком.
+    """
+    sql, params = Transaction.objects.annotate(
+        signed=signed_value()).values_list('card_id', 'signed') \
+        .order_by().query.sql_with_params()
+    total = 0
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            index.add(chunk)
+            total += len(chunk)
+    return total
+
+
+def archived_records(chunk_size):
+    """
+    Строки (карта, тип, сумма) из архивных сегментов, по индексу
+    gzip-member'ов; каждый файл открывается один раз.
+    """
+    root = Path(archive_settings()['ROOT'])
+    entries = ArchiveIndex.objects.order_by(
+        'segment_id', 'offset').values_list(
+        'segment__path', 'offset', 'length').iterator(chunk_size=chunk_size)
+    for path, members in groupby(entries, key=lambda entry: entry[0]):
+        with open(root / path, 'rb') as segment:
+            for _, offset, length in members:
+                segment.seek(offset)
+                data = gzip.decompress(segment.read(length))
+                for line in data.splitlines():
+                    row = json.loads(line)
+                    yield row[6], row[2], row[5]
+
+
+def scan_archive(index, chunk_size):
+    """
+    Архив одним проходом; заодно считает поповнення и зняття для
+    сверки наличных.
+    """
+    signs = {name: sign for name, (field, sign) in TYPE_FIELDS.items()}
+    cash = {'Поповнення': 0, 'Зняття готівки': 0}
+    total = 0
+    for chunk in chunks(archived_records(chunk_size), chunk_size):
+        index.add([(card_id, signs.get(type_transaction, 0) * value)
+                   for card_id, type_transaction, value in chunk])
+        for card_id, type_transaction, value in chunk:
+            if type_transaction in cash:
+                cash[type_transaction] += value
+        total += len(chunk)
+    return total, cash
+
+
+def recheck(card_number, archived):
+    """
+    Повторная проверка карты с блокировкой ее строки: операции леджера
+    меняют баланс и пишут журнал в одной транзакции под этой же
+    блокировкой, поэтому расхождение из-за гонки со сканом исчезает.
+    """
+    with transaction.atomic():
+        balance = Card.objects.select_for_update().filter(
+            pk=card_number).values_list('balance', flat=True).first()
+        if balance is None:
+            return None
+        journal = Transaction.objects.filter(card_id=card_number).aggregate(
+            total=Sum(signed_value()))['total'] or 0
+    return balance, journal + archived
+
+
+def cash_report(archived_cash):
+    """
+    Наличные всех банкоматов против движения наличных по журналу:
+    начальная наличность + поповнення - зняття. Журнал не хранит
+    банкомат операции, поэтому сверка общая по всем банкоматам.
+    """
+    totals = Transaction.objects.aggregate(
+        deposits=Sum('value', filter=Q(type_transaction='Поповнення')),
+        withdrawals=Sum('value', filter=Q(type_transaction='Зняття готівки')),
+    )
+    deposits = (totals['deposits'] or 0) + archived_cash['Поповнення']
+    withdrawals = (totals['withdrawals'] or 0) + \
+        archived_cash['Зняття готівки']
+    cash = ATMShard.objects.aggregate(total=Sum('balance'))['total'] or 0
+    openings = list(ATM.objects.values_list('opening_balance', flat=True))
+    report = {
+        'atms': len(openings),
+        'cash': cash,
+        'deposits': deposits,
+        'withdrawals': withdrawals,
+    }
+    if None in openings:
+        report['status'] = 'unknown'
+        report['detail'] = 'Не задано початкову готівку банкоматів'
+        return report
+    expected = sum(openings) + deposits - withdrawals
+    report.update(opening=sum(openings), expected=expected,
+                  difference=cash - expected,
+                  status='ok' if cash == expected else 'mismatch')
+    return report
+
+
+def reconcile(chunk_size=None, max_reported=None, log=None):
+    """
+    Сверка балансов карт с журналом (горячая таблица и архив) и
+    наличных банкоматов с движением наличных. Память ограничена
+    массивами по числу карт и одним чанком журнала.
+    """
+    if np is None:
+        raise RuntimeError('Для звірки потрібен numpy')
+    config = reconcile_settings()
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+    max_reported = config['MAX_REPORTED'] \
+        if max_reported is None else max_reported
+    log = log or (lambda message: None)
+    flush_local()
+    started = time.perf_counter()
+    index = CardIndex(chunk_size)
+    log(f'{len(index.numbers)} карт')
+    hot_rows = scan_journal(index, chunk_size)
+    log(f'{hot_rows} транзакцій у журналі')
+    hot_sums = index.sums.copy()
+    archived_rows, archived_cash = scan_archive(index, chunk_size)
+    log(f'{archived_rows} транзакцій в архіві')
+    scanned = time.perf_counter() - started
+    discrepancies = []
+    for position in index.discrepancies():
+        card_number = str(index.numbers[position])
+        checked = recheck(card_number,
+                          int(index.sums[position] - hot_sums[position]))
+        if checked is None or checked[0] == checked[1]:
+            continue
+        balance, journal = checked
+        discrepancies.append({
+            'card': card_number,
+            'balance': balance,
+            'journal': journal,
+            'difference': balance - journal,
+            'rows': int(index.rows[position]),
+        })
+    elapsed = time.perf_counter() - started
+    return {
+        'cards': len(index.numbers),
+        'rows': hot_rows + archived_rows,
+        'archived_rows': archived_rows,
+        'unattributed_rows': index.unattributed_rows,
+        'unattributed_sum': index.unattributed_sum,
+        'scan_seconds': round(scanned, 3),
+        'rows_per_second': round((hot_rows + archived_rows) / scanned)
+        if scanned else None,
+        'seconds': round(elapsed, 3),
+        'discrepancy_count': len(discrepancies),
+        'discrepancies': discrepancies[:max_reported],
+        'cash': cash_report(archived_cash),
+    }
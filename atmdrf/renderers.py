@@ -0,0 +1,45 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson пишет 1e16 и 1e-7, json - 1e+16 и 1e-07: такие числа (и похожие
+# строки, что только лишний раз включает медленный путь) уходят в json.
+EXPONENT = re.compile(rb'\de-?\d')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson: тот же компактный UTF-8 JSON, но в разы
+    быстрее на больших списках. Без orjson, с отступами (indent) или при
+    ensure_ascii работает как обычный JSONRenderer. Вывод побайтно
+    совпадает с JSONRenderer, кроме NaN и бесконечностей: orjson пишет
+    null там, где JSONRenderer со STRICT_JSON падает.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or \
+                not self.compact or \
+                self.get_indent(accepted_media_type,
+                                renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            # Даты отдаются в encoder_class, чтобы формат совпадал с DRF.
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        if EXPONENT.search(ret):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        # Как и JSONRenderer, экранируем U+2028/U+2029 для JavaScript.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028') \
+                .replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -1,6 +1,122 @@
-from rest_framework import serializers
+from decimal import Decimal
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
 from .models import *
+from .money import format_minor, to_major
+from .rates import get_rate_quote
+
+
+class MinorUnitsField(serializers.Field):
+    """
+    Сумма хранится в копейках/центах, а в API отдается строкой в
+    основных единицах, как DecimalField.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return str(to_major(value))
+
+
+# Поля, у которых to_representation не меняет значение из БД.
+PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField,
+                serializers.BooleanField, serializers.ChoiceField,
+                serializers.PrimaryKeyRelatedField)
+
+
+def iso_datetime(tz):
+    def convert(value):
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            return value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def converter_factory(field):
+    """
+    Фабрика преобразования значения колонки в значение поля; None -
+    значение выводится как есть. Фабрика вызывается раз на
+    сериализацию (часовой пояс запроса), преобразование - на строку.
+    """
+    if isinstance(field, PLAIN_FIELDS):
+        return None
+    if isinstance(field, MinorUnitsField):
+        return lambda: format_minor
+    if isinstance(field, serializers.DateTimeField) and \
+            not hasattr(field, 'timezone') and \
+            getattr(field, 'format', api_settings.DATETIME_FORMAT) == \
+            ISO_8601:
+        def make():
+            tz = field.default_timezone()
+            return field.to_representation if tz is None \
+                else iso_datetime(tz)
+        return make
+    return lambda: field.to_representation
+
+
+class ValuesSerializer:
+    """
+    Сериализатор только для чтения поверх .values(): дает тот же JSON,
+    что model_serializer, но без экземпляров моделей и обхода объектов
+    полей на каждую строку. План (имя, колонка, преобразование)
+    строится один раз на класс.
+    """
+    model_serializer = None
+    extra_columns = ()
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def get_plan(cls):
+        plan = cls.__dict__.get('_plan')
+        if plan is None:
+            serializer = cls.model_serializer()
+            model = serializer.Meta.model
+            plan = cls._plan = tuple(
+                (name, model._meta.get_field(field.source).attname,
+                 converter_factory(field))
+                for name, field in serializer.fields.items()
+                if not field.write_only
+            )
+        return plan
+
+    @classmethod
+    def values(cls, queryset):
+        columns = [column for name, column, make in cls.get_plan()]
+        return queryset.values(*dict.fromkeys(columns + list(
+            cls.extra_columns)))
+
+    @classmethod
+    def converters(cls):
+        return tuple((name, column, make and make())
+                     for name, column, make in cls.get_plan())
+
+    @staticmethod
+    def represent(row, converters):
+        return {name: value if convert is None or value is None
+                else convert(value)
+                for name, column, convert in converters
+                for value in (row[column],)}
+
+    @property
+    def data(self):
+        converters = self.converters()
+        if self.many:
+            represent = self.represent
+            return [represent(row, converters) for row in self.instance]
+        return self.represent(self.instance, converters)
+
+
+def amount_field():
+    return serializers.DecimalField(max_digits=14, decimal_places=2,
+                                    min_value=Decimal('0.01'))
 
 
 class UserListSerializer(serializers.ModelSerializer):
@@ -35,6 +151,8 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 
 
 class UserChangePinSerializer(serializers.ModelSerializer):
+    password = serializers.CharField(max_length=4,
+                                     style={'input_type': 'password'})
     pin1 = serializers.CharField(max_length=4, min_length=4,
                                  style={'input_type': 'password'})
     pin2 = serializers.CharField(max_length=4, min_length=4,
@@ -65,12 +183,25 @@ class UserIsOwnerDetailSerializer(serializers.ModelSerializer):
                   'wallet')
 
 
+class UserBulkRegisterParamsSerializer(serializers.Serializer):
+    chunk_size = serializers.IntegerField(min_value=1, max_value=10000,
+                                          default=1000)
+    rows_format = serializers.ChoiceField(choices=('csv', 'jsonl'),
+                                          required=False)
+
+
 class WalletSerializer(serializers.ModelSerializer):
+    balance = MinorUnitsField()
+
     class Meta:
         model = Card
         fields = '__all__'
 
 
+class WalletValuesSerializer(ValuesSerializer):
+    model_serializer = WalletSerializer
+
+
 class CardCreateSerializer(serializers.ModelSerializer):
     user = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
@@ -79,6 +210,8 @@ class CardCreateSerializer(serializers.ModelSerializer):
         fields = ('currency', 'user')
 
     def create(self, validated_data):
+        validated_data = dict(validated_data)
+        validated_data['user_id'] = validated_data.pop('user').pk
         card = Card.objects.create(validated_data)
         return f'Нова карта {card.card_number} {card.currency} створена'
 
@@ -95,43 +228,64 @@ class CardBalanceSerializer(serializers.ModelSerializer):
         return instance.get_balance()
 
 
+class CardBalanceAsOfSerializer(serializers.Serializer):
+    card = serializers.CharField(max_length=16, min_length=16)
+    moment = serializers.DateTimeField()
+
+
+class CardTotalsSerializer(serializers.Serializer):
+    card = serializers.CharField(max_length=16, min_length=16)
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError(
+                'Початок періоду пізніше за його кінець')
+        return attrs
+
+
 class CardDepositSerializer(serializers.ModelSerializer):
     card = serializers.CharField(max_length=16, min_length=16)
-    deposit = serializers.IntegerField()
+    deposit = amount_field()
 
     class Meta:
         model = Card
         fields = ('card', 'deposit')
 
     def update(self, instance, validated_data):
-        result = instance.deposit(validated_data['deposit'])
-        instance.save()
+        result = instance.deposit(validated_data['deposit'],
+                                  self.context.get('atm_id'))
         return result
 
 
 class CardWithdrawSerializer(serializers.ModelSerializer):
     card = serializers.CharField(max_length=16, min_length=16)
-    withdraw = serializers.IntegerField()
+    withdraw = amount_field()
 
     class Meta:
         model = Card
         fields = ('card', 'withdraw')
 
     def update(self, instance, validated_data):
-        result = instance.withdraw(validated_data['withdraw'])
-        instance.save()
+        result = instance.withdraw(validated_data['withdraw'],
+                                   self.context.get('atm_id'))
         return result
 
 
 class CardSendMoneySerializer(serializers.ModelSerializer):
     card_sender = serializers.CharField(max_length=16, min_length=16)
     card_receiver = serializers.CharField(max_length=16, min_length=16)
-    send_money = serializers.IntegerField()
+    send_money = amount_field()
 
     class Meta:
         model = Card
         fields = ('card_sender', 'card_receiver', 'send_money')
 
+    @staticmethod
+    def prepare():
+        get_rate_quote()
+
     def update(self, instance, validated_data):
         receiver = Card.objects.get(card_number=validated_data['card_receiver'])
         result = instance.send_money(
@@ -141,7 +295,49 @@ class CardSendMoneySerializer(serializers.ModelSerializer):
         return result
 
 
+class SendBatchItemSerializer(serializers.Serializer):
+    card_receiver = serializers.CharField(max_length=16, min_length=16)
+    send_money = amount_field()
+
+
+class CardSendBatchSerializer(serializers.ModelSerializer):
+    card_sender = serializers.CharField(max_length=16, min_length=16)
+    items = SendBatchItemSerializer(many=True, allow_empty=False,
+                                    max_length=10000)
+
+    class Meta:
+        model = Card
+        fields = ('card_sender', 'items')
+
+    def prepare(self):
+        """
+        Курс нужен, только если среди карт пакета есть другая валюта:
+        один запрос валют карт вместо запроса курса на каждый пакет.
+        """
+        numbers = {item['card_receiver']
+                   for item in self.validated_data['items']}
+        numbers.add(self.validated_data['card_sender'])
+        currencies = Card.objects.filter(pk__in=numbers).values_list(
+            'currency', flat=True).order_by().distinct()
+        if len(currencies[:2]) > 1:
+            get_rate_quote()
+
+    def update(self, instance, validated_data):
+        return instance.send_batch(
+            (item['card_receiver'], item['send_money'])
+            for item in validated_data['items']
+        )
+
+
 class TransactionListSerializer(serializers.ModelSerializer):
+    value = MinorUnitsField()
+
     class Meta:
         model = Transaction
-        exclude = ('id', 'user')
+        exclude = ('id', 'user', 'card', 'rate_snapshot')
+
+
+class TransactionListValuesSerializer(ValuesSerializer):
+    model_serializer = TransactionListSerializer
+    # Ключ курсорной пагинации.
+    extra_columns = ('id',)
@@ -0,0 +1,181 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .journal import flush_local
+from .models import Checkpoint, DailyBalanceSnapshot, Transaction
+
+DEFAULTS = {
+    'BATCH_SIZE': 5000,
+    'SETTLE_SECONDS': 60,
+}
+
+CHECKPOINT = 'daily-snapshots'
+
+# Тип транзакции -> (поле снимка, знак изменения баланса карты).
+TYPE_FIELDS = {
+    'Поповнення': ('deposits', 1),
+    'Зняття готівки': ('withdrawals', -1),
+    'Переказ': ('sent', -1),
+    'Отримання': ('received', 1),
+}
+
+TOTAL_FIELDS = tuple(field for field, sign in TYPE_FIELDS.values())
+
+
+def snapshot_settings():
+    return {**DEFAULTS, **getattr(settings, 'BALANCE_SNAPSHOTS', {})}
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def watermark():
+    return Checkpoint.objects.filter(pk=CHECKPOINT).values_list(
+        'position', flat=True).first() or 0
+
+
+def empty_totals():
+    return dict.fromkeys(TOTAL_FIELDS, 0)
+
+
+def net(totals):
+    return sum(sign * totals[field] for field, sign in TYPE_FIELDS.values())
+
+
+def rollup(batch_size=None):
+    """
+    Одна порция инкрементального свертывания журнала в дневные снимки.
+    Берет записи с id выше контрольной точки подряд до первой записи
+    моложе SETTLE_SECONDS, чтобы не обогнать незакоммиченные транзакции:
+    контрольная точка - это id, и пропущенная запись с меньшим id уже
+    не попала бы в снимок. Возвращает число обработанных записей.
+    """
+    config = snapshot_settings()
+    batch_size = batch_size or config['BATCH_SIZE']
+    flush_local()
+    cutoff = timezone.now() - timedelta(seconds=config['SETTLE_SECONDS'])
+    with transaction.atomic():
+        checkpoint, _ = Checkpoint.objects.select_for_update().get_or_create(
+            pk=CHECKPOINT)
+        rows = list(
+            Transaction.objects.filter(id__gt=checkpoint.position)
+            .order_by('id')
+            .values_list('id', 'card_id', 'type_transaction', 'value',
+                         'date')[:batch_size]
+        )
+        for index, row in enumerate(rows):
+            if row[4] >= cutoff:
+                del rows[index:]
+                break
+        if not rows:
+            return 0
+        days = defaultdict(lambda: defaultdict(empty_totals))
+        for pk, card_id, type_transaction, value, date in rows:
+            if card_id is None or type_transaction not in TYPE_FIELDS:
+                continue
+            field = TYPE_FIELDS[type_transaction][0]
+            days[card_id][timezone.localdate(date)][field] += value
+        for card_id, totals in days.items():
+            _apply(card_id, totals)
+        checkpoint.position = rows[-1][0]
+        checkpoint.save(update_fields=['position', 'time_update'])
+    return len(rows)
+
+
+def _apply(card_id, totals):
+    first_day = min(totals)
+    previous = DailyBalanceSnapshot.objects.filter(
+        card_id=card_id, day__lt=first_day).order_by('-day').first()
+    existing = {snapshot.day: snapshot for snapshot in
+                DailyBalanceSnapshot.objects.filter(card_id=card_id,
+                                                    day__gte=first_day)}
+    closing = previous.closing_balance if previous else 0
+    delta = 0
+    changed, created = [], []
+    for day in sorted(set(totals) | set(existing)):
+        day_totals = totals.get(day, empty_totals())
+        delta += net(day_totals)
+        snapshot = existing.get(day)
+        if snapshot is None:
+            snapshot = DailyBalanceSnapshot(
+                card_id=card_id, day=day,
+                closing_balance=closing + net(day_totals))
+            created.append(snapshot)
+        else:
+            snapshot.closing_balance += delta
+            changed.append(snapshot)
+        for field, value in day_totals.items():
+            setattr(snapshot, field, getattr(snapshot, field) + value)
+        closing = snapshot.closing_balance
+    DailyBalanceSnapshot.objects.bulk_update(
+        changed, ('closing_balance',) + TOTAL_FIELDS)
+    DailyBalanceSnapshot.objects.bulk_create(created)
+
+
+def _tail_totals(queryset):
+    totals = empty_totals()
+    for type_transaction, value in queryset.values(
+            'type_transaction').annotate(total=Sum('value')).values_list(
+            'type_transaction', 'total').order_by():
+        if type_transaction in TYPE_FIELDS:
+            totals[TYPE_FIELDS[type_transaction][0]] += value
+    return totals
+
+
+def _archived_totals(card_number, date_from, date_to):
+    from .archive import card_rows
+    totals = empty_totals()
+    for type_transaction, value in card_rows(card_number, date_from,
+                                             date_to):
+        if type_transaction in TYPE_FIELDS:
+            totals[TYPE_FIELDS[type_transaction][0]] += value
+    return totals
+
+
+def balance_as_of(card_number, moment):
+    """
+    Баланс карты на момент moment: закрытие последнего снимка до дня
+    moment плюс хвост - записи этого дня до moment и еще не свернутые
+    записи предыдущих дней. Записи дня, уже ушедшие в архив, читаются
+    из архива.
+    """
+    day_start = start_of_day(timezone.localdate(moment))
+    snapshot = DailyBalanceSnapshot.objects.filter(
+        card_id=card_number, day__lt=day_start.date()
+    ).order_by('-day').values_list('closing_balance', flat=True).first()
+    journal = Transaction.objects.filter(card_id=card_number)
+    today = _tail_totals(journal.filter(date__gte=day_start,
+                                        date__lte=moment))
+    unrolled = _tail_totals(journal.filter(id__gt=watermark(),
+                                           date__lt=day_start))
+    archived = _archived_totals(card_number, day_start, moment)
+    return (snapshot or 0) + net(today) + net(unrolled) + net(archived)
+
+
+def totals_for_period(card_number, date_from, date_to):
+    """
+    Обороты карты по типам за дни [date_from, date_to] из снимков плюс
+    еще не свернутые записи, и балансы на начало и конец периода.
+    """
+    totals = DailyBalanceSnapshot.objects.filter(
+        card_id=card_number, day__gte=date_from, day__lte=date_to
+    ).aggregate(**{field: Sum(field) for field in TOTAL_FIELDS})
+    totals = {field: value or 0 for field, value in totals.items()}
+    period_start = start_of_day(date_from)
+    period_end = start_of_day(date_to + timedelta(days=1))
+    unrolled = _tail_totals(Transaction.objects.filter(
+        card_id=card_number, id__gt=watermark(),
+        date__gte=period_start, date__lt=period_end))
+    for field, value in unrolled.items():
+        totals[field] += value
+    totals['opening_balance'] = balance_as_of(
+        card_number, period_start - timedelta(microseconds=1))
+    totals['closing_balance'] = balance_as_of(
+        card_number, period_end - timedelta(microseconds=1))
+    return totals
@@ -0,0 +1,76 @@
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+from .archive import FIELDS, archive_boundary, archive_settings, \
+    decode_member, index_entries, row_matches
+from .models import Card, Transaction
+from .money import format_minor
+from .utils import filter_transactions, transaction_filters
+
+STATEMENT_FIELDS = ('date', 'type_transaction', 'sender', 'receiver',
+                    'value')
+
+
+def statement_queryset(user_id=None, card_number=None, params=None):
+    """
+    Выписка пользователя или карты в хронологическом порядке; фильтры
+    params те же, что у /log/ (type, date_from, date_to).
+    """
+    queryset = Transaction.objects.all()
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    if card_number is not None:
+        # Только записи, проведенные по этой карте: у перевода между
+        # картами одного владельца строка 'Переказ' принадлежит карте
+        # отправителя, а 'Отримання' - карте получателя.
+        queryset = queryset.filter(card_id=card_number)
+    queryset = filter_transactions(queryset, params or {})
+    return queryset.order_by('date', 'id').values_list(*STATEMENT_FIELDS)
+
+
+def statement_archive(user_id=None, card_number=None, params=None):
+    """
+    Архивные записи выписки в хронологическом порядке. Индекс читается
+    до начала потока (генератор ответа работает уже после middleware),
+    а gzip-member'ы распаковываются в генераторе по одному месяцу.
+    """
+    if not archive_boundary():
+        return ()
+    if user_id is None:
+        user_id = Card.objects.filter(pk=card_number).values_list(
+            'user_id', flat=True).first()
+    type_transaction, date_from, date_to = transaction_filters(params or {})
+    entries = list(index_entries(user_id, date_from=date_from,
+                                 date_to=date_to).order_by('segment__month'))
+    return archive_statement_rows(entries, card_number, type_transaction,
+                                  date_from, date_to)
+
+
+def archive_statement_rows(entries, card_number, type_transaction,
+                           date_from, date_to):
+    root = Path(archive_settings()['ROOT'])
+    positions = [FIELDS.index(field) for field in STATEMENT_FIELDS]
+    card_position = FIELDS.index('card_id')
+    for month, members in groupby(entries, key=itemgetter(0)):
+        rows = [
+            row for _, name, offset, length in members
+            for row in decode_member(str(root / name), offset, length)
+            if row_matches(row, type_transaction, date_from, date_to)
+            and (card_number is None or row[card_position] == card_number)
+        ]
+        rows.sort(key=itemgetter(1, 0))
+        for row in rows:
+            yield tuple(row[position] for position in positions)
+
+
+def statement_rows(queryset, chunk_size=5000, archived=()):
+    """
+    Строки выписки прямо из курсора БД, без моделей и сериализаторов DRF,
+    слитые по дате с архивными записями archived.
+    """
+    for date, type_transaction, sender, receiver, value in merge(
+            archived, queryset.iterator(chunk_size=chunk_size),
+            key=itemgetter(0)):
+        yield date, type_transaction, sender, receiver, format_minor(value)
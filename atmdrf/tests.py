@@ -1,3 +1,1146 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, SimpleTestCase, TestCase, \
+    TransactionTestCase, override_settings
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .apps import AtmdrfConfig
+from .allocator import HiLoSequence, format_card_number, format_iban, \
+    iban_check_digits, is_valid_card_number, is_valid_iban
+from .archive import archive_boundary, archive_month, decode_member
+from .authentication import CachedBasicAuthentication, \
+    ClaimsJWTAuthentication, ClaimsTokenObtainPairSerializer, \
+    TokenClaimsUser, TokenVersions
+from .database import ReplicaRouter, replica_reads_middleware, use_replica
+from .journal import Journal, JournalQueue
+from .ledger import ATMOutOfCash, InsufficientFunds, _take_cash, \
+    deposit, send_batch, withdraw
+from .models import *
+from .money import CURRENCIES, EXCHANGE_TABLE, Money, div_round, \
+    exchange_factors, exchange_matrix, exchange_minor, format_minor, \
+    scale_rates, to_minor
+from .onboarding import DEFAULT_PIN, bulk_register
+from .outbox import Relay, checkpoint_name
+from .rates import FixtureRateSource, RateProvider, RateQuote, \
+    get_rate_quote, set_provider
+from .reconcile import reconcile
+from .renderers import FastJSONRenderer
+from .snapshots import balance_as_of, rollup, start_of_day, watermark
+from .statements import statement_archive, statement_queryset
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def create_user(phone_number='+380000000001', **extra_fields):
+    return User.objects.create_user(first_name='Тарас', last_name='Шевченко',
+                                    phone_number=phone_number, **extra_fields)
+
+
+def create_card(user, currency='UAH', balance=0):
+    card = Card.objects.create({'currency': currency, 'user_id': user.pk})
+    if balance:
+        Card.objects.filter(pk=card.pk).update(balance=balance)
+        card.refresh_from_db()
+    return card
+
+
+class LedgerTestCase(TestCase):
+    def setUp(self):
+        set_provider(RateProvider(FixtureRateSource(), cache_key=self.id()))
+        self.user = create_user()
+        self.card = self.user.wallet.get()
+
+    def tearDown(self):
+        set_provider(None)
+
+
+class StatementTests(LedgerTestCase):
+    def test_transfer_between_own_cards(self):
+        other = create_card(self.user)
+        self.card.deposit('100.00')
+        self.card.refresh_from_db()
+        self.card.send_money('40.00', other)
+        rows = list(statement_queryset(self.user.pk, other.card_number))
+        self.assertEqual([(row[1], row[4]) for row in rows],
+                         [('Отримання', 4000)])
+        rows = list(statement_queryset(self.user.pk, self.card.card_number))
+        self.assertEqual([(row[1], row[4]) for row in rows],
+                         [('Поповнення', 10000), ('Переказ', 4000)])
+
+
+class TransactionLogTests(LedgerTestCase):
+    def test_log_rows_keep_their_fields(self):
+        self.card.deposit('10.00')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.settings(ROOT_URLCONF='atmdrf.urls'):
+            response = client.get('/log/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]),
+                         {'date', 'type_transaction', 'sender', 'receiver',
+                          'value'})
+
+
+class RecordingRateSource(FixtureRateSource):
+    """
+    Запоминает глубину вложенности atomic в момент запроса курса.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.depths = []
+
+    def fetch(self):
+        self.depths.append(len(connection.atomic_blocks))
+        return super().fetch()
+
+
+class SlowRateSource(FixtureRateSource):
+    """
+    Ждет release перед ответом, чтобы удержать refresh() внутри fetch().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def fetch(self):
+        self.started.set()
+        self.release.wait(5)
+        return super().fetch()
+
+
+class RateProviderTests(SimpleTestCase):
+    def setUp(self):
+        self.source = SlowRateSource()
+        self.provider = RateProvider(self.source, ttl=60,
+                                     cache_key=self.id())
+        self.stale = RateQuote(FixtureRateSource().fetch(),
+                               time.time() - 120)
+        self.provider._quote = self.stale
+
+    def tearDown(self):
+        self.source.release.set()
+
+    def test_stale_get_does_not_wait_for_fetch(self):
+        refresh = threading.Thread(target=self.provider.refresh)
+        refresh.start()
+        self.assertTrue(self.source.started.wait(5))
+        started = time.monotonic()
+        self.assertIs(self.provider.get(), self.stale)
+        self.assertLess(time.monotonic() - started, 1)
+        self.source.release.set()
+        refresh.join(5)
+        self.assertLess(self.provider.get().age, 60)
+
+    async def test_stale_aget_does_not_wait_for_fetch(self):
+        refresh = threading.Thread(target=self.provider.refresh)
+        refresh.start()
+        self.assertTrue(self.source.started.wait(5))
+        started = time.monotonic()
+        self.assertIs(await self.provider.aget(), self.stale)
+        self.assertLess(time.monotonic() - started, 1)
+        self.source.release.set()
+        refresh.join(5)
+
+
+@override_settings(ROOT_URLCONF='atmdrf.urls')
+class AsyncViewTests(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.card.deposit('25.00')
+        self.other = create_card(create_user('+380000000002'))
+        self.client = AsyncClient()
+        self.client.force_login(self.user)
+
+    async def test_currency_rate(self):
+        response = await AsyncClient().get('/async/currency-rate/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('usd_buy', response.json())
+        self.assertIn('Age', response.headers)
+
+    async def test_wallet_balance(self):
+        response = await self.client.post(
+            '/async/wallet/balance/', {'card': self.card.card_number},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         {'result': self.card.get_balance()})
+
+    async def test_wallet_balance_of_other_user(self):
+        response = await self.client.post(
+            '/async/wallet/balance/', {'card': self.other.card_number},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_log(self):
+        response = await self.client.get('/async/log/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    async def test_log_requires_authentication(self):
+        response = await AsyncClient().get('/async/log/')
+        self.assertIn(response.status_code, (401, 403))
+
+
+@override_settings(ROOT_URLCONF='atmdrf.urls')
+class IdempotencyTests(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.card.deposit('100.00')
+        self.receiver = create_card(create_user('+380000000002'), 'USD')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, amount, key):
+        return self.client.put('/wallet/send-money/', {
+            'card_sender': self.card.card_number,
+            'card_receiver': self.receiver.card_number,
+            'send_money': amount,
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_stored_response(self):
+        first = self.send('10.00', 'key-1')
+        second = self.send('10.00', 'key-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.filter(
+            type_transaction='Переказ').count(), 1)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, 9000)
+
+    def test_key_reused_with_other_body(self):
+        self.send('10.00', 'key-2')
+        response = self.send('20.00', 'key-2')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Transaction.objects.filter(
+            type_transaction='Переказ').count(), 1)
+
+    def test_rate_fetched_before_key_transaction(self):
+        source = RecordingRateSource()
+        set_provider(RateProvider(source, cache_key=self.id()))
+        depth = len(connection.atomic_blocks)
+        self.assertEqual(self.send('10.00', 'key-3').status_code, 200)
+        self.assertEqual(source.depths, [depth])
+
+
+class DatabaseTests(SimpleTestCase):
+    def test_app_config_is_installed(self):
+        self.assertIsInstance(apps.get_app_config('atmdrf'), AtmdrfConfig)
+
+    @skipIf(connection.vendor != 'sqlite', 'SQLite only')
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'WAL',
+                                       'synchronous': 'NORMAL'})
+    def test_sqlite_pragmas_are_applied_to_new_connections(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        default = connections['default']
+        wrapper = type(default)(
+            {**default.settings_dict, 'NAME': f'{root.name}/db.sqlite3'},
+            alias='pragmas')
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_router_sends_only_marked_reads_to_replica(self):
+        router = ReplicaRouter()
+        with mock.patch('atmdrf.database.replica_alias',
+                        return_value='replica'):
+            self.assertEqual(router.db_for_read(Transaction), 'default')
+            with use_replica():
+                self.assertEqual(router.db_for_read(Transaction), 'replica')
+                self.assertEqual(router.db_for_write(Transaction),
+                                 'default')
+        with mock.patch('atmdrf.database.replica_alias', return_value=None), \
+                use_replica():
+            self.assertEqual(router.db_for_read(Transaction), 'default')
+
+    @override_settings(DATABASE_ROUTING={'REPLICA_PATHS': (r'/log/$',)})
+    def test_middleware_marks_replica_paths(self):
+        router = ReplicaRouter()
+        seen = {}
+
+        def view(request):
+            seen[request.path] = router.db_for_read(Transaction)
+
+        middleware = replica_reads_middleware(view)
+        with mock.patch('atmdrf.database.replica_alias',
+                        return_value='replica'):
+            for path in ('/log/', '/wallet/'):
+                middleware(RequestFactory().get(path))
+        self.assertEqual(seen, {'/log/': 'replica', '/wallet/': 'default'})
+
+
+@override_settings(ROOT_URLCONF='atmdrf.urls')
+class PinAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.user.set_password('1234')
+        self.user.save()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+
+    def basic(self, pin):
+        credentials = b64encode(f'{self.user.username}:{pin}'.encode())
+        return f'Basic {credentials.decode()}'
+
+    def open_session(self):
+        response = self.client.post('/terminal/session/',
+                                    HTTP_AUTHORIZATION=self.basic('1234'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['type'], 'Terminal')
+        return f'Terminal {response.json()["token"]}'
+
+    def test_terminal_session_authenticates_without_pin(self):
+        session = self.open_session()
+        with mock.patch('rest_framework.authentication.authenticate') as pin:
+            response = self.client.get('/wallet/',
+                                       HTTP_AUTHORIZATION=session)
+        self.assertEqual(response.status_code, 200)
+        pin.assert_not_called()
+
+    def test_terminal_session_ends_with_pin_change(self):
+        session = self.open_session()
+        self.user.change_pin('1234', '4321', '4321')
+        response = self.client.get('/wallet/', HTTP_AUTHORIZATION=session)
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(PIN_AUTH={'SESSION_TTL': -1})
+    def test_expired_terminal_session(self):
+        session = self.open_session()
+        response = self.client.get('/wallet/', HTTP_AUTHORIZATION=session)
+        self.assertEqual(response.status_code, 401)
+
+    def test_basic_pin_check_is_cached(self):
+        authentication = CachedBasicAuthentication()
+        with mock.patch('rest_framework.authentication.authenticate',
+                        wraps=authenticate) as pin:
+            for _ in range(2):
+                user, _ = authentication.authenticate_credentials(
+                    self.user.username, '1234')
+                self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(pin.call_count, 1)
+
+    def test_cached_pin_check_ends_with_pin_change(self):
+        authentication = CachedBasicAuthentication()
+        authentication.authenticate_credentials(self.user.username, '1234')
+        self.user.change_pin('1234', '4321', '4321')
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            authentication.authenticate_credentials(self.user.username,
+                                                    '1234')
+
+    def test_wrong_pin_is_not_cached(self):
+        authentication = CachedBasicAuthentication()
+        for _ in range(2):
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                authentication.authenticate_credentials(
+                    self.user.username, '0000')
+
+
+@override_settings(
+    PASSWORD_HASHERS=['atmdrf.hashers.PinPBKDF2PasswordHasher'])
+class PinHasherTests(TestCase):
+    def test_iterations_come_from_pin_auth(self):
+        with self.settings(PIN_AUTH={'HASHER_ITERATIONS': 1500}):
+            encoded = make_password('1234')
+        self.assertTrue(encoded.startswith('pin_pbkdf2_sha256$1500$'))
+        self.assertTrue(check_password('1234', encoded))
+
+    def test_hash_is_upgraded_on_login(self):
+        user = create_user()
+        with self.settings(PIN_AUTH={'HASHER_ITERATIONS': 1000}):
+            user.set_password('1234')
+            user.save()
+        with self.settings(PIN_AUTH={'HASHER_ITERATIONS': 2000}):
+            self.assertIsNotNone(authenticate(username=user.username,
+                                              password='1234'))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pin_pbkdf2_sha256$2000$'))
+        self.assertTrue(user.check_password('1234'))
+
+    def test_wrong_pin_keeps_hash(self):
+        user = create_user()
+        with self.settings(PIN_AUTH={'HASHER_ITERATIONS': 1000}):
+            user.set_password('1234')
+            user.save()
+        with self.settings(PIN_AUTH={'HASHER_ITERATIONS': 2000}):
+            self.assertIsNone(authenticate(username=user.username,
+                                           password='0000'))
+        user.refresh_from_db()
+        self.assertIn('$1000$', user.password)
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.user.set_password('1234')
+        self.user.save()
+        key = TokenVersions.cache_key(self.user.pk)
+        cache.delete(key)
+        # Номера счетов повторяются в следующих тестах после отката.
+        self.addCleanup(cache.delete, key)
+        patcher = mock.patch('atmdrf.authentication._token_versions',
+                             TokenVersions())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def claims_token(self):
+        return ClaimsTokenObtainPairSerializer.get_token(
+            self.user).access_token
+
+    def test_cached_version_needs_no_queries(self):
+        token = self.claims_token()
+        self.authenticate(token)
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+        self.assertIsInstance(user, TokenClaimsUser)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_pin_change_revokes_token(self):
+        token = self.claims_token()
+        self.authenticate(token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.change_pin('1234', '4321', '4321')
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+        self.assertIsInstance(self.authenticate(self.claims_token()),
+                              TokenClaimsUser)
+
+    def test_deactivation_revokes_token(self):
+        token = self.claims_token()
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_hash_upgrade_on_login_keeps_token(self):
+        hashers = ['atmdrf.hashers.PinPBKDF2PasswordHasher']
+        with self.settings(PASSWORD_HASHERS=hashers,
+                           PIN_AUTH={'HASHER_ITERATIONS': 1000}):
+            self.user.set_password('1234')
+            self.user.save()
+        user = User.objects.get(pk=self.user.pk)
+        token = self.claims_token()
+        with self.settings(PASSWORD_HASHERS=hashers,
+                           PIN_AUTH={'HASHER_ITERATIONS': 2000}), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(user.check_password('1234'))
+        self.assertIn('$2000$', user.password)
+        self.assertEqual(self.authenticate(token).pk, self.user.pk)
+
+    def test_unrelated_change_keeps_token(self):
+        token = self.claims_token()
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Леся'
+        user.save()
+        self.assertEqual(self.authenticate(token).pk, self.user.pk)
+
+    def test_legacy_token_is_checked_against_database(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertNumQueries(1):
+            user = self.authenticate(token)
+        self.assertIsInstance(user, User)
+
+
+@override_settings(ROOT_URLCONF='atmdrf.urls')
+class OnboardingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(
+            first_name='Леся', last_name='Українка',
+            phone_number='+380000000009'))
+
+    def post(self, body, content_type, query=''):
+        response = self.client.post(f'/register/bulk/{query}', body,
+                                    content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in
+                b''.join(response.streaming_content).splitlines()]
+
+    def test_bulk_register_reports_each_row(self):
+        rows = [
+            {'first_name': 'Іван', 'last_name': 'Франко',
+             'phone_number': '+380000000010'},
+            {'first_name': '', 'last_name': 'Франко',
+             'phone_number': '+380000000011'},
+            {'first_name': 'Марко', 'last_name': 'Вовчок',
+             'phone_number': '+380000000012'},
+        ]
+        results = list(bulk_register(rows, chunk_size=2, processes=1))
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'error', 'created'])
+        self.assertIn('first_name', results[1]['errors'])
+        users = User.objects.filter(
+            username__in=[results[0]['login'], results[2]['login']])
+        self.assertEqual(len({user.password for user in users}), 2)
+        for user in users:
+            self.assertTrue(user.check_password(DEFAULT_PIN))
+            self.assertTrue(user.wallet.filter(
+                card_number=user.username).exists())
+
+    def test_ndjson_body_is_streamed(self):
+        body = '\n'.join(json.dumps({
+            'first_name': 'Іван', 'last_name': 'Франко',
+            'phone_number': f'+38000000002{index}'
+        }, ensure_ascii=False) for index in range(3))
+        results = self.post(body.encode(), 'application/x-ndjson',
+                            '?chunk_size=2')
+        self.assertEqual([result['row'] for result in results], [1, 2, 3])
+        self.assertTrue(all(result['status'] == 'created'
+                            for result in results))
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile(
+            'clients.csv', 'first_name,last_name,phone_number\n'
+            'Іван,Франко,+380000000030\n,Франко,+380000000031\n'
+            .encode())
+        response = self.client.post('/register/bulk/', {'file': upload},
+                                    format='multipart')
+        results = [json.loads(line) for line in
+                   b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'error'])
+
+    def test_shared_pin_hash_flag_is_ignored(self):
+        body = 'first_name,last_name,phone_number\n' + ''.join(
+            f'Іван,Франко,+38000000004{index}\n' for index in range(2))
+        results = self.post(body.encode(), 'text/csv', '?shared_pin_hash')
+        passwords = User.objects.filter(
+            username__in=[result['login'] for result in results]
+        ).values_list('password', flat=True)
+        self.assertEqual(len(set(passwords)), 2)
+
+
+@override_settings(ROOT_URLCONF='atmdrf.urls')
+class MetricsAccessTests(TestCase):
+    def test_localhost_is_not_trusted_by_default(self):
+        response = self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1')
+        self.assertIn(response.status_code, (401, 403))
+
+    @override_settings(METRICS={'TOKEN': 'scraper-secret'})
+    def test_token(self):
+        response = self.client.get('/metrics/',
+                                   HTTP_X_METRICS_TOKEN='wrong')
+        self.assertIn(response.status_code, (401, 403))
+        response = self.client.get('/metrics/',
+                                   HTTP_X_METRICS_TOKEN='scraper-secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class BenchSeedTests(TestCase):
+    def test_refuses_non_test_database(self):
+        with mock.patch('atmdrf.management.commands.bench_seed.'
+                        'is_test_database', return_value=False):
+            with self.assertRaises(CommandError):
+                call_command('bench_seed', users=1, transactions=1)
+
+    @skipIf(np is None, 'numpy не встановлено')
+    def test_seeded_data_reconciles(self):
+        call_command('bench_seed', users=5, transactions=200,
+                     chunk_size=50, stderr=io.StringIO())
+        report = reconcile()
+        self.assertEqual(report['discrepancy_count'], 0)
+        self.assertEqual(report['cash']['status'], 'ok')
+
+
+class CollectingSink:
+    def __init__(self):
+        self.offsets = []
+
+    def publish(self, events):
+        self.offsets.extend(event['offset'] for event in events)
+
+
+class OutboxRelayTests(TestCase):
+    def create_events(self, count):
+        return [LedgerEvent.objects.create(kind='deposit', card='1',
+                                           value=100).pk
+                for _ in range(count)]
+
+    def test_late_event_in_skipped_gap_is_published(self):
+        first, late, last = self.create_events(3)
+        LedgerEvent.objects.filter(pk=late).delete()
+        sink = CollectingSink()
+        relay = Relay([sink], gap_timeout=0)
+        relay.run_once()
+        self.assertEqual(sink.offsets, [first, last])
+        self.assertTrue(OutboxGap.objects.filter(first=late).exists())
+
+        LedgerEvent.objects.create(pk=late, kind='deposit', card='1',
+                                   value=100)
+        self.assertEqual(relay.run_once(), 1)
+        self.assertEqual(sink.offsets, [first, last, late])
+        self.assertFalse(OutboxGap.objects.exists())
+        self.assertEqual(relay.run_once(), 0)
+
+    def test_purge_keeps_events_of_lagging_consumer(self):
+        first, second, third = self.create_events(3)
+        Checkpoint.objects.create(pk=checkpoint_name(), position=third)
+        Checkpoint.objects.create(pk=checkpoint_name('local'),
+                                  position=first)
+        Checkpoint.objects.create(pk='daily-snapshots', position=0)
+        self.assertEqual(Relay([]).purge(retention=0), 1)
+        self.assertEqual(
+            list(LedgerEvent.objects.values_list('pk', flat=True)
+                 .order_by('pk')), [second, third])
+
+
+class JournalQueueTests(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.wal_path = Path(root.name) / 'journal.wal'
+
+    def queue(self):
+        # Сброс вызывает сам тест, фоновый поток не запускается.
+        with mock.patch.object(JournalQueue, '_run', lambda queue: None):
+            return JournalQueue(self.wal_path, batch_size=10,
+                                flush_interval=3600, segment_size=200)
+
+    def record(self, queue, value):
+        journal = Journal()
+        journal.record('Поповнення', None, self.card.pk, value,
+                       self.user.pk)
+        with mock.patch('atmdrf.journal.get_queue', return_value=queue), \
+                self.settings(TRANSACTION_JOURNAL={'ASYNC': True}):
+            journal.commit()
+
+    def test_flush_keeps_commit_order(self):
+        queue = self.queue()
+        for value in (3, 1, 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.record(queue, value)
+        self.assertFalse(Transaction.objects.exists())
+        queue.flush()
+        self.assertEqual(list(Transaction.objects.order_by('id')
+                              .values_list('value', flat=True)), [3, 1, 2])
+        self.assertFalse(JournalBatch.objects.exists())
+
+    def test_replay_after_crash(self):
+        queue = self.queue()
+        for value in (1, 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.record(queue, value)
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.record(queue, 3)
+            raise ValueError
+        queue._wal.close()
+        recovered = self.queue()
+        self.assertEqual(len(recovered), 2)
+        recovered.flush()
+        self.assertEqual(sorted(Transaction.objects.values_list(
+            'value', flat=True)), [1, 2])
+        recovered.close()
+        self.assertEqual(len(self.queue()), 0)
+
+
+@override_settings(ROOT_URLCONF='atmdrf.urls')
+class PaginationTests(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Пары записей с одной датой: курсор должен различать их по id.
+        moment = timezone.now() - timedelta(hours=1)
+        Transaction.objects.bulk_create([
+            Transaction(type_transaction='Поповнення',
+                        receiver=self.card.pk, card=self.card,
+                        value=100 * number, user=self.user,
+                        date=moment + timedelta(seconds=number // 2))
+            for number in range(1, 26)
+        ])
+        self.expected = [f'{number}.00' for number in range(25, 0, -1)]
+
+    def values(self, response):
+        return [row['value'] for row in response.json()['results']]
+
+    def test_cursor_round_trip(self):
+        values, url, pages = [], '/log/', 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.json())
+            values.extend(self.values(response))
+            url = response.json()['next']
+            pages += 1
+        self.assertEqual(values, self.expected)
+        self.assertEqual(pages, 3)
+
+    def test_bad_cursor(self):
+        for cursor in ('garbage', 'WzFd', 'eyJhIjogMX0='):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/log/?cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+    def test_page_number_fallback(self):
+        response = self.client.get('/log/?page=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 25)
+        self.assertEqual(self.values(response), self.expected[20:])
+        self.assertEqual(self.client.get('/log/?page=4').status_code, 404)
+
+
+@override_settings(ROOT_URLCONF='atmdrf.urls')
+class UserAdminTests(TestCase):
+    def setUp(self):
+        admin = create_user('+380000000100', is_staff=True)
+        for number in range(2, 13):
+            create_user(f'+3800000000{number:02}')
+        self.ibans = sorted(User.objects.values_list('iban', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def test_keyset_pages_by_iban(self):
+        ibans, url = [], '/user/?page_size=5'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.json())
+            results = response.json()['results']
+            self.assertLessEqual(len(results), 5)
+            self.assertNotIn('password', results[0])
+            ibans.extend(row['iban'] for row in results)
+            url = response.json()['next']
+        self.assertEqual(ibans, self.ibans)
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        counts = []
+        for page_size in (2, 12):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/user/?page_size={page_size}')
+            self.assertEqual(len(response.json()['results']), page_size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_export_ndjson(self):
+        response = self.client.get('/user/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('users.ndjson', response['Content-Disposition'])
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['iban'] for row in rows], self.ibans)
+        self.assertNotIn('password', rows[0])
+
+    def test_export_csv(self):
+        response = self.client.get('/user/export/?output=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertIn('iban', lines[0].split(','))
+        self.assertEqual(len(lines), len(self.ibans) + 1)
+
+    def test_export_requires_admin(self):
+        self.client.force_authenticate(create_user('+380000000099'))
+        self.assertEqual(self.client.get('/user/export/').status_code, 403)
+
+
+class SnapshotTests(LedgerTestCase):
+    def add(self, value, date, type_transaction='Поповнення'):
+        return Transaction.objects.create(
+            type_transaction=type_transaction, receiver=self.card.pk,
+            card=self.card, value=value, user=self.user, date=date).pk
+
+    def test_rollup_stops_at_first_unsettled_row(self):
+        old = start_of_day(timezone.localdate() - timedelta(days=2))
+        recent = self.add(100, timezone.now())
+        self.add(200, old)
+        self.assertEqual(rollup(), 0)
+        self.assertEqual(watermark(), 0)
+        Transaction.objects.filter(pk=recent).update(date=old)
+        self.assertEqual(rollup(), 2)
+        snapshot = DailyBalanceSnapshot.objects.get(card=self.card)
+        self.assertEqual((snapshot.deposits, snapshot.closing_balance),
+                         (300, 300))
+
+    def test_balance_as_of(self):
+        today = timezone.localdate()
+        first = start_of_day(today - timedelta(days=3))
+        second = start_of_day(today - timedelta(days=2))
+        self.add(1000, first + timedelta(hours=1))
+        self.add(300, second + timedelta(hours=1), 'Зняття готівки')
+        self.add(50, second + timedelta(hours=2))
+        moments = {
+            first: 0,
+            first + timedelta(hours=2): 1000,
+            second + timedelta(hours=1): 700,
+            second + timedelta(hours=3): 750,
+        }
+        for rolled in (False, True):
+            for moment, balance in moments.items():
+                with self.subTest(moment=moment, rolled=rolled):
+                    self.assertEqual(
+                        balance_as_of(self.card.pk, moment), balance)
+            rollup()
+
+
+class ArchiveTests(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        overridden = self.settings(TRANSACTION_ARCHIVE={'ROOT': root.name})
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.addCleanup(archive_boundary, refresh=True)
+        archive_boundary(refresh=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def archive_old_rows(self, count):
+        month = (timezone.localdate() - timedelta(days=800)).replace(day=1)
+        for day in range(1, count + 1):
+            Transaction.objects.create(
+                type_transaction='Поповнення', receiver=self.card.pk,
+                card=self.card, value=100 * day, user=self.user,
+                date=start_of_day(month.replace(day=day)))
+        rollup()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_month(month), count)
+
+    def get(self, path):
+        with self.settings(ROOT_URLCONF='atmdrf.urls'):
+            return self.client.get(path)
+
+    def test_short_page_without_archive_skips_archive_queries(self):
+        self.card.deposit('10.00')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.get('/log/').json()['results']), 1)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'archive' in query['sql'].lower()])
+
+    def test_round_trip(self):
+        self.archive_old_rows(3)
+        self.card.deposit('10.00')
+        self.assertEqual(
+            Transaction.objects.filter(user=self.user).count(), 1)
+
+        values = [row['value'] for row in
+                  self.get('/log/').json()['results']]
+        self.assertEqual(values, ['10.00', '3.00', '2.00', '1.00'])
+
+        page = self.get('/log/?page=1').json()
+        self.assertEqual(page['count'], 4)
+        self.assertEqual([row['value'] for row in page['results']], values)
+
+        response = self.get(f'/log/statement/?card={self.card.pk}'
+                            f'&output=ndjson')
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['value'] for row in rows],
+                         ['1.00', '2.00', '3.00', '10.00'])
+
+    def test_cursor_pages_continue_into_archive(self):
+        self.archive_old_rows(12)
+        for _ in range(5):
+            self.card.deposit('10.00')
+        values, url = [], '/log/'
+        while url:
+            page = self.get(url).json()
+            values.extend(row['value'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(values, ['10.00'] * 5 + [
+            f'{day}.00' for day in range(12, 0, -1)])
+
+    def test_statement_archive_decodes_members_lazily(self):
+        self.archive_old_rows(3)
+        with mock.patch('atmdrf.statements.decode_member',
+                        wraps=decode_member) as decode:
+            rows = statement_archive(self.user.pk)
+            self.assertEqual(decode.call_count, 0)
+            with self.assertNumQueries(0):
+                self.assertEqual([row[-1] for row in rows], [100, 200, 300])
+            self.assertEqual(decode.call_count, 1)
+
+
+class LedgerTests(LedgerTestCase):
+    def cash(self, atm):
+        return list(atm.shards.order_by('index')
+                    .values_list('balance', flat=True))
+
+    def test_withdraw_more_than_balance(self):
+        atm = ATM.objects.create(balance=1000)
+        deposit(self.card, 5000, atm.pk)
+        with self.assertRaises(InsufficientFunds):
+            withdraw(self.card, 5001, atm.pk)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, 5000)
+        self.assertEqual(atm.get_balance(), 105000)
+        self.assertFalse(Transaction.objects.filter(
+            type_transaction='Зняття готівки').exists())
+
+    def test_withdraw_more_than_atm_cash(self):
+        atm = ATM.objects.create(balance=10)
+        card = create_card(self.user, balance=5000)
+        with self.assertRaises(ATMOutOfCash):
+            withdraw(card, 2000, atm.pk)
+        card.refresh_from_db()
+        self.assertEqual(card.balance, 5000)
+        self.assertEqual(atm.get_balance(), 1000)
+        self.assertEqual(card.withdraw('20.00', atm.pk),
+                         'В банкоматі недостатньо готівки')
+
+    def test_take_cash_falls_back_to_other_shards(self):
+        atm = ATM.objects.create(shards=3)
+        for index, balance in enumerate((100, 300, 200)):
+            atm.shards.filter(index=index).update(balance=balance)
+        _take_cash(atm.pk, 50, 0)
+        self.assertEqual(self.cash(atm), [50, 300, 200])
+        _take_cash(atm.pk, 450, 0)
+        self.assertEqual(self.cash(atm), [50, 0, 50])
+        # Частичные списания откатывает транзакция операции.
+        with self.assertRaises(ATMOutOfCash), transaction.atomic():
+            _take_cash(atm.pk, 101, 2)
+        self.assertEqual(self.cash(atm), [50, 0, 50])
+
+
+
+class SendBatchTests(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = RecordingRateSource()
+        set_provider(RateProvider(self.source, cache_key=self.id()))
+
+    def test_partial_failures(self):
+        sender = create_card(self.user, balance=10000)
+        first = create_card(create_user('+380000000002'))
+        second = create_card(create_user('+380000000003'))
+        results = send_batch(sender, [
+            (first.pk, 6000),
+            ('0000000000000000', 100),
+            (sender.pk, 100),
+            (second.pk, 5000),
+            (second.pk, 3000),
+        ], get_rate_quote)
+        self.assertEqual([result.get('error') for result in results],
+                         [None, 'not_found', 'not_found',
+                          'insufficient_funds', None])
+        balances = dict(Card.objects.filter(
+            pk__in=[sender.pk, first.pk, second.pk]).values_list(
+            'card_number', 'balance'))
+        self.assertEqual(balances, {sender.pk: 1000, first.pk: 6000,
+                                    second.pk: 3000})
+        self.assertEqual(Transaction.objects.filter(
+            type_transaction='Переказ', sender=sender.pk).count(), 2)
+
+    def test_rate_is_fetched_only_for_cross_currency_items(self):
+        sender = create_card(self.user, balance=10000)
+        receiver = create_card(create_user('+380000000002'))
+        sender.send_batch([(receiver.pk, '10.00')])
+        self.assertEqual(self.source.depths, [])
+
+        dollars = create_card(create_user('+380000000003'), 'USD')
+        results = sender.send_batch([(receiver.pk, '10.00'),
+                                     (dollars.pk, '41.10')])
+        self.assertEqual(len(self.source.depths), 1)
+        self.assertEqual(results[1]['result'],
+                         f'Успішний переказ на {dollars.pk} 1.00 USD')
+
+    def test_quote_matrix_and_snapshot_are_reused(self):
+        sender = create_card(self.user, balance=100000)
+        dollars = create_card(create_user('+380000000002'), 'USD')
+        euros = create_card(create_user('+380000000003'), 'EUR')
+        items = [(dollars.pk, '41.10'), (euros.pk, '41.10'),
+                 (dollars.pk, '41.10')]
+        snapshot_table = RateSnapshot._meta.db_table
+        with mock.patch('atmdrf.rates.exchange_matrix',
+                        wraps=exchange_matrix) as matrix:
+            for batch in range(2):
+                with CaptureQueriesContext(connection) as queries, \
+                        self.captureOnCommitCallbacks(execute=True):
+                    results = sender.send_batch(items)
+                self.assertTrue(all(result['ok'] for result in results))
+                self.assertEqual(len([
+                    query for query in queries.captured_queries
+                    if snapshot_table in query['sql']
+                    and query['sql'].startswith('SELECT')
+                ]), 0 if batch else 1)
+        self.assertEqual(matrix.call_count, 1)
+        self.assertEqual(RateSnapshot.objects.count(), 1)
+        snapshot_ids = set(Transaction.objects.filter(
+            sender=sender.pk).values_list('rate_snapshot_id', flat=True))
+        self.assertEqual(snapshot_ids, {RateSnapshot.objects.get().pk})
+
+
+class MoneyTests(SimpleTestCase):
+    rates = scale_rates(FixtureRateSource().fetch())
+
+    def test_to_minor_rounds_half_up(self):
+        self.assertEqual(to_minor('0.005'), 1)
+        self.assertEqual(to_minor('0.004'), 0)
+        self.assertEqual(to_minor('-0.005'), -1)
+        self.assertEqual(to_minor(Decimal('10.125')), 1013)
+        self.assertEqual(to_minor(7), 700)
+        self.assertEqual(format_minor(-1013), '-10.13')
+
+    def test_div_round(self):
+        self.assertEqual([div_round(value, 2) for value in (4, 5, 7)],
+                         [2, 3, 4])
+        self.assertEqual(div_round(5, 3), 2)
+        self.assertEqual(div_round(4, 3), 1)
+
+    @skipIf(np is None, 'numpy не встановлено')
+    def test_div_round_numpy(self):
+        self.assertEqual(div_round(np.array([4, 5, 7]), 2).tolist(),
+                         [2, 3, 4])
+
+    def test_exchange_matrix(self):
+        matrix = exchange_matrix(CURRENCIES, self.rates)
+        uah, usd, eur = (CURRENCIES.index(currency)
+                         for currency in ('UAH', 'USD', 'EUR'))
+        self.assertEqual(matrix[usd][usd], (1, 1))
+        self.assertEqual(matrix[usd][eur],
+                         exchange_factors('USD', 'EUR', self.rates))
+        # 100.00 грн по продажу 41.10 = 2.43 USD; 1 USD по купівлі 40.40.
+        self.assertEqual(exchange_minor(10000, 'UAH', 'USD', self.rates),
+                         243)
+        self.assertEqual(exchange_minor(100, 'USD', 'UAH', self.rates),
+                         4040)
+        self.assertEqual(exchange_minor(100, 'USD', 'EUR', self.rates), 94)
+
+    def test_cross_rate_through_uah(self):
+        table = {pair: factors for pair, factors in EXCHANGE_TABLE.items()
+                 if pair != ('USD', 'EUR')}
+        with mock.patch.dict(EXCHANGE_TABLE, table, clear=True):
+            matrix = exchange_matrix(CURRENCIES, self.rates)
+        numerator, denominator = matrix[CURRENCIES.index('USD')][
+            CURRENCIES.index('EUR')]
+        # 1.00 USD -> 40.40 грн -> 0.90 EUR, одне округлення.
+        self.assertEqual(div_round(100 * numerator, denominator), 90)
+
+    def test_money_is_immutable(self):
+        money = Money.from_major('10.50')
+        with self.assertRaises(AttributeError):
+            money.amount = 0
+        with self.assertRaises(AttributeError):
+            del money.currency
+        self.assertEqual({money: 1}[Money(1050, 'UAH')], 1)
+        self.assertEqual(money + Money(50), Money(1100))
+        with self.assertRaises(ValueError):
+            money + Money(50, 'USD')
+
+
+@skipIf(orjson is None, 'orjson is not installed')
+class FastJSONRendererTests(SimpleTestCase):
+    def test_output_matches_json_renderer(self):
+        payloads = [
+            {'next': None, 'results': [{
+                'id': 1, 'type_transaction': 'Поповнення',
+                'value': '10.00 UAH', 'date': timezone.now(),
+                'day': timezone.localdate(), 'amount': Decimal('1.10'),
+            }]},
+            {'usd_buy': '40.40000', 'age': 0.0, 'ratio': 1.5},
+            {'small': 1e-7, 'large': 1e16, 'text': '1e5'},
+            ['line\u2028separator\u2029', '"quoted"\n', True, 2 ** 70],
+            {1: {'nested': [None, 0, -1]}},
+            [],
+        ]
+        for data in payloads:
+            with self.subTest(data=data):
+                self.assertEqual(FastJSONRenderer().render(data),
+                                 JSONRenderer().render(data))
+
+
+class NumberAllocatorTests(TestCase):
+    def test_luhn(self):
+        self.assertTrue(is_valid_card_number('4111111111111111'))
+        self.assertTrue(is_valid_card_number('79927398713'))
+        self.assertFalse(is_valid_card_number('4111111111111112'))
+        number = format_card_number(42, '4149')
+        self.assertEqual(len(number), 16)
+        self.assertTrue(number.startswith('4149'))
+        self.assertTrue(is_valid_card_number(number))
+
+    def test_iban_mod_97(self):
+        self.assertEqual(iban_check_digits('GB', 'WEST12345698765432'),
+                         '82')
+        self.assertTrue(is_valid_iban('GB82WEST12345698765432'))
+        self.assertFalse(is_valid_iban('GB83WEST12345698765432'))
+        iban = format_iban(42, 'UA', '300000')
+        self.assertEqual(len(iban), 29)
+        self.assertTrue(is_valid_iban(iban))
+
+    def test_numbers_do_not_overflow_their_fields(self):
+        self.assertEqual(len(format_card_number(10 ** 11 - 1, '4149')), 16)
+        with self.assertRaises(ValueError):
+            format_card_number(10 ** 11, '4149')
+        with self.assertRaises(ValueError):
+            format_iban(10 ** 19, 'UA', '300000')
+
+    def test_rolled_back_numbers_are_not_cached(self):
+        sequence = HiLoSequence('test-rollback', block_size=100)
+        try:
+            with transaction.atomic():
+                taken = sequence.take(2)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(sequence.take(3), taken + [taken[-1] + 1])
+        self.assertEqual(NumberSequence.objects.get(
+            name='test-rollback').next_value, taken[0] + 3)
+
+
+class NumberBlockTests(TransactionTestCase):
+    def test_block_is_reserved_outside_transactions(self):
+        sequence = HiLoSequence('test-block', block_size=100)
+        first = sequence.take()
+        with self.assertNumQueries(0):
+            second = sequence.take(99)
+        self.assertEqual(first + second, list(range(first[0],
+                                                    first[0] + 100)))
+        self.assertEqual(NumberSequence.objects.get(
+            name='test-block').next_value, first[0] + 100)
+
+    def test_block_is_reserved_outside_caller_transaction(self):
+        sequence = HiLoSequence('test-outer', block_size=100)
+        # Не SQLite: блок резервируется на отдельном соединении.
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                self.assertRaises(RuntimeError), transaction.atomic():
+            taken = sequence.take(2)
+            raise RuntimeError
+        self.assertEqual(NumberSequence.objects.get(
+            name='test-outer').next_value, taken[0] + 100)
+        with self.assertNumQueries(0):
+            self.assertEqual(sequence.take(), [taken[-1] + 1])
@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework import routers
 
 from .views import *
+from . import async_views
 
 router = routers.SimpleRouter()
 router.register(r'user', UserViewSet)
@@ -11,6 +12,13 @@ urlpatterns = [
     path('', include(router.urls)),
     path('', UserIsOwnerViewSet.as_view()),
     path('log/', TransactionListAPIView.as_view()),
+    path('log/statement/', TransactionStatementAPIView.as_view()),
     path('register/', UserRegisterAPIView.as_view()),
+    path('register/bulk/', UserBulkRegisterAPIView.as_view()),
     path('currency-rate/', CurrencyRate.as_view()),
+    path('terminal/session/', TerminalSessionAPIView.as_view()),
+    path('metrics/', MetricsAPIView.as_view()),
+    path('async/currency-rate/', async_views.currency_rate),
+    path('async/wallet/balance/', async_views.wallet_balance),
+    path('async/log/', async_views.transaction_log),
 ]
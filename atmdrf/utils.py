@@ -1,40 +1,242 @@
-import requests
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime, time
 
+from asgiref.sync import sync_to_async
+from django.db.models import Q
 from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 
 from .serializers import *
+from .archive import ArchivedHistory, archive_boundary, archive_needed, \
+    known_boundary, merge_archived
+from .idempotency import idempotent
 
 
-def get_currency_rate():
-    exchange_rate_json = requests.get(
-        'https://api.privatbank.ua/p24api/pubinfo?json&exchange&coursid=5'
-    ).json()
-    usd_buy = exchange_rate_json[0]['buy']
-    usd_sale = exchange_rate_json[0]['sale']
-    eur_buy = exchange_rate_json[1]['buy']
-    eur_sale = exchange_rate_json[1]['sale']
-    rates = {
-        'usd_buy': usd_buy,
-        'usd_sale': usd_sale,
-        'eur_buy': eur_buy,
-        'eur_sale': eur_sale
-    }
-    return rates
+class TransactionPagination(PageNumberPagination):
+    """
+    Постраничный режим истории: count и страницы включают архив.
+    """
+    page_size = 10
 
+    def paginate_queryset(self, queryset, request, view=None):
+        boundary = archive_boundary()
+        if boundary:
+            type_transaction, date_from, date_to = transaction_filters(
+                request.query_params)
+            queryset = ArchivedHistory(
+                queryset, boundary, request.user.pk,
+                type_transaction=type_transaction, date_from=date_from,
+                date_to=date_to)
+        return super().paginate_queryset(queryset, request, view)
 
-class TransactionPagination(PageNumberPagination):
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная пагинация по ключу сортировки: следующая страница
+    выбирается условием WHERE (key) < (last key), а не OFFSET, и без
+    COUNT(*), поэтому страница N стоит столько же, сколько первая.
+    """
     page_size = 10
+    page_size_query_param = None
+    max_page_size = 500
+    ordering = ('-pk',)
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Невірний курсор'
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, page_size = self.page_queryset(queryset, request)
+        return self.page_rows(list(queryset), page_size)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset, page_size = self.page_queryset(queryset, request)
+        return self.page_rows([row async for row in queryset], page_size)
+
+    def page_queryset(self, queryset, request):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor))
+        return queryset.order_by(*self.ordering)[:page_size + 1], page_size
+
+    def page_rows(self, rows, page_size):
+        self.next_position = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_position = [self.key_value(rows[-1], name)
+                                  for name in self.key_fields()]
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def key_fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    @staticmethod
+    def key_value(row, name):
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
+
+    def after(self, cursor):
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, cursor):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    @staticmethod
+    def encode_value(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def encode_cursor(self, position):
+        raw = json.dumps(position, default=self.encode_value)
+        return urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+            fields = [model._meta.pk if name == 'pk'
+                      else model._meta.get_field(name)
+                      for name in self.key_fields()]
+            if len(position) != len(fields):
+                raise ValueError
+            return [field.to_python(value)
+                    for field, value in zip(fields, position)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+
+class TransactionKeysetPagination(KeysetPagination):
+    """
+    История пользователя: когда страница доходит до границы архива,
+    она дополняется транзакциями из архивных сегментов.
+    """
+    page_size = 10
+    ordering = ('-date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, page_size = self.page_queryset(queryset, request)
+        return self.page_rows(self.with_archive(list(queryset), request,
+                                                page_size), page_size)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset, page_size = self.page_queryset(queryset, request)
+        rows = [row async for row in queryset]
+        boundary = known_boundary()
+        if boundary is None or archive_needed(rows, page_size + 1,
+                                              boundary):
+            rows = await sync_to_async(self.with_archive)(rows, request,
+                                                          page_size)
+        return self.page_rows(rows, page_size)
+
+    def with_archive(self, rows, request, page_size):
+        type_transaction, date_from, date_to = transaction_filters(
+            request.query_params)
+        return merge_archived(
+            rows, request.user.pk, page_size + 1,
+            tuple(self.cursor) if self.cursor is not None else None,
+            type_transaction=type_transaction, date_from=date_from,
+            date_to=date_to)
+
+
+class UserKeysetPagination(KeysetPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    ordering = ('iban',)
+
+
+def parse_moment(value, end=False):
+    day = parse_date(value)
+    if day is not None:
+        moment = datetime.combine(day, time.max if end else time.min)
+    else:
+        moment = parse_datetime(value)
+    if moment is None:
+        raise ValidationError({'date': f'Невірна дата {value}'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def transaction_filters(params):
+    date_from, date_to = params.get('date_from'), params.get('date_to')
+    return (params.get('type') or None,
+            parse_moment(date_from) if date_from else None,
+            parse_moment(date_to, end=True) if date_to else None)
+
+
+def filter_transactions(queryset, params):
+    """
+    Фильтры истории по типу и диапазону дат; все они обслуживаются
+    индексом (user, -date, -id).
+    """
+    type_transaction, date_from, date_to = transaction_filters(params)
+    if type_transaction:
+        queryset = queryset.filter(type_transaction=type_transaction)
+    if date_from is not None:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date__lte=date_to)
+    return queryset
 
 
 class ViewSetMixin:
     @staticmethod
     def put_mixin(request, serializer_class, field):
-        serializer = serializer_class(data=request.data)
+        """
+        serializer.prepare(), если он есть, вызывается до транзакции
+        операции (см. idempotent).
+        """
+        serializer = serializer_class(
+            data=request.data,
+            context={'request': request,
+                     'atm_id': getattr(request.user, 'atm_id', None)}
+        )
         serializer.is_valid(raise_exception=True)
-        instance = Card.objects.get(card_number=serializer.data.get(field))
-        if instance.user == request.user:
-            result = serializer.update(instance, serializer.validated_data)
-            return Response({'result': result})
-        raise Http404
+
+        def perform():
+            instance = Card.objects.get(card_number=serializer.data.get(field))
+            if instance.user_id == request.user.pk:
+                result = serializer.update(instance,
+                                           serializer.validated_data)
+                return Response({'result': result})
+            raise Http404
+
+        return idempotent(request, serializer.validated_data, perform,
+                          getattr(serializer, 'prepare', None))
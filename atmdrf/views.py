@@ -1,25 +1,66 @@
-from django.http import Http404
+import json
+
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from rest_framework import generics, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAdminUser
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenObtainPairView
 
 from .serializers import *
-from .permissions import IsOwnerAccount, IsAnonymous
+from .permissions import IsOwnerAccount, IsAnonymous, IsMetricsScraper
 from .models import *
-from .utils import ViewSetMixin, TransactionPagination, get_currency_rate
+from .utils import ViewSetMixin, TransactionPagination, \
+    TransactionKeysetPagination, UserKeysetPagination, filter_transactions
+from .rates import get_rate_quote
+from .authentication import CachedBasicAuthentication, \
+    ClaimsTokenObtainPairSerializer, get_user_instance, issue_terminal_session
+from .balances import get_card_balance
+from .export import streaming_export
+from .metrics import registry
+from .money import to_major
+from .snapshots import balance_as_of, totals_for_period
+from .statements import STATEMENT_FIELDS, statement_archive, \
+    statement_queryset, statement_rows
+from .onboarding import bulk_register, read_rows, text_lines
+
+
+USER_LIST_FIELDS = [field.name for field in User._meta.concrete_fields
+                    if field.name not in UserListSerializer.Meta.exclude]
 
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserDetailSerializer
     permission_classes = (IsAdminUser,)
+    pagination_class = UserKeysetPagination
+    export_chunk_size = 2000
+
+    def get_queryset(self):
+        if self.action == 'list':
+            return User.objects.only(*USER_LIST_FIELDS)
+        return User.objects.prefetch_related(
+            Prefetch('wallet',
+                     queryset=Card.objects.only('card_number', 'user_id')),
+            'groups', 'user_permissions'
+        )
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        serializer = UserListSerializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(queryset)
+        serializer = UserListSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False)
+    def export(self, request):
+        rows = User.objects.order_by('iban').values_list(
+            *USER_LIST_FIELDS).iterator(chunk_size=self.export_chunk_size)
+        return streaming_export(rows, USER_LIST_FIELDS,
+                                request.query_params.get('output', 'ndjson'),
+                                'users')
 
 
 class UserRegisterAPIView(generics.CreateAPIView):
@@ -39,11 +80,43 @@ class UserRegisterAPIView(generics.CreateAPIView):
         })
 
 
+class UserBulkRegisterAPIView(APIView):
+    """
+    Анкеты читаются из тела запроса построчно, результаты отдаются
+    потоком по мере создания пачек. Каждая пачка - своя транзакция в
+    основной БД, поэтому генератору ответа middleware не нужны.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def post(self, request, *args, **kwargs):
+        params = UserBulkRegisterParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError({'file': 'Файл з анкетами не передано'})
+            binary, name = upload, upload.name
+        else:
+            binary, name = request.stream or (), ''
+        fmt = params.validated_data.get('rows_format') or (
+            'jsonl' if name.endswith(('.jsonl', '.ndjson')) or
+            'ndjson' in request.content_type else 'csv')
+        results = bulk_register(
+            read_rows(text_lines(binary), fmt),
+            chunk_size=params.validated_data['chunk_size']
+        )
+        return StreamingHttpResponse(
+            (json.dumps(result, ensure_ascii=False) + '\n'
+             for result in results),
+            content_type='application/x-ndjson'
+        )
+
+
 class UserIsOwnerViewSet(generics.RetrieveUpdateAPIView):
     permission_classes = (IsOwnerAccount,)
 
     def get_queryset(self):
-        return self.request.user
+        return get_user_instance(self.request.user)
 
     def get_serializer(self, *args, **kwargs):
         if self.request.method == 'PUT':
@@ -63,18 +136,36 @@ class UserIsOwnerViewSet(generics.RetrieveUpdateAPIView):
         return Response({'result': result})
 
 
+class ClaimsTokenObtainPairView(TokenObtainPairView):
+    serializer_class = ClaimsTokenObtainPairSerializer
+
+
+class TerminalSessionAPIView(APIView):
+    authentication_classes = (CachedBasicAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    @staticmethod
+    def post(request):
+        token, ttl = issue_terminal_session(request.user)
+        return Response({'token': token, 'type': 'Terminal',
+                         'expires_in': ttl})
+
+
 class UserWalletViewSet(ViewSetMixin, viewsets.ModelViewSet):
     permission_classes = (IsOwnerAccount,)
 
     def get_queryset(self):
-        user = self.request.user
-        return user.wallet.all()
+        return Card.objects.filter(user_id=self.request.user.pk)
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return CardCreateSerializer
         return WalletSerializer
 
+    def list(self, request, *args, **kwargs):
+        rows = WalletValuesSerializer.values(self.get_queryset())
+        return Response(WalletValuesSerializer(rows, many=True).data)
+
     def create(self, request, *args, **kwargs):
         serializer = CardCreateSerializer(data=request.data,
                                           context={'request': request})
@@ -87,12 +178,50 @@ class UserWalletViewSet(ViewSetMixin, viewsets.ModelViewSet):
         serializer = CardBalanceSerializer(data=request.data,
                                            context={'request': request})
         serializer.is_valid(raise_exception=True)
-        instance = Card.objects.get(card_number=serializer.data.get('card'))
-        if instance.user == request.user:
+        entry = get_card_balance(serializer.validated_data['card'])
+        if entry is not None and entry['user_id'] == request.user.pk:
+            instance = Card(card_number=entry['card_number'],
+                            balance=entry['balance'],
+                            currency=entry['currency'],
+                            user_id=entry['user_id'])
             result = serializer.get_balance(instance)
             return Response({'result': result})
         raise Http404
 
+    def get_owned_currency(self, card_number):
+        currency = Card.objects.filter(
+            pk=card_number, user_id=self.request.user.pk
+        ).values_list('currency', flat=True).first()
+        if currency is None:
+            raise Http404
+        return currency
+
+    @action(methods=['POST'], detail=False, url_path='balance-as-of')
+    def balance_as_of(self, request):
+        serializer = CardBalanceAsOfSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        card_number = serializer.validated_data['card']
+        currency = self.get_owned_currency(card_number)
+        balance = balance_as_of(card_number,
+                                serializer.validated_data['moment'])
+        return Response({'result': {
+            'balance': str(to_major(balance, currency)),
+            'currency': currency,
+        }})
+
+    @action(methods=['POST'], detail=False)
+    def totals(self, request):
+        serializer = CardTotalsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        currency = self.get_owned_currency(data['card'])
+        totals = totals_for_period(data['card'], data['date_from'],
+                                   data['date_to'])
+        result = {key: str(to_major(value, currency))
+                  for key, value in totals.items()}
+        result['currency'] = currency
+        return Response({'result': result})
+
     @action(methods=['PUT'], detail=False)
     def deposit(self, request):
         return self.put_mixin(request, CardDepositSerializer, 'card')
@@ -105,19 +234,65 @@ class UserWalletViewSet(ViewSetMixin, viewsets.ModelViewSet):
     def send_money(self, request):
         return self.put_mixin(request, CardSendMoneySerializer, 'card_sender')
 
+    @action(methods=['PUT'], detail=False, url_path='send-batch')
+    def send_batch(self, request):
+        return self.put_mixin(request, CardSendBatchSerializer, 'card_sender')
+
 
 class TransactionListAPIView(generics.ListAPIView):
     permission_classes = (IsOwnerAccount,)
-    serializer_class = TransactionListSerializer
-    pagination_class = TransactionPagination
+    serializer_class = TransactionListValuesSerializer
+    pagination_class = TransactionKeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if 'page' in self.request.query_params:
+                self._paginator = TransactionPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
-        user = self.request.user
-        return user.transaction.all()
+        return TransactionListValuesSerializer.values(filter_transactions(
+            Transaction.objects.filter(user_id=self.request.user.pk),
+            self.request.query_params
+        ))
+
+
+class TransactionStatementAPIView(APIView):
+    permission_classes = (IsOwnerAccount,)
+    chunk_size = 5000
+
+    def get(self, request):
+        params = request.query_params
+        card_number = params.get('card')
+        if card_number is not None and not Card.objects.filter(
+                pk=card_number, user_id=request.user.pk).exists():
+            raise Http404
+        queryset = statement_queryset(request.user.pk, card_number, params)
+        # Поток читается уже после выхода из middleware, поэтому БД
+        # (реплика) фиксируется здесь.
+        queryset = queryset.using(queryset.db)
+        archived = statement_archive(request.user.pk, card_number, params)
+        return streaming_export(
+            statement_rows(queryset, self.chunk_size, archived),
+            STATEMENT_FIELDS,
+            params.get('output', 'csv'), f'statement-{card_number or "all"}'
+        )
 
 
 class CurrencyRate(APIView):
     @staticmethod
     def get(request):
-        currency_rate = get_currency_rate()
-        return Response(currency_rate)
+        quote = get_rate_quote()
+        return Response(quote.as_dict(), headers={'Age': str(int(quote.age))})
+
+
+class MetricsAPIView(APIView):
+    permission_classes = (IsMetricsScraper,)
+
+    @staticmethod
+    def get(request):
+        return HttpResponse(registry.exposition(),
+                            content_type='text/plain; version=0.0.4')